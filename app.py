@@ -1,11 +1,15 @@
-import dash, json, requests
-from dash import callback, callback_context
+import json, os, requests, time
+from dash import callback, callback_context, ClientsideFunction
 import dash_bootstrap_components as dbc
 from dash_extensions.enrich import DashProxy, Output, Input, State, html, dcc, \
     ServersideOutputTransform
 
-from src.edgar_ui import explore_edgar
+from src.edgar_ui import explore_edgar, biolink_index
 from src.bring_your_own_data import byo_layout
+from src.jobs import start_workers
+from src.metrics import instrument_server, observe
+from src.transfer import init_transfer
+from src.typeahead import init_typeahead, add_curie
 
 
 app = DashProxy(
@@ -14,10 +18,14 @@ app = DashProxy(
     transforms=[ServersideOutputTransform()],
     suppress_callback_exceptions=True,
     external_stylesheets=[dbc.themes.MATERIA, dbc.icons.FONT_AWESOME, dbc.themes.BOOTSTRAP],
-    use_pages=True
+    use_pages=True,
+    compress=True
 )
 
 server = app.server
+instrument_server(server)
+init_transfer(server)
+init_typeahead(server, biolink_index.valid_predicates)
 app.title = 'EDGAR'
 app._favicon = 'Logo.ico'
 
@@ -77,11 +85,14 @@ sidebar = html.Div([
 ############# Normalization ########################
 def resolvename(name):
     name_resolver_url = f'https://name-resolution-sri.renci.org/lookup?string={name}&offset=0&limit=2'
+    start_time = time.time()
     res = requests.post(name_resolver_url).json()
+    observe('edgar_upstream_seconds', time.time() - start_time, service='name_resolution')
     curie = ''
     for rs in res:
         if rs['label']==name or rs['label'].lower() == name.lower():
             curie = rs['curie']
+            add_curie(curie, rs['label'])
             break
     return curie
 
@@ -209,16 +220,12 @@ def display_content(pathname):
         return about
 
 
-@app.callback( [Output("modal", "is_open"), Output("open", "n_clicks")], [Input("open", "n_clicks"), Input("close", "n_clicks")], [State("modal", "is_open")])
-def toggle_modal(n1, n2, is_open):
-    changed_id = [p['prop_id'] for p in dash.callback_context.triggered][0]
-    if "close" in changed_id:
-        return False, {"display": "none"}
-
-    if n1 or n2:
-        return not is_open, {}
-
-    return is_open, {}
+app.clientside_callback(
+    ClientsideFunction(namespace='edgar', function_name='toggle_modal'),
+    [Output("modal", "is_open"), Output("open", "n_clicks")],
+    [Input("open", "n_clicks"), Input("close", "n_clicks")],
+    [State("modal", "is_open")]
+)
 
 
 ####### NameResolver CALLBACK #######################################
@@ -240,4 +247,7 @@ def normalizeterm(searchterm, click):
 
 #### Visualize the Output ######
 if __name__ == "__main__":
+    # with the reloader on, only the child process that actually serves requests starts the compute workers
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_workers(int(os.environ.get('EDGAR_COMPUTE_WORKERS', 2)))
     app.run_server(debug=True)
@@ -0,0 +1,105 @@
+// typeahead: which /typeahead index each input searches, and the last keystroke sent per input
+const TYPEAHEAD_KINDS = {
+    'source-suggestions': 'curie', 'target-suggestions': 'curie',
+    'source_dropdown': 'category', 'target_dropdown': 'category', 'via_dropdown': 'category',
+    'predicate_dropdown': 'predicate', 'via_predicate_dropdown': 'predicate'
+};
+const TYPEAHEAD_DELAY = 120;
+const typeaheadClient = Math.random().toString(36).slice(2);
+const typeaheadSeq = {};
+
+// the categories a predicate dropdown's options are filtered by, as filter_predicate_options does
+function predicateCategories(field, source, via, target) {
+    if (field === 'via_predicate_dropdown') {
+        return {source: via || '', target: target || ''};
+    }
+    if (field === 'predicate_dropdown') {
+        return {source: source || '', target: via || target || ''};
+    }
+    return {};
+}
+
+async function typeahead(field, query, extra) {
+    const seq = (typeaheadSeq[field] || 0) + 1;
+    typeaheadSeq[field] = seq;
+    await new Promise(resolve => setTimeout(resolve, TYPEAHEAD_DELAY));
+    if (typeaheadSeq[field] !== seq) {
+        throw window.dash_clientside.PreventUpdate;
+    }
+    const params = new URLSearchParams({q: query, field: field, seq: seq, client: typeaheadClient, ...extra});
+    const response = await fetch(`/typeahead/${TYPEAHEAD_KINDS[field]}?${params}`);
+    // 204: the server already saw a newer keystroke from this input
+    if (response.status !== 200 || typeaheadSeq[field] !== seq) {
+        throw window.dash_clientside.PreventUpdate;
+    }
+    return response.json();
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    edgar: {
+        toggle_modal: function (n1, n2, is_open) {
+            const triggered = dash_clientside.callback_context.triggered.map(t => t.prop_id);
+            if (triggered.length && triggered[0].includes('close')) {
+                return [false, {'display': 'none'}];
+            }
+            if (n1 || n2) {
+                return [!is_open, {}];
+            }
+            return [is_open, {}];
+        },
+
+        toggle_parameters: function (n_clicks, visible, source_value, target_value, predicate) {
+            const hidden = {'display': 'none'};
+            const error = function (children) {
+                return {namespace: 'dash_html_components', type: 'Span', props: {children: children, style: {'color': 'red'}}};
+            };
+            if (n_clicks > 0) {
+                if (Boolean(source_value) === Boolean(target_value) || !predicate) {
+                    return [hidden, visible, error('One "biolink" compliant Curie, a return Categories and Predicate is required')];
+                }
+                const curie = source_value ? source_value : target_value;
+                if (!curie.includes(':')) {
+                    const br = {namespace: 'dash_html_components', type: 'Br', props: {}};
+                    const link = {namespace: 'dash_core_components', type: 'Link', props: {children: 'Name->Curie on the sidebar', href: '/normalize_node'}};
+                    return [hidden, visible, error([`${curie} is not "biolink" compliant, e.g., MONDO:0004975`, br, br, 'See ', link, ' for more details.'])];
+                }
+                visible = !visible;
+            }
+            return [{'display': visible ? 'block' : 'none'}, visible, ''];
+        },
+
+        normalize_checklist: function (inferred_values) {
+            if (inferred_values.length !== 1) {
+                return ['graph', 'property'];
+            }
+            return inferred_values;
+        },
+
+        suggest_curies: async function (value) {
+            const field = dash_clientside.callback_context.outputs_list.id;
+            if (!value || value.length < 2) {
+                return [];
+            }
+            const suggestions = await typeahead(field, value);
+            return suggestions.map(s => ({namespace: 'dash_html_components', type: 'Option', props: {value: s.value, children: s.label}}));
+        },
+
+        suggest_options: async function (search_value, value, example_query, source, via, target) {
+            // an example query pins the choices; an empty search keeps the full list
+            if (!search_value || example_query) {
+                throw window.dash_clientside.PreventUpdate;
+            }
+            const field = dash_clientside.callback_context.outputs_list.id;
+            const options = await typeahead(field, search_value, predicateCategories(field, source, via, target));
+            if (value && !options.some(option => option.value === value)) {
+                options.unshift({label: value, value: value});
+            }
+            return options;
+        },
+
+        echo_query: function (selected_query, source_value, predicate_value, target_value) {
+            const show = value => (value === null || value === undefined) ? 'None' : value;
+            return `Selected Query: ${show(selected_query)}, Source: ${show(source_value)}, Predicate: ${show(predicate_value)}, Target: ${show(target_value)}`;
+        }
+    }
+});
@@ -0,0 +1,67 @@
+# Production server: gunicorn --config gunicorn.conf.py app:server
+import os
+import subprocess
+import sys
+import threading
+
+bind = os.environ.get('EDGAR_BIND', '0.0.0.0:8050')
+
+# each web worker keeps its own answer sets in memory (EDGAR_STATE_BUDGET_MB), so size workers by memory as well as cores
+workers = int(os.environ.get('EDGAR_WEB_WORKERS', os.cpu_count()))
+# callbacks spend most of their time in SQLite, file reads and numpy, so a few threads per worker keep the cores busy
+worker_class = 'gthread'
+threads = int(os.environ.get('EDGAR_WEB_THREADS', 4))
+
+# import the app (Biolink model, predicate index, typeahead vocabulary) once in the master; workers share it copy-on-write
+preload_app = os.environ.get('EDGAR_PRELOAD', '1') != '0'
+
+# AnswerCoalesce runs in the compute workers, but name resolution and big answer-set loads still happen in requests
+timeout = int(os.environ.get('EDGAR_WEB_TIMEOUT', 300))
+# let in-flight requests finish on restart or scale-down
+graceful_timeout = int(os.environ.get('EDGAR_GRACEFUL_TIMEOUT', 120))
+keepalive = 5
+
+# recycle workers now and then so fragmented heaps are handed back; jitter keeps them from restarting together
+max_requests = int(os.environ.get('EDGAR_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+
+accesslog = os.environ.get('EDGAR_ACCESS_LOG', '-') or None
+
+compute_workers = int(os.environ.get('EDGAR_COMPUTE_WORKERS', 2))
+# how often the master checks that the compute tier is still there
+COMPUTE_SUPERVISE_INTERVAL = 5
+
+
+def start_compute(server):
+    server.compute = subprocess.Popen([sys.executable, '-m', 'src.jobs', '--workers', str(compute_workers)],
+                                      cwd=os.path.dirname(os.path.abspath(__file__)))
+    server.log.info(f"Started {compute_workers} compute workers (pid {server.compute.pid})")
+
+
+def supervise_compute(server):
+    # without the compute tier the site would keep queueing queries that never run
+    while not server.compute_stopping.wait(COMPUTE_SUPERVISE_INTERVAL):
+        if server.compute.poll() is not None:
+            # the arbiter reaps every child, so the exit status is not ours to read
+            server.log.warning(f"Compute tier (pid {server.compute.pid}) exited, restarting it")
+            start_compute(server)
+
+
+def when_ready(server):
+    # the compute tier runs beside the web workers unless EDGAR_COMPUTE_WORKERS=0 (e.g. it has its own container)
+    if compute_workers:
+        server.compute_stopping = threading.Event()
+        start_compute(server)
+        threading.Thread(target=supervise_compute, args=(server,), name='edgar-compute-supervisor', daemon=True).start()
+
+
+def on_exit(server):
+    compute = getattr(server, 'compute', None)
+    if compute is not None:
+        server.compute_stopping.set()
+        # the workers finish their current jobs; a job cut off at the deadline is requeued when its lease lapses
+        compute.terminate()
+        try:
+            compute.wait(graceful_timeout)
+        except subprocess.TimeoutExpired:
+            compute.kill()
@@ -0,0 +1,28 @@
+import logging
+import os
+import time
+import requests
+from src.utils import LoggingUtil
+from src.metrics import observe
+
+this_dir = os.path.dirname(os.path.realpath(__file__))
+
+logger = LoggingUtil.init_logging('answercoalesce', level=logging.WARNING, format='long', logFilePath=this_dir + '/')
+
+AC_URL = os.environ.get('EDGAR_AC_URL', "https://answercoalesce.renci.org/query")
+# seconds to connect, and to wait for the answer; a hung call must not hold a compute worker forever
+AC_TIMEOUT = (10, float(os.environ.get('EDGAR_AC_TIMEOUT', 900)))
+
+
+def send_post_request(data):
+    start_time = time.time()  # Record start time
+    status = 'error'
+    try:
+        response = requests.post(AC_URL, json=data, timeout=AC_TIMEOUT)
+        status = response.status_code
+        response.raise_for_status()  # Raise an HTTPError if the HTTP request returned an unsuccessful status code
+    finally:
+        elapsed_time = time.time() - start_time  # Calculate elapsed time
+        observe('edgar_upstream_seconds', elapsed_time, service='answercoalesce', status=status)
+    logger.info(f"Time taken for POST request: {elapsed_time} seconds", extra={'duration': elapsed_time})
+    return response.content
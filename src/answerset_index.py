@@ -0,0 +1,155 @@
+import math
+import sys
+from bisect import bisect_right
+
+SUPPORT_GRAPHS = "biolink:support_graphs"
+P_VALUE = "biolink:p_value"
+
+# Edge roles within an inference's support graphs
+INFERENCE = 'inference'
+ENRICHMENT2GROUP = 'enrichment2group'
+GROUP2CURIE = 'group2curie'
+
+
+def get_inference_edges( results ):
+    # multi-hop results share edges, so each inference is listed once, in first-seen order
+    return list(dict.fromkeys(edge_id for result in results for edge_id in result_inference_edges(result)))
+
+
+def result_inference_edges( result ):
+    return [edge[0]['id'] for _, edge in result["analyses"][0]["edge_bindings"].items()]
+
+
+def get_support_graphs( kg_edge ):
+    return [attributes["value"] for attributes in kg_edge.get("attributes", []) if
+            attributes["attribute_type_id"] == SUPPORT_GRAPHS]
+
+
+def attribute_role( values ):
+    # enrichment->group edges point at their own support graphs (a list); group->curie edges carry plain values
+    if not values:
+        return None
+    return ENRICHMENT2GROUP if isinstance(values[0], list) else GROUP2CURIE
+
+
+def edge_role( kg_edge ):
+    return attribute_role([attributes["value"] for attributes in kg_edge.get("attributes") or []])
+
+
+def enrichment_method( aux_graph_id ):
+    # Still a string-prefix heuristic: AnswerCoalesce's responses carry no attribute, qualifier or edge shape telling
+    # graph from property enrichment, only its naming of graph-enrichment support graphs with an 'e' prefix. This is
+    # the one place that guess is made; replace it here once AnswerCoalesce reports the method.
+    return 'graph' if aux_graph_id.startswith('e') else 'property'
+
+
+def classify_support_graph( aux_graph_edges, kg_edges, edge_roles ):
+    enrich2group_aux_graph_edge = ''
+    group2curie_aux_graph_edge = ''
+    for aedge in aux_graph_edges:
+        if aedge not in edge_roles:
+            # role places the edge in its support graph; panel is what clicking the drawn edge opens, which only
+            # edges carrying biolink:support_graphs have
+            edge_roles[aedge] = {'role': edge_role(kg_edges[aedge]),
+                                 'panel': attribute_role(get_support_graphs(kg_edges[aedge]))}
+        role = edge_roles[aedge]['role']
+        if role == ENRICHMENT2GROUP:
+            enrich2group_aux_graph_edge = aedge
+        elif role == GROUP2CURIE:
+            group2curie_aux_graph_edge = aedge
+    return enrich2group_aux_graph_edge, group2curie_aux_graph_edge
+
+
+def support_graph_pvalues( enrichment2group_edge, group2curie_edge, kg_edges, aux_graphs ):
+    # the enrichment edges are the ones of the nested graphs that do not touch the lookup terminals
+    terminals = {group2curie_edge['subject'], group2curie_edge['object']}
+    pvalues = set()
+    for enrichment2group_support_graphs in get_support_graphs(enrichment2group_edge):
+        for e2group_sp in enrichment2group_support_graphs:
+            for e2gedge in aux_graphs[e2group_sp]["edges"]:
+                edge = kg_edges[e2gedge]
+                if edge["subject"] not in terminals and edge["object"] not in terminals:
+                    pvalues.update(att["value"] for att in edge["attributes"] if att['attribute_type_id'] == P_VALUE)
+    return sorted(pvalues)
+
+
+def enrichment_group( enrichment2group_edge, group2curie_edge ):
+    # the enriched node is the one the enrichment->group and group->curie edges share
+    shared = {enrichment2group_edge['subject'], enrichment2group_edge['object']} & \
+             {group2curie_edge['subject'], group2curie_edge['object']}
+    return min(shared) if shared else enrichment2group_edge['object']
+
+
+def build_support_index( kg_edges, results, aux_graphs ):
+    """ One pass over the inferences tagging every support graph and aux edge with its role and enrichment method """
+    inferences = {}
+    graph_roles = {}
+    edge_roles = {}
+    for inference_edge in get_inference_edges(results):
+        support_graphs = get_support_graphs(kg_edges[inference_edge])
+        inferences[inference_edge] = support_graphs
+        edge_roles[inference_edge] = {'role': INFERENCE}
+        for graph in support_graphs:
+            if graph in graph_roles:
+                continue
+            method = enrichment_method(graph)
+            enrich2group, group2curie = classify_support_graph(aux_graphs[graph]["edges"], kg_edges, edge_roles)
+            pvalues = support_graph_pvalues(kg_edges[enrich2group], kg_edges[group2curie], kg_edges, aux_graphs) if \
+                enrich2group and group2curie else []
+            graph_roles[graph] = {'method': method, ENRICHMENT2GROUP: enrich2group, GROUP2CURIE: group2curie,
+                                  'pvalues': pvalues}
+            for aedge in aux_graphs[graph]["edges"]:
+                # an aux edge can sit in a graph-enrichment and a property-enrichment support graph at once
+                methods = edge_roles[aedge].setdefault('methods', [])
+                if method not in methods:
+                    methods.append(method)
+
+    return {'inferences': inferences, 'support_graphs': graph_roles, 'edges': edge_roles}
+
+
+def get_inference_methods( support_index, inference_edge ):
+    support_graphs = support_index['support_graphs']
+    return {support_graphs[graph]['method'] for graph in support_index['inferences'][inference_edge]}
+
+
+def fisher_combined_pvalue( pvalues ):
+    # chi-square survival function with 2k degrees of freedom has a closed form, so no scipy is needed
+    if len(pvalues) == 1:
+        # exactly, not through exp(log(p)), so an inference sitting on the threshold is not cut
+        return pvalues[0]
+    if 0 in pvalues:
+        return 0.0
+    statistic = -sum(math.log(pvalue) for pvalue in pvalues)
+    term = total = 1.0
+    for i in range(1, len(pvalues)):
+        term *= statistic / i
+        total += term
+    return min(1.0, math.exp(-statistic) * total)
+
+
+def build_ranking_index( support_index ):
+    """ Inferences ordered by combined enrichment p-value, ties broken by the number of supporting paths """
+    support_graphs = support_index['support_graphs']
+    ranked = []
+    for inference_edge, graphs in support_index['inferences'].items():
+        best_pvalues = [support_graphs[graph]['pvalues'][0] for graph in graphs if support_graphs[graph]['pvalues']]
+        best = min(best_pvalues) if best_pvalues else 1.0
+        combined = fisher_combined_pvalue(best_pvalues) if best_pvalues else 1.0
+        ranked.append((combined, -len(graphs), best, inference_edge))
+    ranked.sort()
+
+    return {
+        'order': [inference_edge for *_, inference_edge in ranked],
+        'combined_pvalue': [combined for combined, *_ in ranked],
+        'best_pvalue': [best for _, _, best, _ in ranked],
+        'paths': [-paths for _, paths, _, _ in ranked],
+        'score': [round(-math.log10(max(combined, sys.float_info.min)), 3) for combined, *_ in ranked],
+    }
+
+
+def top_k( ranking_index, k ):
+    return ranking_index['order'][:k]
+
+
+def threshold_cut( ranking_index, pvalue_threshold ):
+    return ranking_index['order'][:bisect_right(ranking_index['combined_pvalue'], pvalue_threshold)]
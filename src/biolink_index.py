@@ -0,0 +1,128 @@
+import logging
+import os
+from functools import lru_cache
+import orjson
+from src.utils import LoggingUtil, DATA_DIR
+
+this_dir = os.path.dirname(os.path.realpath(__file__))
+
+logger = LoggingUtil.init_logging('biolink_index', level=logging.WARNING, format='long', logFilePath=this_dir + '/')
+
+BIOLINK_DIR = os.path.join(DATA_DIR, 'biolink')
+ASPECT_SLOT = 'object aspect qualifier'
+DIRECTION_SLOT = 'object direction qualifier'
+
+
+def usage_value(slot_definition, field):
+    return getattr(slot_definition, field, None) if slot_definition is not None else None
+
+
+def enum_values(tk, slot_definition, slot_name):
+    enum_name = usage_value(slot_definition, 'range') or tk.view.get_slot(slot_name).range
+    if not enum_name or not tk.is_enum(enum_name):
+        return []
+    return sorted(tk.view.get_enum(enum_name).permissible_values)
+
+
+def build_biolink_index(tk):
+    """ Walk the Biolink model once: predicate domains and ranges, and which qualifiers each association allows """
+    classes = {}
+
+    def class_key(name):
+        # descendants are stored once per class and shared by every predicate/association that names it
+        if not name:
+            return None
+        key = tk.get_element(name).name
+        if key not in classes:
+            classes[key] = sorted(tk.get_descendants(key, formatted=True, mixin=True))
+        return key
+
+    predicates = sorted(set(tk.get_descendants('related to', formatted=True)))
+    domains = {}
+    ranges = {}
+    for predicate in predicates:
+        element = tk.get_element(predicate)
+        domains[predicate] = class_key(element.domain)
+        ranges[predicate] = class_key(element.range)
+
+    qualifiers = []
+    for association in tk.get_descendants('association'):
+        element = tk.get_element(association)
+        aspect_usage = tk.get_slot_usage(element, ASPECT_SLOT)
+        direction_usage = tk.get_slot_usage(element, DIRECTION_SLOT)
+        predicate_parent = usage_value(tk.get_slot_usage(element, 'predicate'), 'subproperty_of')
+        if (aspect_usage is None and direction_usage is None) or not predicate_parent:
+            continue
+        qualifiers.append({
+            'association': association,
+            'predicates': sorted(tk.get_descendants(predicate_parent, formatted=True)),
+            'subject': class_key(usage_value(tk.get_slot_usage(element, 'subject'), 'range')),
+            'object': class_key(usage_value(tk.get_slot_usage(element, 'object'), 'range')),
+            'aspects': enum_values(tk, aspect_usage, ASPECT_SLOT),
+            'directions': enum_values(tk, direction_usage, DIRECTION_SLOT),
+        })
+
+    return {'version': tk.get_model_version(), 'classes': classes, 'predicates': predicates, 'domains': domains,
+            'ranges': ranges, 'qualifiers': qualifiers}
+
+
+class BiolinkIndex:
+    """ In-memory view of the precomputed table; every lookup is a few set memberships """
+
+    def __init__(self, table):
+        self.version = table['version']
+        self.classes = {name: set(descendants) for name, descendants in table['classes'].items()}
+        self.predicates = table['predicates']
+        self.domains = table['domains']
+        self.ranges = table['ranges']
+        self.qualifiers = [{**entry, 'predicates': set(entry['predicates'])} for entry in table['qualifiers']]
+
+    def allows(self, class_key, category):
+        # unconstrained slots and unchosen categories match anything
+        return class_key is None or not category or category in self.classes[class_key]
+
+    @lru_cache(maxsize=4096)
+    def valid_predicates(self, source_category, target_category):
+        return tuple(predicate for predicate in self.predicates if
+                     self.allows(self.domains[predicate], source_category) and
+                     self.allows(self.ranges[predicate], target_category))
+
+    @lru_cache(maxsize=4096)
+    def qualifier_options(self, source_category, predicate, target_category):
+        aspects = set()
+        directions = set()
+        for entry in self.qualifiers:
+            if predicate in entry['predicates'] and self.allows(entry['subject'], source_category) and \
+                    self.allows(entry['object'], target_category):
+                aspects.update(entry['aspects'])
+                directions.update(entry['directions'])
+        return sorted(aspects), sorted(directions)
+
+    def check(self, source_category, predicate, target_category, aspect=None, direction=None):
+        """ None for a combination the model allows, otherwise why it does not """
+        if predicate not in self.domains:
+            return f"{predicate} is not a Biolink predicate"
+        if predicate not in self.valid_predicates(source_category, target_category):
+            return f"{predicate} does not connect {source_category or 'anything'} to {target_category or 'anything'}"
+        aspects, directions = self.qualifier_options(source_category, predicate, target_category)
+        if aspect and aspect not in aspects:
+            return f"object_aspect_qualifier {aspect} does not apply to {source_category} {predicate} {target_category}"
+        if direction and direction not in directions:
+            return f"object_direction_qualifier {direction} does not apply to {source_category} {predicate} {target_category}"
+        return None
+
+
+def load_biolink_index(tk):
+    """ Built once per Biolink model version and kept on disk, so restarts only read it back """
+    path = os.path.join(BIOLINK_DIR, f"{tk.get_model_version()}.json")
+    try:
+        with open(path, 'rb') as inf:
+            return BiolinkIndex(orjson.loads(inf.read()))
+    except FileNotFoundError:
+        pass
+    table = build_biolink_index(tk)
+    os.makedirs(BIOLINK_DIR, exist_ok=True)
+    with open(f"{path}.{os.getpid()}.tmp", 'wb') as outf:
+        outf.write(orjson.dumps(table))
+    os.replace(f"{path}.{os.getpid()}.tmp", path)
+    return BiolinkIndex(table)
@@ -1,4 +1,4 @@
-import json
+import dash
 import base64
 import logging
 from src.utils import LoggingUtil
@@ -6,7 +6,9 @@ import os
 from dash import dcc, html
 from dash_extensions.enrich import Input, Output, callback, State
 import dash_bootstrap_components as dbc
-from src.visualization import vizlayout
+from src.visualization import vizlayout, onetable
+from src.jobs import submit_job, get_job, save_upload, DONE, FAILED
+from src.workspace import compare, OPERATIONS, SHARED_CANDIDATES, DIFFERENTIAL
 
 
 this_dir = os.path.dirname(os.path.realpath(__file__))
@@ -15,47 +17,89 @@ logger = LoggingUtil.init_logging('bring_your_own_data', level=logging.WARNING,
 
 
 # Callback to load data
-@callback(Output('store-response', 'data'), [Input('upload-data', 'contents')], [State('upload-data', 'filename')])
+@callback(Output('store-response', 'data'), Output('byo-interval', 'disabled'), [Input('upload-data', 'contents')], [State('upload-data', 'filename')])
 def load_data(contents, filename):
     if contents is not None and filename.endswith('.json'):
         try:
             _, content_string = contents.split(',')
             decoded = base64.b64decode(content_string)
-            response = json.loads(decoded)
+            handle = submit_job('ingest', {'path': save_upload(decoded), 'label': filename[:-len('.json')]})
             logger.info(f"JSON data Decoded")
-            return response
+            return handle, False
         except Exception as e:
             logger.error(f"Error decoding or parsing JSON: {type(e).__name__}: {str(e)}")
-            return ''
+            return '', True
     logger.info("No contents provided or incorrect file type")
-    return ''
+    return '', True
 
 
-# callback to display the loaded JSON data
-@callback(Output('output-data', 'children'), [Input('store-response', 'data')])
-def display_data(store_data):
-    if store_data:
+# callback to display the loaded JSON data once its ingest job is done
+@callback(Output('output-data', 'children'), Output('byo-interval', 'disabled', allow_duplicate=True), Output('workspace-store', 'data'), [Input('store-response', 'data'), Input('byo-interval', 'n_intervals')], State('workspace-store', 'data'))
+def display_data(handle, n_intervals, workspace):
+    if handle:
+        job = get_job(handle)
+        if job is None:
+            return html.Div("No data loaded"), True, dash.no_update
+        if job['status'] == DONE:
+            logger.info(f"Data loaded!")
+            return vizlayout(handle), True, add_to_workspace(workspace or [], handle, job['summary'].get('label', handle[:8]))
+        if job['status'] == FAILED:
+            logger.error(f"Error decoding or parsing JSON: {job['error']}")
+            return html.Div(f"Could not load the answer set: {job['error']}"), True, dash.no_update
         logger.info(f"Data uploaded, please wait...")
-        result = vizlayout(store_data)
-        return result 
+        return html.Div("Data uploaded, please wait..."), False, dash.no_update
     logger.info("No data loaded to display")
-    return html.Div("No data loaded")
+    return html.Div("No data loaded"), True, dash.no_update
+
+
+def add_to_workspace(workspace, handle, label):
+    if any(answerset['handle'] == handle for answerset in workspace):
+        return dash.no_update
+    # labels head the comparison columns, so they have to stay unique
+    labels = {answerset['label'] for answerset in workspace}
+    unique_label, n = label, 1
+    while unique_label in labels:
+        n += 1
+        unique_label = f"{label} {n}"
+    return workspace + [{'handle': handle, 'label': unique_label}]
+
+
+# callbacks for the comparison workspace
+@callback(Output('workspace-sets', 'options'), Output('workspace-sets', 'value'), Input('workspace-store', 'data'), State('workspace-sets', 'value'))
+def update_workspace_sets(workspace, selected):
+    options = [{'label': answerset['label'], 'value': answerset['handle']} for answerset in workspace or []]
+    handles = {option['value'] for option in options}
+    return options, [handle for handle in selected or [] if handle in handles]
+
+
+@callback(Output('workspace-output', 'children'), Input('workspace-compare', 'n_clicks'), State('workspace-operation', 'value'), State('workspace-sets', 'value'), State('workspace-store', 'data'), prevent_initial_call=True)
+def compare_answersets(n_clicks, operation, selected, workspace):
+    answersets = [answerset for answerset in workspace or [] if answerset['handle'] in (selected or [])]
+    if len(answersets) < 2:
+        return html.Div("Select at least two answer sets to compare")
+    if operation == DIFFERENTIAL and len(answersets) > 2:
+        return html.Div("Differential p-values compare exactly two answer sets")
+    try:
+        df = compare(operation, answersets)
+    except Exception as e:
+        logger.error(f"Error comparing answer sets: {type(e).__name__}: {str(e)}")
+        return html.Div(f"Could not compare the answer sets: {str(e)}")
+    if df.empty:
+        return html.Div("Nothing in common between the selected answer sets")
+    return html.Div([html.H6(f"{OPERATIONS[operation]}: {len(df)} rows"), onetable(df.round(6), 'workspace-table')])
+
+
+@callback(Output('workspace-store', 'data', allow_duplicate=True), Input('workspace-clear', 'n_clicks'), prevent_initial_call=True)
+def clear_workspace(n_clicks):
+    return []
 
 
 # callback to view sample result
-@callback(Output('output-data', 'children', allow_duplicate=True), [Input('sample-result', 'n_clicks')])
+@callback(Output('store-response', 'data', allow_duplicate=True), Output('byo-interval', 'disabled', allow_duplicate=True), [Input('sample-result', 'n_clicks')])
 def sample_data(n_clicks):
     if n_clicks > 0:
-        try:
-            with open("src/samples/MONDO0004975Drug.json", "r") as inf:
-                response = json.load(inf)
-            result = vizlayout(response)
-            logger.info(f"Data loaded!")
-            return result
-        except Exception as e:
-            logger.error(f"Error decoding or parsing JSON: {type(e).__name__}: {str(e)}")
-            return ''
-    return ''
+        return submit_job('ingest', {'path': os.path.join(this_dir, 'samples', 'MONDO0004975Drug.json'), 'label': 'Alzheimer sample'}), False
+    return dash.no_update, dash.no_update
 
 
 byo_layout = dbc.Container([
@@ -66,6 +110,17 @@ byo_layout = dbc.Container([
                 ),
             ])), dbc.Col(html.Div([html.Button('View Alzheimer Sample', id = 'sample-result', n_clicks=0, style={'width': '90%', 'height': '60px', 'lineHeight': '60px', 'borderWidth': '1px', 'borderStyle': 'dashed', 'borderRadius': '5px', 'textAlign': 'center', 'position': 'relative', 'display': 'flex', 'alignItems': 'center', 'justifyContent': 'center'})]))]),
             dcc.Store(id='store-response'),
+            dcc.Interval(id='byo-interval', interval=500, n_intervals=0, disabled=True),
+            dcc.Store(id='workspace-store', storage_type='session', data=[]),
+            dbc.Accordion([dbc.AccordionItem([
+                dbc.Row([
+                    dbc.Col(dcc.Checklist(id='workspace-sets', options=[], value=[], inline=True, inputStyle={'margin-left': '10px', 'margin-right': '4px'}), width=6),
+                    dbc.Col(dcc.Dropdown(id='workspace-operation', options=[{'label': label, 'value': value} for value, label in OPERATIONS.items()], value=SHARED_CANDIDATES, clearable=False), width=3),
+                    dbc.Col([dbc.Button('Compare', id='workspace-compare', n_clicks=0, color='primary', size='sm', style={'margin-right': '5px'}),
+                             dbc.Button('Clear', id='workspace-clear', n_clicks=0, color='secondary', size='sm')], width=3),
+                ]),
+                dcc.Loading(html.Div(id='workspace-output', style={'margin-top': '10px'})),
+            ], title='Compare loaded answer sets')], start_collapsed=True, style={'margin-top': '10px'}),
             html.Div(id='output-data', style={'whiteSpace': 'pre-wrap'})
         ],
         fluid=True,
@@ -0,0 +1,248 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import orjson
+from src.utils import LoggingUtil, DATA_DIR
+from src.metrics import inc, stage_timer
+from src.answerset_index import build_support_index, build_ranking_index
+from src.requery import query_key
+
+this_dir = os.path.dirname(os.path.realpath(__file__))
+
+logger = LoggingUtil.init_logging('chains', level=logging.WARNING, format='long', logFilePath=this_dir + '/')
+
+SUBQUERY_DIR = os.path.join(DATA_DIR, 'subqueries')
+# at most this many AnswerCoalesce calls in flight per chained query
+CHAIN_CONCURRENCY = int(os.environ.get('EDGAR_CHAIN_CONCURRENCY', 4))
+# intermediate nodes carried from one hop to the next
+CHAIN_FANOUT = int(os.environ.get('EDGAR_CHAIN_FANOUT', 10))
+SUBQUERY_POLL_INTERVAL = 0.2
+# the holder of a subquery lock touches it this often while its call runs; a lock untouched for
+# SUBQUERY_LOCK_TIMEOUT was left behind by a crashed worker and stops blocking others
+SUBQUERY_LOCK_REFRESH = 10
+SUBQUERY_LOCK_TIMEOUT = 60
+
+
+def linear_path( query_graph ):
+    """ Node and edge keys of a chain query graph, ordered from its pinned end """
+    nodes = query_graph["nodes"]
+    edges = query_graph["edges"]
+    pinned = [key for key, node in nodes.items() if node.get("ids")]
+    if len(pinned) != 1:
+        raise ValueError("A chained query needs exactly one node with ids")
+    adjacent = {key: [] for key in nodes}
+    for edge_key, edge in edges.items():
+        adjacent[edge["subject"]].append((edge_key, edge["object"]))
+        adjacent[edge["object"]].append((edge_key, edge["subject"]))
+    if len(adjacent[pinned[0]]) != 1 or any(len(hops) > 2 for hops in adjacent.values()):
+        raise ValueError("A chained query must be a simple path starting at its pinned node")
+
+    path_nodes, path_edges = [pinned[0]], []
+    while len(path_edges) < len(edges):
+        step = [(edge_key, node) for edge_key, node in adjacent[path_nodes[-1]] if edge_key not in path_edges]
+        if not step:
+            raise ValueError("A chained query must be a single connected path")
+        path_edges.append(step[0][0])
+        path_nodes.append(step[0][1])
+    return path_nodes, path_edges
+
+
+def hop_query( query_graph, edge_key, pinned_key, ids, parameters ):
+    edge = query_graph["edges"][edge_key]
+    nodes = {}
+    for key in (edge["subject"], edge["object"]):
+        node = {name: value for name, value in query_graph["nodes"][key].items() if name != "ids"}
+        if key == pinned_key:
+            node["ids"] = list(ids)
+        nodes[key] = node
+    data = {"message": {"query_graph": {"nodes": nodes, "edges": {edge_key: edge}}}}
+    if parameters:
+        data["parameters"] = parameters
+    return data
+
+
+def lock_owner( lock_path ):
+    try:
+        with open(lock_path) as inf:
+            return inf.read()
+    except FileNotFoundError:
+        return None
+
+
+def take_lock( lock_path ):
+    """ Our owner token if we now hold the lock, None if a live holder has it """
+    token = uuid.uuid4().hex
+    try:
+        lock = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        try:
+            owner = lock_owner(lock_path)
+            # its holder stopped touching it: remove it, unless it changed hands while we looked
+            if time.time() - os.path.getmtime(lock_path) > SUBQUERY_LOCK_TIMEOUT and lock_owner(lock_path) == owner:
+                logger.warning(f"Removing the abandoned subquery lock {lock_path}")
+                os.remove(lock_path)
+        except FileNotFoundError:
+            pass
+        return None
+    with os.fdopen(lock, 'w') as outf:
+        outf.write(token)
+    return token
+
+
+def refresh_lock( lock_path, token, stop ):
+    while not stop.wait(SUBQUERY_LOCK_REFRESH):
+        if lock_owner(lock_path) != token:
+            return
+        try:
+            os.utime(lock_path)
+        except FileNotFoundError:
+            return
+
+
+def release_lock( lock_path, token ):
+    # a lock taken over after we were presumed dead is someone else's now
+    if lock_owner(lock_path) == token:
+        os.remove(lock_path)
+
+
+def cached_answer( data ):
+    # hops repeat across chains (the same intermediate gene, the same pinned disease), so keep every answer
+    key = hashlib.sha256(f"{query_key(data)}:{orjson.dumps(data.get('parameters', {}), option=orjson.OPT_SORT_KEYS).decode()}"
+                         .encode()).hexdigest()
+    path = os.path.join(SUBQUERY_DIR, f"{key}.json")
+    os.makedirs(SUBQUERY_DIR, exist_ok=True)
+    while True:
+        try:
+            with open(path, 'rb') as inf:
+                content = inf.read()
+            inc('edgar_chain_subqueries_total', cache='hit')
+            return orjson.loads(content)
+        except FileNotFoundError:
+            pass
+        # single flight across threads and worker processes: whoever creates the lock file asks, the others wait
+        token = take_lock(f"{path}.lock")
+        if token is None:
+            time.sleep(SUBQUERY_POLL_INTERVAL)
+            continue
+        stop_refreshing = threading.Event()
+        threading.Thread(target=refresh_lock, args=(f"{path}.lock", token, stop_refreshing), daemon=True).start()
+        try:
+            from src.answercoalesce import send_post_request
+
+            content = send_post_request(data)
+            with open(f"{path}.{token}.tmp", 'wb') as outf:
+                outf.write(content)
+            os.replace(f"{path}.{token}.tmp", path)
+            inc('edgar_chain_subqueries_total', cache='miss')
+            return orjson.loads(content)
+        finally:
+            stop_refreshing.set()
+            release_lock(f"{path}.lock", token)
+
+
+def top_answers( answerset, pinned_ids, fanout ):
+    """ (inference edge, pinned node, answer node) for the best ranked inferences, at most fanout answer nodes """
+    message = answerset["message"]
+    kg_edges = message["knowledge_graph"]["edges"]
+    ranking_index = build_ranking_index(build_support_index(kg_edges, message["results"], message["auxiliary_graphs"]))
+    answers = []
+    answer_nodes = set()
+    for inference_edge in ranking_index['order']:
+        edge = kg_edges[inference_edge]
+        pinned, answer = (edge["subject"], edge["object"]) if edge["subject"] in pinned_ids else (edge["object"], edge["subject"])
+        if answer not in answer_nodes:
+            if len(answer_nodes) == fanout:
+                continue
+            answer_nodes.add(answer)
+        answers.append((inference_edge, pinned, answer))
+    return answers
+
+
+def namespaced( answerset, suffix ):
+    """ Suffix edge and aux graph ids so several AnswerCoalesce responses can share one knowledge graph """
+    message = answerset["message"]
+    aux_graphs = message.get("auxiliary_graphs") or {}
+
+    def rename( value ):
+        if isinstance(value, str) and value in aux_graphs:
+            return value + suffix
+        if isinstance(value, list) and value and all(isinstance(item, str) and item in aux_graphs for item in value):
+            return [item + suffix for item in value]
+        return value
+
+    edges = {}
+    for edge_id, edge in message["knowledge_graph"]["edges"].items():
+        edge = dict(edge)
+        edge["attributes"] = [{**attribute, "value": rename(attribute["value"])} for attribute in edge.get("attributes") or []]
+        edges[edge_id + suffix] = edge
+    graphs = {graph + suffix: {**aux_graph, "edges": [edge_id + suffix for edge_id in aux_graph["edges"]]}
+              for graph, aux_graph in aux_graphs.items()}
+    return message["knowledge_graph"]["nodes"], edges, graphs
+
+
+def join_paths( query_graph, path_nodes, path_edges, answersets, paths ):
+    """ One answer set whose results are the complete paths, over the union of the hops' knowledge graphs """
+    kg_nodes, kg_edges, aux_graphs = {}, {}, {}
+    for index, answerset in enumerate(answersets):
+        nodes, edges, graphs = namespaced(answerset, f"_h{index}")
+        for node_id, node in nodes.items():
+            kg_nodes.setdefault(node_id, node)
+        kg_edges.update(edges)
+        aux_graphs.update(graphs)
+
+    results = []
+    for path in paths:
+        results.append({
+            "node_bindings": {key: [{"id": node}] for key, node in zip(path_nodes, path["nodes"])},
+            "analyses": [{"resource_id": "infores:edgar",
+                          "edge_bindings": {key: [{"id": edge}] for key, edge in zip(path_edges, path["edges"])}}],
+        })
+    return {"message": {"query_graph": query_graph, "knowledge_graph": {"nodes": kg_nodes, "edges": kg_edges},
+                        "results": results, "auxiliary_graphs": aux_graphs}}
+
+
+def run_chain( data, fanout=CHAIN_FANOUT, concurrency=CHAIN_CONCURRENCY ):
+    """ Answer a multi-hop query hop by hop from its pinned end, fanning each hop's best answers out in parallel """
+    query_graph = data["message"]["query_graph"]
+    parameters = data.get("parameters")
+    path_nodes, path_edges = linear_path(query_graph)
+    pinned_ids = query_graph["nodes"][path_nodes[0]]["ids"]
+
+    answersets = []
+    # partial paths waiting at each frontier node
+    frontier = {None: [{"nodes": [], "edges": []}]}
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for hop, edge_key in enumerate(path_edges):
+            starts = [pinned_ids] if hop == 0 else [[node] for node in frontier]
+            with stage_timer(f'chain.hop{hop}'):
+                hop_answers = list(pool.map(cached_answer, [hop_query(query_graph, edge_key, path_nodes[hop], ids, parameters)
+                                                            for ids in starts]))
+            last_hop = hop == len(path_edges) - 1
+            next_frontier = {}
+            for ids, answerset in zip(starts, hop_answers):
+                suffix = f"_h{len(answersets)}"
+                answersets.append(answerset)
+                # the last hop keeps every answer; earlier ones only pass their best on
+                answers = top_answers(answerset, set(ids), len(answerset["message"]["results"]) if last_hop else fanout)
+                for inference_edge, pinned, answer in answers:
+                    for partial in frontier.get(None if hop == 0 else pinned, []):
+                        next_frontier.setdefault(answer, []).append(
+                            {"nodes": (partial["nodes"] or [pinned]) + [answer], "edges": partial["edges"] + [inference_edge + suffix]})
+            if not last_hop:
+                # intermediate nodes reached from several parents are still queried once
+                kept = list(next_frontier)[:fanout]
+                next_frontier = {node: next_frontier[node] for node in kept}
+            frontier = next_frontier
+            logger.info(f"hop {hop}: {len(starts)} queries, {len(frontier)} nodes reached")
+
+    paths = [path for partials in frontier.values() for path in partials]
+    with stage_timer('chain.join'):
+        return join_paths(query_graph, path_nodes, path_edges, answersets, paths)
+
+
+def is_chain( data ):
+    return len(data["message"]["query_graph"]["edges"]) > 1
@@ -1,53 +1,33 @@
-import dash, bmt, json, requests, threading, time
+import dash, bmt
 from dash import html, dash_table, dcc
-from dash_extensions.enrich import Input, Output, callback, State
+from dash_extensions.enrich import Input, Output, callback, clientside_callback, State, ClientsideFunction
 import dash_bootstrap_components as dbc
 import dash_daq as daq
 import logging
 from src.utils import LoggingUtil
 import os
 
-from templates import get_qg
+from templates import get_qg, path_query, EXAMPLE_QUERIES, EXAMPLE_TEMPLATES, ASPECT_QUALIFIER, DIRECTION_QUALIFIER
 from src.visualization import vizlayout
+from src.jobs import submit_or_attach, get_job, DONE, FAILED
+from src.transfer import download_url
+from src.requery import plan_query, query_key, REUSE, DERIVE
+from src.chains import is_chain
+from src.typeahead import typeahead_index, CATEGORY, PREDICATE
+from src.biolink_index import load_biolink_index
+from src.history import search_history, backfill_history
 
 this_dir = os.path.dirname(os.path.realpath(__file__))
 
 logger = LoggingUtil.init_logging('edgar_dashboard', level=logging.WARNING, format='long', logFilePath=this_dir + '/')
 
 
-# Global variables to store progress and response
-progress = 0
-response_data = None
-request_in_progress = False
-response_status = 0
 tk = bmt.Toolkit()
-AC_URL = "https://answercoalesce.renci.org/query"
 all_node_classes = tk.get_all_classes('entity')
-
-
-def send_post_request(data):
-    global progress, response_data, request_in_progress, response_status
-    try:
-        request_in_progress = True
-        start_time = time.time()  # Record start time
-        response = requests.post(AC_URL, json=data)
-        response.raise_for_status()  # Raise an HTTPError if the HTTP request returned an unsuccessful status code
-        response_data = response.json()
-        response_status = response.status_code
-        end_time = time.time()  # Record end time
-        elapsed_time = end_time - start_time  # Calculate elapsed time
-        print(f"Time taken for POST request: {elapsed_time} seconds")
-    except requests.exceptions.HTTPError as e:
-        logger.error(f"Error in send_post_request function: {type(e).__name__}: {str(e)}")
-        response_data = f"HTTP error occurred: {e}"
-        print(f"HTTP error: {e}")
-    except Exception as e:
-        logger.error(f"Error in send_post_request function: {type(e).__name__}: {str(e)}")
-        response_data = f"Other error occurred: {str(e)}"
-        print(f"Error: {e}")
-    finally:
-        request_in_progress = False
-        progress = 100  # Set progress to 100 when done
+# predicate domains/ranges and association qualifiers, walked once per Biolink version rather than per callback
+biolink_index = load_biolink_index(tk)
+# answer sets computed before the history table existed are listed too
+backfill_history()
 
 
 source = html.Div([
@@ -58,8 +38,11 @@ source = html.Div([
         type='text',
         placeholder="Leave blank to if this is your \nreturn node(s)...",
         spellCheck="false",
-        className='searchTerms'
-)])
+        className='searchTerms',
+        list='source-suggestions',
+        autoComplete='off'
+),
+    html.Datalist(id='source-suggestions')])
 
 target = html.Div([
     html.Div(html.B(children='Target Curie:')),
@@ -68,10 +51,14 @@ target = html.Div([
         value='',
         placeholder="Leave blank if this is your \nreturn node(s)...",
         spellCheck="false",
-        className='searchTerms'
-    )])
-
-predicate_temp_options = ['biolink:treats', 'biolink:affects', 'biolink:regulates',
+        className='searchTerms',
+        list='target-suggestions',
+        autoComplete='off'
+    ),
+    html.Datalist(id='target-suggestions')])
+
+# listed in the order they are offered; dict.fromkeys drops the repeats
+predicate_temp_options = list(dict.fromkeys(['biolink:treats', 'biolink:affects', 'biolink:regulates',
 'biolink:associated_with', 'biolink:active_in', 'biolink:actively_involved_in',
 'biolink:acts_upstream_of','biolink:acts_upstream_of_negative_effect',
 'biolink:acts_upstream_of_or_within_negative_effect',
@@ -129,13 +116,18 @@ predicate_temp_options = ['biolink:treats', 'biolink:affects', 'biolink:regulate
 'biolink:regulates',
 'biolink:related_to',
 'biolink:similar_to',
-'biolink:subclass_of']
+'biolink:subclass_of']))
+
+for node_class in all_node_classes:
+    typeahead_index.add(CATEGORY, node_class)
+for predicate_option in predicate_temp_options:
+    typeahead_index.add(PREDICATE, predicate_option)
 
 
 submit_button = html.Div([
         html.Div([
             dbc.Row(html.Button("Submit Query", id="send-request-button", n_clicks=0)),
-            dbc.Row([html.Div([dbc.Col([daq.Gauge(id='progress-gauge', min=0, max=100, value=0), dcc.Interval(id="progress-interval", interval=500, n_intervals=0, disabled=True)]), dbc.Col([dbc.Row([html.Button("Visualize", id="visualize-button", n_clicks=0, className="mr-2", disabled=True)]), dbc.Row([html.Button("Download", id="download-button", n_clicks=0, className="mr-2", disabled=True), dcc.Download(id="download")])])], id="content", style={'display': 'none', 'flex-direction': 'row'})])
+            dbc.Row([html.Div([dbc.Col([daq.Gauge(id='progress-gauge', min=0, max=100, value=0), dcc.Interval(id="progress-interval", interval=500, n_intervals=0, disabled=True)]), dbc.Col([dbc.Row([html.Button("Visualize", id="visualize-button", n_clicks=0, className="mr-2", disabled=True)]), dbc.Row([html.A(html.Button("Download", id="download-button", n_clicks=0, className="mr-2", disabled=True), id="download-link")])])], id="content", style={'display': 'none', 'flex-direction': 'row'})])
         ]),
         dcc.Store(id='response-output-store', data={}),
 ])
@@ -157,6 +149,25 @@ parameters = html.Div([
 ])
 
 
+HISTORY_COLUMNS = ['Finished', 'Query', 'Parameters', 'Inferences', 'Seconds', 'Kind']
+
+query_history = dbc.Accordion([dbc.AccordionItem([
+        dcc.Input(id='history-search', type='text', debounce=True, placeholder='Search by CURIE, name, category or predicate...',
+                  style={'width': '100%', 'margin-bottom': '0.5em'}),
+        dash_table.DataTable(
+            id='history-table',
+            columns=[{"name": i, "id": i} for i in HISTORY_COLUMNS],
+            data=[],
+            page_size=10,
+            style_header={'backgroundColor': '#cbd3dd', 'color': 'black', 'fontWeight': 'bold', 'text-align': 'center'},
+            style_cell={'text-align': 'left', "maxWidth": "400px", 'fontSize': 12, 'font-family': 'sans-serif',
+                        "textOverflow": "ellipsis", 'overflow': 'hidden', 'whiteSpace': 'nowrap', 'cursor': 'pointer'},
+            tooltip_duration=None,
+        ),
+    ], title='Query history', item_id='history')],
+    id='history-accordion', start_collapsed=True, style={'margin': '1em'})
+
+
 explore_edgar = html.Div([dbc.Container([
                 dbc.Collapse([
                     html.Div([
@@ -165,18 +176,7 @@ explore_edgar = html.Div([dbc.Container([
                                 html.Div([
                                     dcc.Dropdown(
                                         id="example-query-dropdown",
-                                        options=[
-                                            {'label': "What Drugs treats Disease Y eg. MONDO:0004975?",
-                                             'value': "biolink:Drug-biolink:treats-biolink:Disease"},
-                                            {'label': "What Genes are genetically associated with Disease X eg. DOID:0050430?",
-                                             'value': "biolink:Gene-biolink:genetically_associated_with-biolink:Disease"},
-                                            {'label': "What are the Phenotypes of Disease X eg. MONDO:0005147?",
-                                                'value': "biolink:Disease-biolink:has_phenotype-biolink:PhenotypicFeature"},
-                                            {'label': "What are the Genes that affects Phenotype X eg. HP:0003637?",
-                                                'value': "biolink:Gene-biolink:affects-biolink:PhenotypicFeature"},
-                                            {'label': "What are the Phenotypes of Gene X eg. NCBIGene:122481?",
-                                                'value': "biolink:Gene-biolink:has_phenotype-biolink:PhenotypicFeature"}
-                                        ],
+                                        options=[{'label': label, 'value': pattern} for label, pattern in EXAMPLE_QUERIES],
                                         value=None,
                                         placeholder='Select an example query pattern...optional',
                                         multi=False,
@@ -216,6 +216,13 @@ explore_edgar = html.Div([dbc.Container([
                                                  dcc.Dropdown(id='object_direction_qualifier_dropdown', className='dropdownbox',
                                                           placeholder='Select object_direction_qualifier...', clearable=False),
                                              ]),
+                                             html.Div([
+                                                 html.H3('Via (optional second hop):'),
+                                                 dcc.Dropdown(id='via_dropdown', className='dropdownbox',
+                                                          placeholder='Intermediate Node Type...', clearable=True),
+                                                 dcc.Dropdown(id='via_predicate_dropdown', className='dropdownbox',
+                                                          placeholder='Intermediate to Target Predicate...', clearable=True),
+                                             ]),
                                          ], style={'width': '15em', 'padding-right': '1em'}),
                                          html.Td([
                                              html.H2(children='Target Type:'),
@@ -236,41 +243,18 @@ explore_edgar = html.Div([dbc.Container([
                     is_open=True,
                 ),
             ], style={'display': 'flex', 'align-items': 'center', 'justify-content': 'center'}),
+                query_history,
                 html.Div(id='output-data', style={'whiteSpace': 'pre-wrap'})
     ])
 
 
 ####### PARAMETERS CALLBACKS #######################################
-@callback( Output('parameters-div', 'style'), Output('submit-message', 'children', allow_duplicate=True), Input('toggle-button', 'n_clicks'), State('parameters-visible', 'data'), State('source', 'value'), State('target', 'value'), State('predicate_dropdown', 'value'))
-def param_div_visibility(n_clicks, visible, source_value, target_value, predicate):
-    if n_clicks > 0:
-        if not (bool(source_value) ^ bool(target_value)) or not (bool(predicate)):
-            msg = 'One "biolink" compliant Curie, a return Categories and Predicate is required'
-            style = {'color': 'red'}
-            return {'display': 'none'}, html.Span(msg, style=style)
-
-        curie = source_value if source_value else target_value
-
-        if not (':' in curie):
-            msg = [
-                f'{curie} is not "biolink" compliant, e.g., MONDO:0004975',
-                html.Br(),
-                html.Br(),
-                "See ",
-                dcc.Link('Name->Curie on the sidebar', href='/normalize_node'),
-                " for more details."
-            ]
-            style = {'color': 'red'}
-            return {'display': 'none'}, html.Span(msg, style=style)
-        visible = not visible
-    return {'display': 'block' if visible else 'none'}, ''
-
-
-@callback( Output('parameters-visible', 'data'), Input('toggle-button', 'n_clicks'), State('parameters-visible', 'data'))
-def update_param_div_visibility(n_clicks, visible):
-    if n_clicks > 0:
-        return not visible
-    return visible
+clientside_callback(
+    ClientsideFunction(namespace='edgar', function_name='toggle_parameters'),
+    Output('parameters-div', 'style'), Output('parameters-visible', 'data'), Output('submit-message', 'children', allow_duplicate=True),
+    Input('toggle-button', 'n_clicks'), State('parameters-visible', 'data'), State('source', 'value'), State('target', 'value'), State('predicate_dropdown', 'value'),
+    prevent_initial_call=True
+)
 
 
 @callback( Output('submit-message', 'children', allow_duplicate=True), Output('param-json-store', 'data'), Input('param-submit-button', 'n_clicks'), State('pvalue-threshold', 'value'), State('result-length', 'value'), State('predicates-to-exclude', 'value'))
@@ -301,17 +285,40 @@ def add_parameters(n_clicks, pvalue_threshold, result_length, predicates_to_excl
 
 
 ####### TRAPI Query CALLBACKS #######################################
-@callback([Output('source_dropdown', 'options'), Output('predicate_dropdown', 'options'), Output('target_dropdown', 'options')], [Input('example-query-dropdown', 'value')])
+@callback([Output('source_dropdown', 'options'), Output('predicate_dropdown', 'options'), Output('target_dropdown', 'options'), Output('via_dropdown', 'options'), Output('via_predicate_dropdown', 'options')], [Input('example-query-dropdown', 'value')])
 def update_trapi_component_dropdowns(selected_option):
+    options = [{'label': option, 'value': option} for option in all_node_classes]
     if selected_option:
-        split_values = selected_option.split('-')
-        options_2 = [{'label': split_values[0], 'value': split_values[0]}]
-        options_3 = [{'label': split_values[1], 'value': split_values[1]}]
-        options_4 = [{'label': split_values[2], 'value': split_values[2]}]
-        return options_2, options_3, options_4
+        template = EXAMPLE_TEMPLATES[selected_option]
+        options_2 = [{'label': template.subject_category, 'value': template.subject_category}]
+        options_3 = [{'label': predicate, 'value': predicate} for predicate in template.predicates]
+        options_4 = [{'label': template.object_category, 'value': template.object_category}]
+        return options_2, options_3, options_4, options, predicate_temp_options
     else:
-        options = [{'label': option, 'value': option} for option in all_node_classes]
-        return options, predicate_temp_options, options
+        return options, predicate_temp_options, options, options, predicate_temp_options
+
+
+@callback([Output('predicate_dropdown', 'options', allow_duplicate=True), Output('via_predicate_dropdown', 'options', allow_duplicate=True)],
+          [Input('source_dropdown', 'value'), Input('via_dropdown', 'value'), Input('target_dropdown', 'value')],
+          State('example-query-dropdown', 'value'), prevent_initial_call=True)
+def filter_predicate_options(source_category, via_category, target_category, selected_option):
+    # only offer predicates whose Biolink domain and range admit the chosen categories
+    via_options = [predicate for predicate in predicate_temp_options if
+                   predicate in biolink_index.valid_predicates(via_category, target_category)]
+    if selected_option:
+        return dash.no_update, via_options
+    options = [predicate for predicate in predicate_temp_options if
+               predicate in biolink_index.valid_predicates(source_category, via_category or target_category)]
+    return options, via_options
+
+
+@callback([Output('object_aspect_qualifier_dropdown', 'options'), Output('object_direction_qualifier_dropdown', 'options')],
+          [Input('source_dropdown', 'value'), Input('predicate_dropdown', 'value'), Input('target_dropdown', 'value')],
+          State('via_dropdown', 'value'))
+def update_qualifier_dropdowns(source_category, predicate, target_category, via_category):
+    if not predicate:
+        return [], []
+    return biolink_index.qualifier_options(source_category, predicate, via_category or target_category)
 
 
 @callback([
@@ -320,27 +327,30 @@ def update_trapi_component_dropdowns(selected_option):
         Output("progress-interval", "disabled"),
         Output("visualize-button", "disabled"),
         Output("download-button", "disabled"),
-        Output("download", "data"),
+        Output("download-link", "href"),
         Output("content", "style"),
         Output("submit-message", "children")
     ],
-    Input('param-json-store', 'data'),
     Input("send-request-button", "n_clicks"),
     Input("progress-interval", "n_intervals"),
     Input("visualize-button", "n_clicks"),
     Input("download-button", "n_clicks"),
     [
+    State("response-output-store", "data"),
+    State("progress-gauge", "value"),
+    State('param-json-store', 'data'),
     State('source', 'value'),
     State('target', 'value'),
     State('source_dropdown', 'value'),
     State('predicate_dropdown', 'value'),
     State('object_aspect_qualifier_dropdown', 'value'),
     State('object_direction_qualifier_dropdown', 'value'),
-    State('target_dropdown', 'value')
+    State('target_dropdown', 'value'),
+    State('via_dropdown', 'value'),
+    State('via_predicate_dropdown', 'value')
     ], prevent_initial_call=True
 )
-def show_json_output(params, n_clicks_send, n_intervals, n_clicks_visualize, n_clicks_download, source_value, target_value, source_category, predicate, object_aspect_qualifier, object_direction_qualifier, target_category):
-    global progress, response_data, request_in_progress
+def show_json_output(n_clicks_send, n_intervals, n_clicks_visualize, n_clicks_download, handle, progress, params, source_value, target_value, source_category, predicate, object_aspect_qualifier, object_direction_qualifier, target_category, via_category, via_predicate):
     ctx = dash.callback_context
     if not ctx.triggered:
         return dash.no_update, dash.no_update, True, True, True, None, {'display': 'none'}, ''
@@ -360,8 +370,23 @@ def show_json_output(params, n_clicks_send, n_intervals, n_clicks_visualize, n_c
             style = {'color': 'red'}
             return dash.no_update, dash.no_update, True, True, True, None, {'display': 'none'}, html.Span(msg, style=style)
 
+        # combinations the Biolink model rules out are stopped here instead of round-tripping to AnswerCoalesce
+        hops = [(source_category, predicate, via_category, object_aspect_qualifier, object_direction_qualifier),
+                (via_category, via_predicate, target_category, None, None)] if via_category and via_predicate else \
+            [(source_category, predicate, target_category, object_aspect_qualifier, object_direction_qualifier)]
+        for hop in hops:
+            invalid = biolink_index.check(*hop)
+            if invalid:
+                style = {'color': 'red'}
+                return dash.no_update, dash.no_update, True, True, True, None, {'display': 'none'}, html.Span(invalid, style=style)
+
         is_source = bool(source_value)
-        data = get_qg([curie], is_source, [predicate], source_category, target_category, object_aspect_qualifier, object_direction_qualifier)
+        if via_category and via_predicate:
+            # two hops: source -predicate-> via -via_predicate-> target, answered hop by hop from the pinned end
+            qualifier_sets = [{ASPECT_QUALIFIER: object_aspect_qualifier, DIRECTION_QUALIFIER: object_direction_qualifier}] if object_aspect_qualifier and object_direction_qualifier else []
+            data = path_query([source_category, via_category, target_category], [[predicate], [via_predicate]], [curie], 0 if is_source else 2, qualifier_sets=[qualifier_sets, []])
+        else:
+            data = get_qg([curie], is_source, [predicate], source_category, target_category, object_aspect_qualifier, object_direction_qualifier)
 
         # Validation to check for trapi 'query_graph'
         if "message" not in data or "query_graph" not in data["message"]:
@@ -369,57 +394,104 @@ def show_json_output(params, n_clicks_send, n_intervals, n_clicks_visualize, n_c
             style = {'color': 'red'}
             return dash.no_update, dash.no_update, True, True, True, None, {'display': 'none'}, html.Span(msg, style=style)
 
-        progress = 0  # Reset progress
-        response_data = None  # Reset response data
-        request_in_progress = True  # Mark the request as in progress
-
         if params:
             data.update(params)
 
-        threading.Thread(target=send_post_request, args=(data,)).start()
+        # stricter parameters on a query we already answered are applied locally instead of asking again
+        plan, cached = plan_query(data)
+        if plan == REUSE:
+            return cached, 0, False, True, True, None, {'display': 'flex'}, 'Reusing the previous answer set...'
+        if plan == DERIVE:
+            handle = submit_or_attach('derive', {'source': cached, 'parameters': data['parameters']}, query_key(data))
+            return handle, 0, False, True, True, None, {'display': 'flex'}, 'Filtering the previous answer set...'
+
+        # identical queries already in flight (another session, a double click) are joined, not repeated
+        handle = submit_or_attach('chain' if is_chain(data) else 'answercoalesce', data, query_key(data))
 
-        return dash.no_update, 0, False, True, True, None, {'display': 'flex'}, 'Request sent, please wait...'
+        return handle, 0, False, True, True, None, {'display': 'flex'}, 'Request sent, please wait...'
 
     elif trigger_id == "progress-interval":
-        if request_in_progress:
-            # Simulate progress updates while the request is in progress
-            simulated_progress = min(progress + 10, 90)  # Let's Cap at 90% until request is done
-            progress = simulated_progress
-            return dash.no_update, progress, False, True, True, None, dash.no_update, 'Processing, please wait...'
-        else:
-            # When the request completes
-            if progress == 100:
-                if response_data and "message" in response_data:
-                    return json.dumps(response_data, indent=2), 100, True, False, False, None, dash.no_update, 'Done!'
-                else:
-                    msg = 'No response available'
-                    style = {'color': 'red'}
-                    logger.error(f"Error in show_json_output callback: {response_data}")
-                    return dash.no_update, 100, True, True, True, None, dash.no_update, html.Span(msg, style=style)
+        job = get_job(handle) if handle else None
+        if job is None:
+            return dash.no_update, dash.no_update, True, True, True, None, dash.no_update, dash.no_update
+        if job['status'] == DONE:
+            return dash.no_update, 100, True, False, False, download_url(handle), dash.no_update, 'Done!'
+        if job['status'] == FAILED:
+            msg = 'No response available'
+            style = {'color': 'red'}
+            logger.error(f"Error in show_json_output callback: {job['error']}")
+            return dash.no_update, 100, True, True, True, None, dash.no_update, html.Span(msg, style=style)
+        # Simulate progress updates while the job is queued or running, capped at 90% until it is done
+        return dash.no_update, min((progress or 0) + 10, 90), False, True, True, None, dash.no_update, 'Processing, please wait...'
 
     elif trigger_id == "visualize-button":
-        return dash.no_update, dash.no_update, True, False, False, None, dash.no_update, 'Scroll up, visualization in progress...'
+        return dash.no_update, dash.no_update, True, False, False, dash.no_update, dash.no_update, 'Scroll up, visualization in progress...'
 
     elif trigger_id == "download-button":
-        return dash.no_update, dash.no_update, True, False, False, dict(content=json.dumps(response_data, indent=2), filename="response_data.json"), dash.no_update, 'Download ready!'
+        # the link streams the compressed response from the server
+        return dash.no_update, dash.no_update, True, False, False, dash.no_update, dash.no_update, 'Download ready!'
 
     return dash.no_update, dash.no_update, True, True, True, None, dash.no_update, dash.no_update  # Default to keeping content hidden
 
 
-@callback(Output('output-data', 'children', allow_duplicate=True), [Input('response-output-store', 'data'), Input("visualize-button", "n_clicks")])
-def visualize_data(store_data, visualize_nclicks):
+@callback(Output('output-data', 'children', allow_duplicate=True), Input("visualize-button", "n_clicks"), State('response-output-store', 'data'))
+def visualize_data(visualize_nclicks, store_data):
     if store_data:
         if visualize_nclicks > 0:
             return vizlayout(store_data)
     return ""
 
 
-@callback(
+####### HISTORY CALLBACKS #######################################
+@callback(Output('history-table', 'data'), Output('history-table', 'tooltip_data'),
+          Input('history-search', 'value'), Input('history-accordion', 'active_item'), prevent_initial_call=True)
+def list_history(text, active_item):
+    if active_item != 'history':
+        return dash.no_update, dash.no_update
+    rows = search_history(text or '')
+    return rows, [{'Query': row['Query'], 'Parameters': row['Parameters']} for row in rows]
+
+
+@callback(Output('output-data', 'children', allow_duplicate=True), Output('response-output-store', 'data', allow_duplicate=True),
+          Output('submit-message', 'children', allow_duplicate=True),
+          Input('history-table', 'active_cell'), prevent_initial_call=True)
+def reopen_history(active_cell):
+    # the compact answer set is already cached under the job handle, so nothing is recomputed
+    if not active_cell or not active_cell.get('row_id'):
+        return dash.no_update, dash.no_update, dash.no_update
+    handle = active_cell['row_id']
+    job = get_job(handle)
+    if job is None or job['status'] != DONE:
+        return dash.no_update, dash.no_update, 'That answer set is no longer available, please submit the query again.'
+    return vizlayout(handle), handle, 'Reopened from history, scroll down for the results.'
+
+
+####### TYPEAHEAD CALLBACKS #######################################
+for curie_input in ('source', 'target'):
+    clientside_callback(
+        ClientsideFunction(namespace='edgar', function_name='suggest_curies'),
+        Output(f'{curie_input}-suggestions', 'children'),
+        Input(curie_input, 'value'),
+        prevent_initial_call=True
+    )
+
+for dropdown in ('source_dropdown', 'target_dropdown', 'via_dropdown', 'predicate_dropdown', 'via_predicate_dropdown'):
+    # predicate suggestions stay within what filter_predicate_options allows for the chosen categories
+    clientside_callback(
+        ClientsideFunction(namespace='edgar', function_name='suggest_options'),
+        Output(dropdown, 'options', allow_duplicate=True),
+        Input(dropdown, 'search_value'),
+        State(dropdown, 'value'), State('example-query-dropdown', 'value'),
+        State('source_dropdown', 'value'), State('via_dropdown', 'value'), State('target_dropdown', 'value'),
+        prevent_initial_call=True
+    )
+
+
+clientside_callback(
+    ClientsideFunction(namespace='edgar', function_name='echo_query'),
     Output('output-data', 'children', allow_duplicate=True),
     [Input('example-query-dropdown', 'value'),
      Input('source_dropdown', 'value'),
      Input('predicate_dropdown', 'value'),
      Input('target_dropdown', 'value')]
 )
-def update_output(selected_query, source_value, predicate_value, target_value):
-    return f'Selected Query: {selected_query}, Source: {source_value}, Predicate: {predicate_value}, Target: {target_value}'
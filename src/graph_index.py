@@ -0,0 +1,124 @@
+import numpy as np
+from src.session_state import answerset_state
+
+# Neighborhoods larger than this are cut, nearest nodes first, so a hub cannot blow up a Cytoscape card
+MAX_NODES = 200
+
+NEIGHBORHOOD = 'neighborhood'
+SHARED_NEIGHBORS = 'shared_neighbors'
+SHORTEST_PATH = 'shortest_path'
+
+
+class GraphIndex:
+    """ The knowledge graph as compressed adjacency arrays: node i's neighbours are neighbors[offsets[i]:offsets[i + 1]] """
+
+    def __init__( self, kg_nodes, kg_edges, skip_edges=() ):
+        skip_edges = set(skip_edges)
+        edge_ids = [edge_id for edge_id in kg_edges if edge_id not in skip_edges]
+        self.node_ids = list(dict.fromkeys([*kg_nodes, *(kg_edges[edge_id][end] for edge_id in edge_ids
+                                                          for end in ('subject', 'object'))]))
+        self.positions = {node: index for index, node in enumerate(self.node_ids)}
+        self.edge_ids = edge_ids
+        subjects = np.fromiter((self.positions[kg_edges[edge_id]['subject']] for edge_id in edge_ids), np.int64, len(edge_ids))
+        objects = np.fromiter((self.positions[kg_edges[edge_id]['object']] for edge_id in edge_ids), np.int64, len(edge_ids))
+        edges = np.arange(len(edge_ids), dtype=np.int64)
+
+        # every edge is walkable both ways
+        sources = np.concatenate([subjects, objects])
+        order = np.argsort(sources, kind='stable')
+        self.neighbors = np.concatenate([objects, subjects])[order]
+        self.via = np.concatenate([edges, edges])[order]
+        self.offsets = np.zeros(len(self.node_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=len(self.node_ids)), out=self.offsets[1:])
+
+    def position( self, node ):
+        if node not in self.positions:
+            raise KeyError(f"{node} is not in this answer set's knowledge graph")
+        return self.positions[node]
+
+    def expand( self, frontier ):
+        """ (neighbour, edge, from node) for every edge leaving the frontier """
+        starts, ends = self.offsets[frontier], self.offsets[frontier + 1]
+        lengths = ends - starts
+        if not lengths.sum():
+            return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.int64)
+        # each frontier node's run of slots, laid end to end without a Python loop
+        slots = np.arange(lengths.sum()) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        return self.neighbors[slots], self.via[slots], np.repeat(frontier, lengths)
+
+    def neighborhood( self, node, hops=1, limit=MAX_NODES ):
+        """ Nodes within hops of node and the edges that reached them, breadth first """
+        visited = np.zeros(len(self.node_ids), dtype=bool)
+        frontier = np.array([self.position(node)])
+        visited[frontier] = True
+        nodes, edges = [int(frontier[0])], []
+        for _ in range(hops):
+            neighbours, via, _ = self.expand(frontier)
+            fresh = ~visited[neighbours]
+            neighbours, first = np.unique(neighbours[fresh], return_index=True)
+            via = via[fresh][first]
+            room = limit - len(nodes)
+            neighbours, via = neighbours[:room], via[:room]
+            visited[neighbours] = True
+            nodes.extend(neighbours.tolist())
+            edges.extend(via.tolist())
+            frontier = neighbours
+            if not len(frontier) or len(nodes) >= limit:
+                break
+        return self.named(nodes, edges)
+
+    def shared_neighbors( self, nodes, limit=MAX_NODES ):
+        """ Nodes adjacent to every one of nodes, e.g. the candidates an enrichment group and a gene both touch """
+        positions = [self.position(node) for node in nodes]
+        shared = None
+        for position in positions:
+            adjacent = self.neighbors[self.offsets[position]:self.offsets[position + 1]]
+            shared = np.unique(adjacent) if shared is None else np.intersect1d(shared, adjacent)
+        shared = shared[~np.isin(shared, positions)][:limit]
+        edges = []
+        for position in positions:
+            slots = np.arange(self.offsets[position], self.offsets[position + 1])
+            slots = slots[np.isin(self.neighbors[slots], shared)]
+            # parallel edges (the same gene reached through several groups) are drawn once
+            _, first = np.unique(self.neighbors[slots], return_index=True)
+            edges.extend(self.via[slots[first]].tolist())
+        return self.named(positions + shared.tolist(), list(dict.fromkeys(edges)))
+
+    def shortest_path( self, source, target ):
+        """ Fewest-edge path from source to target (edges walked either way), or None """
+        start, goal = self.position(source), self.position(target)
+        parent = np.full(len(self.node_ids), -1, dtype=np.int64)
+        parent_edge = np.full(len(self.node_ids), -1, dtype=np.int64)
+        parent[start] = start
+        frontier = np.array([start])
+        while len(frontier) and parent[goal] < 0:
+            neighbours, via, origins = self.expand(frontier)
+            fresh = parent[neighbours] < 0
+            neighbours, first = np.unique(neighbours[fresh], return_index=True)
+            parent[neighbours] = origins[fresh][first]
+            parent_edge[neighbours] = via[fresh][first]
+            frontier = neighbours
+        if parent[goal] < 0:
+            return None
+        nodes, edges = [goal], []
+        while nodes[-1] != start:
+            edges.append(int(parent_edge[nodes[-1]]))
+            nodes.append(int(parent[nodes[-1]]))
+        return self.named(nodes[::-1], edges[::-1])
+
+    def nbytes( self ):
+        # the arrays, plus the positions dict and id lists (about 72 bytes a node and 8 an edge, measured with tracemalloc)
+        return self.neighbors.nbytes + self.via.nbytes + self.offsets.nbytes + 72 * len(self.node_ids) + 8 * len(self.edge_ids)
+
+    def named( self, nodes, edges ):
+        return [self.node_ids[node] for node in nodes], [self.edge_ids[edge] for edge in edges]
+
+
+def graph_index( handle ):
+    """ Built once per answer set and worker and kept with it in answerset_state; inferred edges are left out so paths
+        follow the evidence """
+    index = answerset_state.derived(handle, 'graph_index', lambda indexed: GraphIndex(
+        indexed['kg_nodes'], indexed['kg_edges'], skip_edges=indexed['support_index']['inferences']), GraphIndex.nbytes)
+    if index is None:
+        raise KeyError(f"No indexed answer set for {handle}")
+    return index
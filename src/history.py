@@ -0,0 +1,86 @@
+import logging
+import os
+import time
+from contextlib import closing
+import orjson
+from src.utils import LoggingUtil
+from src.jobs import connect, get_job, load_result, DONE, NAMES
+
+this_dir = os.path.dirname(os.path.realpath(__file__))
+
+logger = LoggingUtil.init_logging('history', level=logging.WARNING, format='long', logFilePath=this_dir + '/')
+
+# job kinds that leave an answer set worth reopening
+HISTORY_KINDS = ('answercoalesce', 'chain', 'derive', 'ingest')
+MAX_ROWS = 100
+
+
+def ensure_history(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS history (
+                        id TEXT PRIMARY KEY, kind TEXT NOT NULL, description TEXT, search_text TEXT,
+                        query_graph BLOB, parameters BLOB, inferences INTEGER,
+                        created REAL, started REAL, finished REAL)''')
+    conn.execute('CREATE INDEX IF NOT EXISTS history_finished ON history (finished)')
+
+
+def describe(query_graph, names):
+    """ "biolink:Drug -treats-> biolink:Disease [MONDO:0004975 Alzheimer disease]" """
+    nodes = query_graph.get("nodes", {})
+    hops = []
+    for edge in query_graph.get("edges", {}).values():
+        subject, object = nodes.get(edge["subject"], {}), nodes.get(edge["object"], {})
+        predicates = ','.join(predicate.split(':')[-1] for predicate in edge.get("predicates") or [])
+        hops.append(f"{','.join(subject.get('categories') or [edge['subject']])} -{predicates}-> "
+                    f"{','.join(object.get('categories') or [edge['object']])}")
+    pinned = [f"{curie} {names.get(curie) or ''}".strip() for node in nodes.values() for curie in node.get("ids") or []]
+    return '; '.join(hops) + (f" [{', '.join(pinned)}]" if pinned else '')
+
+
+def record_history(handle):
+    """ Called when a job is done: one searchable row per reopenable answer set """
+    job = get_job(handle)
+    if job is None or job['status'] != DONE or job['kind'] not in HISTORY_KINDS:
+        return
+    summary = job['summary']
+    try:
+        with closing(connect()) as conn:
+            payload = orjson.loads(conn.execute('SELECT payload FROM jobs WHERE id = ?', (handle,)).fetchone()['payload'])
+            query_graph = summary.get('query_graph') or {}
+            description = describe(query_graph, load_result(handle, NAMES) or {})
+            if summary.get('label'):
+                description = f"{summary['label']}: {description}"
+            ensure_history(conn)
+            conn.execute('INSERT OR REPLACE INTO history (id, kind, description, search_text, query_graph, parameters, '
+                         'inferences, created, started, finished) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                         (handle, job['kind'], description, description.lower(), orjson.dumps(query_graph),
+                          orjson.dumps(payload.get('parameters') or {}), summary.get('inferences'),
+                          job['created'], job['started'], job['finished']))
+    except Exception as e:
+        # the answer set is there either way; a missing history row only means it has to be asked for again
+        logger.warning(f"Could not record {handle} in the query history: {type(e).__name__}: {str(e)}")
+
+
+def backfill_history():
+    """ Jobs finished before the history table existed """
+    with closing(connect()) as conn:
+        ensure_history(conn)
+        rows = conn.execute(f'SELECT id FROM jobs WHERE status = ? AND kind IN ({",".join("?" * len(HISTORY_KINDS))}) '
+                            'AND id NOT IN (SELECT id FROM history)', (DONE, *HISTORY_KINDS)).fetchall()
+    for row in rows:
+        record_history(row['id'])
+    return len(rows)
+
+
+def search_history(text='', limit=MAX_ROWS):
+    """ Most recent first; every word of text has to appear in the description """
+    words = text.lower().split()
+    where = ' AND '.join(['search_text LIKE ?'] * len(words)) or '1'
+    with closing(connect()) as conn:
+        ensure_history(conn)
+        rows = conn.execute(f'SELECT id, kind, description, parameters, inferences, created, started, finished FROM history '
+                            f'WHERE {where} ORDER BY finished DESC LIMIT ?', (*[f'%{word}%' for word in words], limit)).fetchall()
+    return [{'id': row['id'], 'Finished': time.strftime('%Y-%m-%d %H:%M', time.localtime(row['finished'])),
+             'Query': row['description'], 'Kind': row['kind'], 'Inferences': row['inferences'],
+             'Parameters': ', '.join(f"{key}={value}" for key, value in orjson.loads(row['parameters']).items()
+                                     if key != 'predicates_to_exclude'),
+             'Seconds': round(row['finished'] - (row['started'] or row['created']), 1)} for row in rows]
@@ -0,0 +1,128 @@
+from bisect import bisect_left
+import numpy as np
+from src.session_state import answerset_state
+from src.typeahead import WORD_BOUNDARY
+from src.answerset_index import ENRICHMENT2GROUP, GROUP2CURIE
+
+# a query word also matches the words it begins, up to this many of them
+MAX_PREFIX_TERMS = 200
+# words this long or longer tolerate one typo, FUZZY_TWO_EDITS or longer two
+FUZZY_ONE_EDIT = 4
+FUZZY_TWO_EDITS = 8
+
+
+def words( text ):
+    return {word.lower() for word in WORD_BOUNDARY.split(str(text)) if word}
+
+
+def trigrams( term ):
+    padded = f'^{term}$'
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance( a, b, limit ):
+    """ Edits (insert, delete, substitute, swap two neighbours) from a to b, or limit + 1 once it must exceed limit """
+    before, previous = None, list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+            if before is not None and j > 1 and char_a == b[j - 2] and a[i - 2] == char_b:
+                current[j] = min(current[j], before[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return previous[-1]
+
+
+def inference_text( inference_edge, kg_nodes, kg_edges, support_index ):
+    """ What an inference can be found by: both ends' names and curies, its predicate, the enrichment groups and
+        enriched nodes of its support graphs, and the knowledge sources of all those edges """
+    edges = [kg_edges[inference_edge]]
+    for graph in support_index['inferences'][inference_edge]:
+        support_graph = support_index['support_graphs'][graph]
+        edges.extend(kg_edges[support_graph[role]] for role in (ENRICHMENT2GROUP, GROUP2CURIE) if support_graph.get(role))
+    text = []
+    for edge in edges:
+        for node in (edge['subject'], edge['object']):
+            text.extend((node, kg_nodes.get(node, {}).get('name') or ''))
+        text.append(edge['predicate'])
+        text.extend(source.get('resource_id', '') for source in edge.get('sources') or [])
+    return text
+
+
+class InferenceSearch:
+    """ Inverted index from words to inferences; postings hold rank positions, so matches come back best first """
+
+    def __init__( self, order, kg_nodes, kg_edges, support_index ):
+        self.order = order
+        postings = {}
+        for position, inference_edge in enumerate(order):
+            for word in set().union(*map(words, inference_text(inference_edge, kg_nodes, kg_edges, support_index))):
+                postings.setdefault(word, []).append(position)
+        self.terms = sorted(postings)
+        self.postings = [np.array(postings[term], dtype=np.int32) for term in self.terms]
+        grams = {}
+        for term_id, term in enumerate(self.terms):
+            for gram in trigrams(term):
+                grams.setdefault(gram, []).append(term_id)
+        self.grams = {gram: np.array(term_ids, dtype=np.int32) for gram, term_ids in grams.items()}
+        self.lengths = np.array([len(term) for term in self.terms], dtype=np.int32)
+
+    def prefix_terms( self, word ):
+        start = bisect_left(self.terms, word)
+        end = start
+        while end < len(self.terms) and end - start < MAX_PREFIX_TERMS and self.terms[end].startswith(word):
+            end += 1
+        return range(start, end)
+
+    def fuzzy_terms( self, word ):
+        """ Terms within one or two edits: trigram counts narrow the vocabulary down, edit distance decides """
+        limit = 2 if len(word) >= FUZZY_TWO_EDITS else 1 if len(word) >= FUZZY_ONE_EDIT else 0
+        if not limit:
+            return []
+        word_grams = trigrams(word)
+        found = [self.grams[gram] for gram in word_grams if gram in self.grams]
+        if not found:
+            return []
+        # an edit changes at most three trigrams, a swap four
+        candidates, shared = np.unique(np.concatenate(found), return_counts=True)
+        keep = (shared >= len(word_grams) - 4 * limit) & (np.abs(self.lengths[candidates] - len(word)) <= limit)
+        return [term_id for term_id in candidates[keep].tolist() if edit_distance(word, self.terms[term_id], limit) <= limit]
+
+    def matches( self, word ):
+        term_ids = set(self.prefix_terms(word))
+        # a word found as it was typed is taken to be spelled right
+        if not term_ids or self.terms[min(term_ids)] != word:
+            term_ids.update(self.fuzzy_terms(word))
+        if not term_ids:
+            return np.empty(0, dtype=np.int32)
+        return np.unique(np.concatenate([self.postings[term_id] for term_id in term_ids]))
+
+    def nbytes( self ):
+        # numpy arrays carry about 112 bytes of header each, a short str about 57 (measured with tracemalloc)
+        arrays = [*self.postings, *self.grams.values()]
+        return (sum(array.nbytes for array in arrays) + 112 * len(arrays) + self.lengths.nbytes
+                + sum(57 + len(term) for term in self.terms) + 8 * len(self.terms))
+
+    def search( self, text ):
+        """ Inferences matching every word of text, exactly, as a prefix or with a typo, in rank order """
+        positions = None
+        for word in sorted(words(text), key=len, reverse=True):
+            found = self.matches(word)
+            positions = found if positions is None else np.intersect1d(positions, found, assume_unique=True)
+            if not len(positions):
+                break
+        if positions is None:
+            return list(self.order)
+        return [self.order[position] for position in positions.tolist()]
+
+
+def inference_search( handle ):
+    """ Built once per answer set and worker and kept with it in answerset_state """
+    search = answerset_state.derived(handle, 'inference_search', lambda indexed: InferenceSearch(
+        indexed['ranking_index']['order'], indexed['kg_nodes'], indexed['kg_edges'], indexed['support_index']),
+        InferenceSearch.nbytes)
+    if search is None:
+        raise KeyError(f"No indexed answer set for {handle}")
+    return search
@@ -0,0 +1,391 @@
+import argparse
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing
+import orjson
+from src.utils import LoggingUtil, DATA_DIR, set_log_context, reset_log_context
+from src.metrics import flush, inc, observe, stage_timer
+
+this_dir = os.path.dirname(os.path.realpath(__file__))
+
+logger = LoggingUtil.init_logging('jobs', level=logging.WARNING, format='long', logFilePath=this_dir + '/')
+
+DB_PATH = os.path.join(DATA_DIR, 'jobs.sqlite')
+RESULTS_DIR = os.path.join(DATA_DIR, 'results')
+UPLOADS_DIR = os.path.join(DATA_DIR, 'uploads')
+POLL_INTERVAL = 0.5
+SUPERVISE_INTERVAL = 2
+# a queued or running job older than this is presumed lost and is not attached to
+ATTACH_WINDOW = float(os.environ.get('EDGAR_ATTACH_WINDOW', 3600))
+# a running job holds a lease its worker renews; once it lapses the worker is presumed dead and the job is requeued
+JOB_LEASE = float(os.environ.get('EDGAR_JOB_LEASE', 60))
+# a job that has lost its worker this many times (e.g. it is what gets OOM-killed) is failed instead of retried
+MAX_ATTEMPTS = int(os.environ.get('EDGAR_JOB_ATTEMPTS', 2))
+# finished jobs and everything they left on disk are deleted after this many seconds; 0 keeps them forever
+JOB_TTL = float(os.environ.get('EDGAR_JOB_TTL', 14 * 24 * 3600))
+RETENTION_SWEEP_INTERVAL = 3600
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Artifacts a job can leave behind under its handle
+RESPONSE = 'response'
+INDEXED = 'indexed'
+NAMES = 'names'
+
+
+def connect():
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                        id TEXT PRIMARY KEY, kind TEXT NOT NULL, payload BLOB, status TEXT NOT NULL,
+                        summary BLOB, error TEXT, created REAL, started REAL, finished REAL, query_key TEXT, progress REAL,
+                        lease REAL, attempts INTEGER DEFAULT 0)''')
+    columns = {row['name'] for row in conn.execute('PRAGMA table_info(jobs)')}
+    if 'query_key' not in columns:
+        conn.execute('ALTER TABLE jobs ADD COLUMN query_key TEXT')
+    if 'progress' not in columns:
+        conn.execute('ALTER TABLE jobs ADD COLUMN progress REAL')
+    if 'lease' not in columns:
+        conn.execute('ALTER TABLE jobs ADD COLUMN lease REAL')
+        conn.execute('ALTER TABLE jobs ADD COLUMN attempts INTEGER DEFAULT 0')
+    conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)')
+    conn.execute('CREATE INDEX IF NOT EXISTS jobs_query_key ON jobs (query_key, finished)')
+    return conn
+
+
+def submit_job(kind, payload, query_key=None):
+    handle = uuid.uuid4().hex
+    with closing(connect()) as conn:
+        conn.execute('INSERT INTO jobs (id, kind, payload, status, created, query_key) VALUES (?, ?, ?, ?, ?, ?)',
+                     (handle, kind, orjson.dumps(payload), QUEUED, time.time(), query_key))
+    return handle
+
+
+def submit_or_attach(kind, payload, query_key):
+    """ Single-flight submit: an identical query already queued or running is joined instead of run again """
+    with closing(connect()) as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        # only a job that is waiting its turn or still has a live worker is worth joining
+        now = time.time()
+        rows = conn.execute('SELECT id, kind, payload FROM jobs WHERE query_key = ? AND ((status = ? AND created > ?) OR '
+                            '(status = ? AND COALESCE(lease, started + ?) > ?)) ORDER BY created',
+                            (query_key, QUEUED, now - ATTACH_WINDOW, RUNNING, JOB_LEASE, now)).fetchall()
+        for row in rows:
+            if row['kind'] == kind and orjson.loads(row['payload']) == payload:
+                conn.execute('COMMIT')
+                inc('edgar_singleflight_total', outcome='attached', kind=kind)
+                return row['id']
+        handle = uuid.uuid4().hex
+        conn.execute('INSERT INTO jobs (id, kind, payload, status, created, query_key) VALUES (?, ?, ?, ?, ?, ?)',
+                     (handle, kind, orjson.dumps(payload), QUEUED, time.time(), query_key))
+        conn.execute('COMMIT')
+    inc('edgar_singleflight_total', outcome='submitted', kind=kind)
+    return handle
+
+
+def get_job(handle):
+    with closing(connect()) as conn:
+        row = conn.execute('SELECT id, kind, status, summary, error, created, started, finished, progress FROM jobs WHERE id = ?',
+                           (handle,)).fetchone()
+    if row is None:
+        return None
+    job = dict(row)
+    job['summary'] = orjson.loads(job['summary']) if job['summary'] else {}
+    return job
+
+
+def find_jobs(query_key):
+    # finished answer sets for the same query, most recent first
+    with closing(connect()) as conn:
+        rows = conn.execute('SELECT id, kind, payload FROM jobs WHERE query_key = ? AND status = ? ORDER BY finished DESC',
+                            (query_key, DONE)).fetchall()
+    return [{'id': row['id'], 'kind': row['kind'], 'payload': orjson.loads(row['payload'])} for row in rows]
+
+
+def reclaim_lost_jobs(conn, now):
+    # running rows from before leases existed count from their start
+    lapsed = 'status = ? AND COALESCE(lease, started + ?) < ?'
+    conn.execute(f'UPDATE jobs SET status = ?, error = ?, finished = ? WHERE {lapsed} AND attempts >= ?',
+                 (FAILED, 'Compute worker lost while running this job', now, RUNNING, JOB_LEASE, now, MAX_ATTEMPTS))
+    requeued = conn.execute(f'UPDATE jobs SET status = ?, lease = NULL, progress = NULL WHERE {lapsed}',
+                            (QUEUED, RUNNING, JOB_LEASE, now)).rowcount
+    if requeued:
+        logger.warning(f"Requeued {requeued} jobs whose compute worker stopped renewing its lease")
+
+
+def claim_job():
+    with closing(connect()) as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        now = time.time()
+        reclaim_lost_jobs(conn, now)
+        row = conn.execute('SELECT id, kind, payload FROM jobs WHERE status = ? ORDER BY created LIMIT 1',
+                           (QUEUED,)).fetchone()
+        if row is not None:
+            conn.execute('UPDATE jobs SET status = ?, started = ?, lease = ?, attempts = COALESCE(attempts, 0) + 1 WHERE id = ?',
+                         (RUNNING, now, now + JOB_LEASE, row['id']))
+        conn.execute('COMMIT')
+    if row is None:
+        return None
+    return {'id': row['id'], 'kind': row['kind'], 'payload': orjson.loads(row['payload'])}
+
+
+def renew_lease(handle, stop):
+    """ Runs beside a job in its worker: while the process is alive the job keeps its lease """
+    while not stop.wait(JOB_LEASE / 3):
+        try:
+            with closing(connect()) as conn:
+                conn.execute('UPDATE jobs SET lease = ? WHERE id = ? AND status = ?', (time.time() + JOB_LEASE, handle, RUNNING))
+        except sqlite3.Error as e:
+            logger.warning(f"Could not renew the lease of {handle}: {str(e)}")
+
+
+def set_progress(handle, fraction):
+    # long jobs report how far along they are; the UI polls it through get_job
+    with closing(connect()) as conn:
+        conn.execute('UPDATE jobs SET progress = ? WHERE id = ?', (fraction, handle))
+
+
+def finish_job(handle, summary):
+    with closing(connect()) as conn:
+        conn.execute('UPDATE jobs SET status = ?, summary = ?, finished = ? WHERE id = ?',
+                     (DONE, orjson.dumps(summary), time.time(), handle))
+
+
+def fail_job(handle, error):
+    with closing(connect()) as conn:
+        conn.execute('UPDATE jobs SET status = ?, error = ?, finished = ? WHERE id = ?',
+                     (FAILED, error, time.time(), handle))
+
+
+def result_path(handle, artifact):
+    return os.path.join(RESULTS_DIR, f'{handle}.{artifact}.json')
+
+
+def save_result(handle, artifact, content):
+    path = result_path(handle, artifact)
+    with open(f'{path}.tmp', 'wb') as outf:
+        outf.write(content)
+    os.replace(f'{path}.tmp', path)
+
+
+def load_result(handle, artifact):
+    try:
+        with open(result_path(handle, artifact), 'rb') as inf:
+            return orjson.loads(inf.read())
+    except FileNotFoundError:
+        return None
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def sweep_expired(now=None):
+    """ Deletes jobs finished more than JOB_TTL ago with their results, uploads and reports, then uploads and chain
+        sub-query answers that old; returns how many jobs went """
+    from src.chains import SUBQUERY_DIR
+    from src.report import REPORTS_DIR, report_path
+
+    if not JOB_TTL:
+        return 0
+    cutoff = (now or time.time()) - JOB_TTL
+    with closing(connect()) as conn:
+        rows = conn.execute('SELECT id, kind, payload FROM jobs WHERE status IN (?, ?) AND finished < ?',
+                            (DONE, FAILED, cutoff)).fetchall()
+        handles = [(row['id'],) for row in rows]
+        conn.execute('BEGIN IMMEDIATE')
+        conn.executemany('DELETE FROM jobs WHERE id = ?', handles)
+        # the query history would otherwise offer to reopen answer sets that are gone
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'history'").fetchone():
+            conn.executemany('DELETE FROM history WHERE id = ?', handles)
+        conn.execute('COMMIT')
+    for row in rows:
+        for artifact in (RESPONSE, INDEXED, NAMES):
+            remove_file(result_path(row['id'], artifact))
+        remove_file(report_path(row['id']))
+        shutil.rmtree(os.path.join(REPORTS_DIR, row['id']), ignore_errors=True)
+        if row['kind'] == 'ingest':
+            remove_file(orjson.loads(row['payload'])['path'])
+    # uploads nobody submitted, and sub-query answers that are simply asked for again
+    for directory in (UPLOADS_DIR, SUBQUERY_DIR):
+        if os.path.isdir(directory):
+            for entry in os.scandir(directory):
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    remove_file(entry.path)
+    if rows:
+        logger.info(f"Deleted {len(rows)} jobs finished before {time.strftime('%Y-%m-%d %H:%M', time.localtime(cutoff))}")
+    return len(rows)
+
+
+def save_upload(content):
+    os.makedirs(UPLOADS_DIR, exist_ok=True)
+    path = os.path.join(UPLOADS_DIR, f'{uuid.uuid4().hex}.json')
+    with open(path, 'wb') as outf:
+        outf.write(content)
+    return path
+
+
+########## Job handlers #############
+def ingest(handle, answerset):
+    # imported here so the web tier never pays for it and workers only pay once
+    from src.visualization import check_answerset, index_answerset
+
+    error = check_answerset(answerset)
+    if error:
+        raise ValueError(error)
+    indexed = index_answerset(answerset)
+    with stage_timer('ingest.save'):
+        save_result(handle, INDEXED, orjson.dumps(indexed))
+        # the curies a query was about and the answers it found feed the curie typeahead
+        kg_nodes = indexed['kg_nodes']
+        curies = {curie for node in indexed['query_graph']['nodes'].values() for curie in node.get('ids') or []}
+        curies.update(binding['id'] for result in indexed['results'] for bindings in result['node_bindings'].values()
+                      for binding in bindings)
+        save_result(handle, NAMES, orjson.dumps({curie: kg_nodes.get(curie, {}).get('name') for curie in curies}))
+    return {'query_graph': indexed['query_graph'], 'inferences': len(indexed['ranking_index']['order'])}
+
+
+def run_answercoalesce(handle, payload):
+    from src.answercoalesce import send_post_request
+
+    content = send_post_request(payload)
+    save_result(handle, RESPONSE, content)
+    with stage_timer('ingest.parse'):
+        answerset = orjson.loads(content)
+    return ingest(handle, answerset)
+
+
+def run_ingest(handle, payload):
+    with stage_timer('ingest.parse'), open(payload['path'], 'rb') as inf:
+        answerset = orjson.loads(inf.read())
+    summary = ingest(handle, answerset)
+    summary['label'] = payload.get('label', handle[:8])
+    return summary
+
+
+def run_derive(handle, payload):
+    from src.requery import derive_answerset
+
+    with stage_timer('derive.filter'):
+        answerset = derive_answerset(payload['source'], payload['parameters'])
+    save_result(handle, RESPONSE, orjson.dumps(answerset))
+    return ingest(handle, answerset)
+
+
+def run_chain(handle, payload):
+    from src.chains import run_chain as answer_chain
+
+    answerset = answer_chain(payload)
+    save_result(handle, RESPONSE, orjson.dumps(answerset))
+    return ingest(handle, answerset)
+
+
+def run_report(handle, payload):
+    from src.report import write_report
+
+    return write_report(handle, payload['source'], payload['formats'])
+
+
+JOB_HANDLERS = {
+    'answercoalesce': run_answercoalesce,
+    'ingest': run_ingest,
+    'derive': run_derive,
+    'chain': run_chain,
+    'report': run_report,
+}
+
+
+def run_job(job):
+    from src.history import record_history
+
+    token = set_log_context(job_id=job['id'])
+    start_time = time.perf_counter()
+    stop_renewing = threading.Event()
+    threading.Thread(target=renew_lease, args=(job['id'], stop_renewing), name='edgar-lease', daemon=True).start()
+    try:
+        summary = JOB_HANDLERS[job['kind']](job['id'], job['payload'])
+        finish_job(job['id'], summary)
+        record_history(job['id'])
+        logger.info(f"{job['kind']} job done", extra={'duration': time.perf_counter() - start_time})
+    except Exception as e:
+        logger.error(f"Error in {job['kind']} job {job['id']}: {type(e).__name__}: {str(e)}",
+                     extra={'duration': time.perf_counter() - start_time})
+        fail_job(job['id'], f"{type(e).__name__}: {str(e)}")
+    finally:
+        stop_renewing.set()
+        observe('edgar_job_seconds', time.perf_counter() - start_time, kind=job['kind'])
+        flush()
+        reset_log_context(token)
+
+
+def run_worker(poll_interval=POLL_INTERVAL, stop=None):
+    stop = stop or threading.Event()
+    parent = os.getppid()
+    last_sweep = 0.0
+    # a worker orphaned by its supervisor finishes what it has and leaves the queue to the replacement tier
+    while not stop.is_set() and os.getppid() == parent:
+        job = claim_job()
+        if job is None:
+            # an idle worker clears out expired jobs; a second worker doing the same at once deletes nothing twice
+            if time.time() - last_sweep > RETENTION_SWEEP_INTERVAL:
+                last_sweep = time.time()
+                try:
+                    sweep_expired()
+                except Exception as e:
+                    logger.warning(f"Retention sweep failed: {type(e).__name__}: {str(e)}")
+            stop.wait(poll_interval)
+            continue
+        run_job(job)
+
+
+def worker_main(poll_interval=POLL_INTERVAL):
+    # SIGTERM means stop claiming; the job in hand is finished, so a deploy does not strand it half done
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    run_worker(poll_interval, stop)
+
+
+def start_worker(index):
+    worker = multiprocessing.Process(target=worker_main, name=f'edgar-worker-{index}', daemon=True)
+    worker.start()
+    return worker
+
+
+def start_workers(count):
+    return [start_worker(i) for i in range(count)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='EDGAR compute workers')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('EDGAR_COMPUTE_WORKERS', os.cpu_count())))
+    args = parser.parse_args()
+    workers = start_workers(args.workers)
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    # a worker that dies (OOM kill, crash) is replaced; its job is requeued once its lease lapses
+    while not stopping.wait(SUPERVISE_INTERVAL):
+        for i, worker in enumerate(workers):
+            if not worker.is_alive():
+                logger.warning(f"Compute worker {worker.pid} exited with {worker.exitcode}, starting a new one")
+                workers[i] = start_worker(i)
+    # pass the SIGTERM on and wait for the workers to finish their current jobs
+    for worker in workers:
+        worker.terminate()
+    for worker in workers:
+        worker.join()
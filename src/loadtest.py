@@ -0,0 +1,296 @@
+import argparse
+import glob
+import logging
+import math
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import orjson
+import requests
+from src.utils import LoggingUtil
+
+this_dir = os.path.dirname(os.path.realpath(__file__))
+
+logger = LoggingUtil.init_logging('loadtest', level=logging.WARNING, format='long', logFilePath=this_dir + '/')
+
+# Replays what an analyst's browser sends: submit, poll, visualize, select rows, tap an edge.
+# Run the app against src.mock_answercoalesce so only EDGAR itself is being measured.
+
+QUERIES = [
+    ("biolink:Drug", "biolink:treats", "biolink:Disease"),
+    ("biolink:Gene", "biolink:genetically_associated_with", "biolink:Disease"),
+    ("biolink:Gene", "biolink:affects", "biolink:PhenotypicFeature"),
+]
+SAMPLE_INTERVAL = 0.5
+
+
+def callback_outputs( output ):
+    # "..a.children...b.value.." for several outputs, "a.children" (maybe with an @hash) for one
+    parts = output[2:-2].split('...') if output.startswith('..') else [output]
+    return [dict(zip(('id', 'property'), part.rsplit('.', 1))) for part in parts]
+
+
+def find_callback( dependencies, output_id, input_id ):
+    for dependency in dependencies:
+        if dependency.get('clientside_function'):
+            continue
+        if any(output['id'] == output_id for output in callback_outputs(dependency['output'])) and \
+                any(item['id'] == input_id for item in dependency['inputs']):
+            return dependency
+    raise LookupError(f"No server callback from {input_id} to {output_id}")
+
+
+def find_component( tree, component_id ):
+    """ Depth-first search of a serialized layout for the props of the component with this id """
+    if isinstance(tree, dict):
+        props = tree.get('props')
+        if isinstance(props, dict) and props.get('id') == component_id:
+            return props
+        children = tree.values()
+    elif isinstance(tree, list):
+        children = tree
+    else:
+        return None
+    for child in children:
+        found = find_component(child, component_id)
+        if found is not None:
+            return found
+    return None
+
+
+def find_elements( tree ):
+    if isinstance(tree, dict):
+        props = tree.get('props')
+        if tree.get('type') == 'Cytoscape' and isinstance(props, dict):
+            return props.get('elements') or []
+        children = tree.values()
+    elif isinstance(tree, list):
+        children = tree
+    else:
+        return []
+    for child in children:
+        elements = find_elements(child)
+        if elements:
+            return elements
+    return []
+
+
+class DashSession:
+    """ One browser tab: the component values it holds, and the callback requests it makes """
+
+    def __init__( self, base_url, dependencies, timings, errors ):
+        self.base_url = base_url.rstrip('/')
+        self.dependencies = dependencies
+        self.timings = timings
+        self.errors = errors
+        self.http = requests.Session()
+        self.values = {}
+
+    def get( self, step, path ):
+        start_time = time.perf_counter()
+        response = self.http.get(self.base_url + path)
+        self.record(step, start_time, response)
+
+    def fire( self, step, output_id, changed ):
+        """ POST the callback that writes output_id when the (id, property) keys of changed change """
+        input_id = next(iter(changed))[0]
+        dependency = find_callback(self.dependencies, output_id, input_id)
+        values = {**self.values, **changed}
+        outputs = callback_outputs(dependency['output'])
+        payload = {
+            'output': dependency['output'],
+            'outputs': outputs if dependency['output'].startswith('..') else outputs[0],
+            'inputs': [{**item, 'value': values.get((item['id'], item['property']))} for item in dependency['inputs']],
+            'state': [{**item, 'value': values.get((item['id'], item['property']))} for item in dependency['state']],
+            'changedPropIds': [f"{component_id}.{prop}" for component_id, prop in changed],
+        }
+        self.values.update(changed)
+        start_time = time.perf_counter()
+        response = self.http.post(f"{self.base_url}/_dash-update-component", data=orjson.dumps(payload),
+                                  headers={'Content-Type': 'application/json', 'X-Request-ID': uuid.uuid4().hex})
+        self.record(step, start_time, response)
+        if response.status_code == 204 or not response.ok:
+            return {}
+        updates = response.json()['response']
+        for component_id, props in updates.items():
+            for prop, value in props.items():
+                self.values[component_id, prop] = value
+        return updates
+
+    def record( self, step, start_time, response ):
+        self.timings[step].append(time.perf_counter() - start_time)
+        if response.status_code >= 400:
+            self.errors[step] += 1
+            logger.warning(f"{step}: HTTP {response.status_code}")
+
+
+def analyst( base_url, dependencies, query, curie, timings, errors, poll_interval=0.5, timeout=600 ):
+    """ One analyst's visit, from submitting a query to reading an edge's support graph """
+    source_category, predicate, target_category = query
+    session = DashSession(base_url, dependencies, timings, errors)
+    session.values.update({('source', 'value'): '', ('target', 'value'): curie,
+                           ('source_dropdown', 'value'): source_category, ('predicate_dropdown', 'value'): predicate,
+                           ('target_dropdown', 'value'): target_category})
+    session.get('page', '/edgar_dashboard')
+
+    start_time = time.perf_counter()
+    session.fire('submit', 'response-output-store', {('send-request-button', 'n_clicks'): 1})
+    intervals = 0
+    while session.values.get(('progress-gauge', 'value')) != 100:
+        if time.perf_counter() - start_time > timeout:
+            errors['timeout'] += 1
+            return
+        time.sleep(poll_interval)
+        intervals += 1
+        session.fire('poll', 'response-output-store', {('progress-interval', 'n_intervals'): intervals})
+    timings['answer'].append(time.perf_counter() - start_time)
+    if session.values.get(('visualize-button', 'disabled')):
+        errors['failed'] += 1
+        return
+
+    session.fire('visualize', 'output-data', {('visualize-button', 'n_clicks'): 1})
+    session.fire('load stores', 'stored-inferred-df', {('answerset-input', 'data'): session.values[('response-output-store', 'data')]})
+    updates = session.fire('inference table', 'result-table-container',
+                           {('stored-inferred-df', 'data'): session.values.get(('stored-inferred-df', 'data'))})
+    table = find_component(updates, 'result-table') or {}
+    rows = [row['id'] for row in (table.get('data') or [])[:2]]
+    if not rows:
+        errors['empty'] += 1
+        return
+    updates = session.fire('select rows', 'cytoscape-cards', {('result-table', 'derived_virtual_selected_row_ids'): rows})
+    edges = [element['data'] for element in find_elements(updates) if 'source' in element['data']]
+    if edges:
+        # the browser's tapEdge -> stored-edge-data hop is a pattern-matching callback; replay what it stores
+        edge = next((data for data in edges if data.get('role')), edges[0])
+        session.fire('tap edge', 'edge-data-table-div', {('stored-edge-data', 'data'): edge})
+
+
+def visit( *args ):
+    # a failed visit is counted, not allowed to vanish inside the thread pool
+    errors = args[5]
+    try:
+        analyst(*args)
+    except Exception as e:
+        errors['exception'] += 1
+        logger.error(f"Analyst session failed: {type(e).__name__}: {str(e)}")
+
+
+def ancestors( pid ):
+    pids = set()
+    while pid > 1:
+        pids.add(pid)
+        try:
+            with open(f'/proc/{pid}/stat') as inf:
+                pid = int(inf.read().rsplit(')', 1)[1].split()[1])
+        except OSError:
+            break
+    return pids
+
+
+class MemorySampler(threading.Thread):
+    """ Peak resident memory of every process whose command line matches, sampled from /proc """
+
+    def __init__( self, match ):
+        super().__init__(daemon=True)
+        self.match = match
+        self.peaks = {}
+        # this driver and the shells that started it mention the match too
+        self.own = ancestors(os.getpid())
+        self.stopped = threading.Event()
+
+    def run( self ):
+        while not self.stopped.is_set():
+            self.sample()
+            self.stopped.wait(SAMPLE_INTERVAL)
+
+    def sample( self ):
+        for path in glob.glob('/proc/[0-9]*/cmdline'):
+            pid = int(path.split('/')[2])
+            if pid in self.own:
+                continue
+            try:
+                with open(path, 'rb') as inf:
+                    cmdline = inf.read().replace(b'\0', b' ').decode(errors='replace').strip()
+                if self.match not in cmdline:
+                    continue
+                with open(os.path.join(os.path.dirname(path), 'status')) as inf:
+                    rss = next(int(line.split()[1]) * 1024 for line in inf if line.startswith('VmRSS:'))
+            except (OSError, StopIteration):
+                continue
+            previous = self.peaks.get(pid, (0, cmdline))[0]
+            self.peaks[pid] = (max(previous, rss), cmdline)
+
+    def stop( self ):
+        self.stopped.set()
+        self.join()
+        self.sample()
+
+
+def percentile( values, q ):
+    # nearest rank, so a p99 over few samples is a sample that was actually observed
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+def summarize( timings, errors, memory, wall_time, sessions ):
+    steps = {step: {'count': len(values), 'errors': errors.get(step, 0), 'p50': percentile(values, 0.5),
+                    'p99': percentile(values, 0.99), 'max': max(values)}
+             for step, values in timings.items() if values}
+    return {'sessions': sessions, 'wall_seconds': wall_time, 'sessions_per_minute': 60 * sessions / wall_time,
+            'steps': steps, 'failures': {kind: count for kind, count in errors.items() if kind not in timings},
+            'memory': [{'pid': pid, 'peak_rss_mb': rss / 2 ** 20, 'cmdline': cmdline}
+                       for pid, (rss, cmdline) in sorted(memory.items())]}
+
+
+def print_report( report ):
+    print(f"{report['sessions']} sessions in {report['wall_seconds']:.1f}s ({report['sessions_per_minute']:.1f}/min)")
+    print(f"{'step':<18}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for step, stats in report['steps'].items():
+        print(f"{step:<18}{stats['count']:>7}{stats['errors']:>8}{stats['p50'] * 1000:>10.0f}{stats['p99'] * 1000:>10.0f}"
+              f"{stats['max'] * 1000:>10.0f}")
+    for kind, count in report['failures'].items():
+        print(f"{kind}: {count}")
+    for process in report['memory']:
+        print(f"pid {process['pid']:>7} peak {process['peak_rss_mb']:8.1f} MB  {process['cmdline'][:80]}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Replay analyst sessions against a running EDGAR and report latency and memory')
+    parser.add_argument('--url', default='http://localhost:8050')
+    parser.add_argument('--users', type=int, default=10, help='concurrent analysts')
+    parser.add_argument('--sessions', type=int, default=50, help='analyst visits in total')
+    parser.add_argument('--ramp', type=float, default=10.0, help='seconds over which the first users arrive')
+    parser.add_argument('--poll-interval', type=float, default=0.5)
+    parser.add_argument('--match', default='app.py', help='command line substring of the server processes to measure')
+    parser.add_argument('--json', help='also write the report here')
+    parser.add_argument('--max-p99', type=float, help='exit non-zero if any step p99 exceeds this many seconds')
+    args = parser.parse_args()
+
+    dependencies = requests.get(args.url.rstrip('/') + '/_dash-dependencies').json()
+    timings = defaultdict(list)
+    errors = defaultdict(int)
+    # fresh curies per run, so every session really asks AnswerCoalesce instead of reusing an earlier answer
+    run_id = uuid.uuid4().hex[:8]
+    sampler = MemorySampler(args.match)
+    sampler.start()
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        for index in range(args.sessions):
+            if index < args.users:
+                time.sleep(args.ramp / args.users)
+            pool.submit(visit, args.url, dependencies, QUERIES[index % len(QUERIES)], f"LOADTEST:{run_id}-{index}",
+                        timings, errors, args.poll_interval)
+    wall_time = time.perf_counter() - start_time
+    sampler.stop()
+
+    report = summarize(timings, errors, sampler.peaks, wall_time, args.sessions)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'wb') as outf:
+            outf.write(orjson.dumps(report, option=orjson.OPT_INDENT_2))
+    if args.max_p99 is not None and any(stats['p99'] > args.max_p99 for stats in report['steps'].values()):
+        sys.exit(1)
@@ -0,0 +1,271 @@
+import cProfile
+import functools
+import glob
+import inspect
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+import orjson
+from src.utils import DATA_DIR, LoggingUtil, set_log_context, reset_log_context
+
+this_dir = os.path.dirname(os.path.realpath(__file__))
+
+logger = LoggingUtil.init_logging('metrics', level=logging.WARNING, format='long', logFilePath=this_dir + '/')
+
+METRICS_DIR = os.path.join(DATA_DIR, 'metrics')
+PROFILE_DIR = os.environ.get('EDGAR_PROFILE_DIR')
+PROFILE_MATCH = os.environ.get('EDGAR_PROFILE_MATCH', '')
+FLUSH_INTERVAL = 5
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9)
+
+HELP = {
+    'edgar_callback_seconds': ('histogram', 'Dash callback request latency'),
+    'edgar_callback_request_bytes': ('histogram', 'Dash callback request payload size'),
+    'edgar_callback_response_bytes': ('histogram', 'Dash callback response payload size before compression'),
+    'edgar_callback_errors_total': ('counter', 'Dash callback requests answered with an error status'),
+    'edgar_stage_seconds': ('histogram', 'Time spent in answer-set processing stages'),
+    'edgar_upstream_seconds': ('histogram', 'Latency of calls to upstream services'),
+    'edgar_job_seconds': ('histogram', 'Compute job run time'),
+    'edgar_chain_subqueries_total': ('counter', 'AnswerCoalesce calls made for chained queries, by cache outcome'),
+    'edgar_singleflight_total': ('counter', 'Query submissions that started a job or attached to an identical one in flight'),
+    'edgar_session_state_total': ('counter', 'Answer-set state lookups and evictions in the web workers, by outcome'),
+    'edgar_session_state_bytes': ('histogram', 'Estimated in-memory size of answer sets loaded by the web workers'),
+    'edgar_validation_failures_total': ('counter', 'Answer sets rejected at ingestion, by validation stage'),
+    'edgar_typeahead_seconds': ('histogram', 'Typeahead lookup latency'),
+}
+
+_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_counters = defaultdict(float)
+_histograms = {}
+_last_flush = 0.0
+
+
+def _forget_parent():
+    # a forked process (gunicorn worker, compute worker) reports its own totals, not a copy of its parent's
+    global _lock, _flush_lock
+    _lock = threading.Lock()
+    _flush_lock = threading.Lock()
+    _counters.clear()
+    _histograms.clear()
+
+
+os.register_at_fork(after_in_child=_forget_parent)
+
+
+def _key( name, labels ):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc( name, value=1, **labels ):
+    with _lock:
+        _counters[_key(name, labels)] += value
+    _maybe_flush()
+
+
+def observe( name, value, buckets=BUCKETS, **labels ):
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.setdefault(key, {'buckets': list(buckets), 'counts': [0] * len(buckets), 'sum': 0.0,
+                                                 'count': 0})
+        for i, bound in enumerate(histogram['buckets']):
+            if value <= bound:
+                histogram['counts'][i] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+    _maybe_flush()
+
+
+@contextmanager
+def stage_timer( stage ):
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe('edgar_stage_seconds', time.perf_counter() - start_time, stage=stage)
+
+
+def timed( stage ):
+    def decorator( func ):
+        @functools.wraps(func)
+        def wrapper( *args, **kwargs ):
+            with stage_timer(stage):
+                return func(*args, **kwargs)
+        # dash-extensions reads callback arguments with getfullargspec, which does not follow __wrapped__
+        wrapper.__signature__ = inspect.signature(func)
+        return wrapper
+    return decorator
+
+
+########## Cross-process aggregation #############
+def _snapshot():
+    with _lock:
+        return {
+            'counters': [[name, list(labels), value] for (name, labels), value in _counters.items()],
+            'histograms': [[name, list(labels), histogram] for (name, labels), histogram in _histograms.items()],
+        }
+
+
+def flush():
+    # every process (web or compute worker) leaves its totals where /metrics can merge them
+    with _flush_lock:
+        _write_snapshot()
+
+
+def _write_snapshot():
+    # called with _flush_lock held; a metrics write must never fail the request or job that triggered it
+    global _last_flush
+    _last_flush = time.time()
+    path = os.path.join(METRICS_DIR, f'{os.getpid()}.json')
+    tmp_path = f'{path}.{threading.get_ident()}.tmp'
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        with open(tmp_path, 'wb') as outf:
+            outf.write(orjson.dumps(_snapshot()))
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Could not write metrics to {path}: {type(e).__name__}: {str(e)}")
+        _remove(tmp_path)
+
+
+def _maybe_flush():
+    # one thread writes when the interval is up; the others carry on rather than queue behind it
+    if time.time() - _last_flush > FLUSH_INTERVAL and _flush_lock.acquire(blocking=False):
+        try:
+            if time.time() - _last_flush > FLUSH_INTERVAL:
+                _write_snapshot()
+        finally:
+            _flush_lock.release()
+
+
+def _alive( pid ):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _remove( path ):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _merged():
+    counters = defaultdict(float)
+    histograms = {}
+    snapshots = [_snapshot()]
+    own_file = os.path.join(METRICS_DIR, f'{os.getpid()}.json')
+    for path in glob.glob(os.path.join(METRICS_DIR, '*.json')):
+        if path == own_file:
+            continue
+        if not _alive(int(os.path.basename(path).split('.')[0])):
+            # a recycled worker's totals would otherwise be summed forever; scrapers see the drop as a counter reset
+            _remove(path)
+            continue
+        try:
+            with open(path, 'rb') as inf:
+                snapshot = orjson.loads(inf.read())
+        except FileNotFoundError:
+            continue
+        except ValueError as e:
+            # orjson.JSONDecodeError is a ValueError; a snapshot nobody can read is dropped, not served as a 500
+            logger.warning(f"Removing unreadable metrics snapshot {path}: {type(e).__name__}: {str(e)}")
+            _remove(path)
+            continue
+        snapshots.append(snapshot)
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            counters[name, tuple(map(tuple, labels))] += value
+        for name, labels, histogram in snapshot['histograms']:
+            merged = histograms.setdefault((name, tuple(map(tuple, labels))),
+                                           {'buckets': histogram['buckets'], 'counts': [0] * len(histogram['buckets']),
+                                            'sum': 0.0, 'count': 0})
+            merged['counts'] = [a + b for a, b in zip(merged['counts'], histogram['counts'])]
+            merged['sum'] += histogram['sum']
+            merged['count'] += histogram['count']
+    return counters, histograms
+
+
+def _escape( value ):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels( labels, **extra ):
+    pairs = [*labels, *extra.items()]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def render_metrics():
+    counters, histograms = _merged()
+    lines = []
+    for metric in sorted({name for name, _ in counters} | {name for name, _ in histograms}):
+        kind, description = HELP.get(metric, ('untyped', metric))
+        lines.append(f'# HELP {metric} {description}')
+        lines.append(f'# TYPE {metric} {kind}')
+        for (name, labels), value in sorted(counters.items()):
+            if name == metric:
+                lines.append(f'{metric}{_labels(labels)} {value}')
+        for (name, labels), histogram in sorted(histograms.items()):
+            if name == metric:
+                for bound, count in zip(histogram['buckets'], histogram['counts']):
+                    lines.append(f'{metric}_bucket{_labels(labels, le=bound)} {count}')
+                lines.append(f'{metric}_bucket{_labels(labels, le="+Inf")} {histogram["count"]}')
+                lines.append(f'{metric}_sum{_labels(labels)} {histogram["sum"]}')
+                lines.append(f'{metric}_count{_labels(labels)} {histogram["count"]}')
+    return '\n'.join(lines) + '\n'
+
+
+########## Flask hooks #############
+def instrument_server( server ):
+    from flask import g, request, Response
+
+    @server.before_request
+    def start_timer():
+        if request.path.endswith('/_dash-update-component'):
+            g.edgar_start = time.perf_counter()
+            g.edgar_callback = (request.get_json(silent=True) or {}).get('output', 'unknown')
+            g.edgar_log_token = set_log_context(request_id=request.headers.get('X-Request-ID', uuid.uuid4().hex),
+                                                callback=g.edgar_callback)
+            if PROFILE_DIR and PROFILE_MATCH in g.edgar_callback:
+                g.edgar_profiler = cProfile.Profile()
+                g.edgar_profiler.enable()
+
+    @server.after_request
+    def record_callback( response ):
+        if 'edgar_start' in g:
+            elapsed_time = time.perf_counter() - g.edgar_start
+            observe('edgar_callback_seconds', elapsed_time, callback=g.edgar_callback)
+            observe('edgar_callback_request_bytes', request.content_length or 0, SIZE_BUCKETS, callback=g.edgar_callback)
+            # after_request hooks run last registered first, so Dash's compression (registered with the app) comes later
+            if not response.is_streamed:
+                observe('edgar_callback_response_bytes', len(response.get_data()), SIZE_BUCKETS,
+                        callback=g.edgar_callback)
+            if response.status_code >= 400:
+                inc('edgar_callback_errors_total', callback=g.edgar_callback)
+            if 'edgar_profiler' in g:
+                g.edgar_profiler.disable()
+                os.makedirs(PROFILE_DIR, exist_ok=True)
+                name = ''.join(c if c.isalnum() else '_' for c in g.edgar_callback).strip('_')[:80]
+                g.edgar_profiler.dump_stats(os.path.join(PROFILE_DIR, f'{name}-{time.time():.0f}-{os.getpid()}.prof'))
+        return response
+
+    @server.teardown_request
+    def clear_log_context( exc ):
+        if 'edgar_log_token' in g:
+            reset_log_context(g.edgar_log_token)
+
+    @server.route('/metrics')
+    def metrics():
+        return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
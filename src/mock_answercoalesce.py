@@ -0,0 +1,128 @@
+import argparse
+import glob
+import hashlib
+import itertools
+import logging
+import os
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import orjson
+from src.utils import LoggingUtil
+
+this_dir = os.path.dirname(os.path.realpath(__file__))
+
+logger = LoggingUtil.init_logging('mock_answercoalesce', level=logging.WARNING, format='long', logFilePath=this_dir + '/')
+
+# A local stand-in for AnswerCoalesce, for load tests: point EDGAR_AC_URL at http://<host>:<port>/query
+
+
+def synthetic_answerset( query, inferences=100, groups=3, genes=50, seed=None ):
+    """ An AnswerCoalesce-shaped answer to a one-hop query: every inference supported by enrichment groups """
+    query_graph = query["message"]["query_graph"]
+    edge_key, edge = next(iter(query_graph["edges"].items()))
+    pinned_key = edge["object"] if query_graph["nodes"][edge["object"]].get("ids") else edge["subject"]
+    answer_key = edge["subject"] if pinned_key == edge["object"] else edge["object"]
+    pinned = query_graph["nodes"][pinned_key]["ids"][0]
+    answer_category = (query_graph["nodes"][answer_key].get("categories") or ["biolink:NamedThing"])[0]
+    predicate = (edge.get("predicates") or ["biolink:related_to"])[0]
+    rng = random.Random(seed if seed is not None else pinned)
+
+    nodes = {pinned: {"name": pinned, "categories": query_graph["nodes"][pinned_key].get("categories") or [], "attributes": []},
+             "GO:member": {"name": "member", "categories": ["biolink:SmallMolecule"], "attributes": []},
+             "GO:enriched": {"name": "enriched", "categories": ["biolink:Pathway"], "attributes": []}}
+    for gene in range(genes):
+        nodes[f"NCBIGene:{gene}"] = {"name": f"gene {gene}", "categories": ["biolink:Gene"], "attributes": []}
+    edges = {}
+    aux_graphs = {}
+    results = []
+    for inference in range(inferences):
+        answer = f"MOCK:{inference}"
+        nodes[answer] = {"name": f"answer {inference}", "categories": [answer_category], "attributes": []}
+        support_graphs = []
+        for group in range(rng.randint(1, groups)):
+            suffix = f"{inference}_{group}"
+            gene = f"NCBIGene:{rng.randrange(genes)}"
+            nodes[f"uuid:{suffix}"] = {"name": f"group {suffix}", "categories": ["biolink:NamedThing"], "attributes": []}
+            edges[f"member_{suffix}"] = {"subject": "GO:member", "object": pinned, "predicate": "biolink:member_of",
+                                         "attributes": [], "sources": []}
+            edges[f"enriched_{suffix}"] = {"subject": f"uuid:{suffix}", "object": "GO:enriched", "predicate": "biolink:affects",
+                                           "attributes": [{"attribute_type_id": "biolink:p_value", "value": rng.random() / 1000}],
+                                           "sources": []}
+            aux_graphs[f"nested_{suffix}"] = {"edges": [f"member_{suffix}", f"enriched_{suffix}"]}
+            edges[f"e2g_{suffix}"] = {"subject": answer, "object": gene, "predicate": "biolink:affects",
+                                      "attributes": [{"attribute_type_id": "biolink:support_graphs", "value": [f"nested_{suffix}"]}],
+                                      "sources": [{"resource_id": "infores:answercoalesce", "resource_role": "primary_knowledge_source"}]}
+            edges[f"g2c_{suffix}"] = {"subject": gene, "object": pinned, "predicate": "biolink:genetically_associated_with",
+                                      "attributes": [{"attribute_type_id": "biolink:aggregator_knowledge_source", "value": "infores:mock"}],
+                                      "sources": [{"resource_id": "infores:mock", "resource_role": "primary_knowledge_source"}]}
+            graph = f"{'e' if rng.random() < 0.6 else 'p'}_{suffix}"
+            aux_graphs[graph] = {"edges": [f"e2g_{suffix}", f"g2c_{suffix}"]}
+            support_graphs.append(graph)
+        subject, object = (answer, pinned) if pinned_key == edge["object"] else (pinned, answer)
+        edges[f"inference_{inference}"] = {"subject": subject, "object": object, "predicate": predicate, "sources": [],
+                                           "attributes": [{"attribute_type_id": "biolink:support_graphs", "value": graph}
+                                                          for graph in support_graphs]}
+        results.append({"node_bindings": {pinned_key: [{"id": pinned}], answer_key: [{"id": answer}]},
+                        "analyses": [{"resource_id": "infores:answercoalesce",
+                                      "edge_bindings": {edge_key: [{"id": f"inference_{inference}"}]}}]})
+    return {"message": {"query_graph": query_graph, "knowledge_graph": {"nodes": nodes, "edges": edges},
+                        "results": results, "auxiliary_graphs": aux_graphs}}
+
+
+class RecordedResponses:
+    """ Recorded AnswerCoalesce responses, replayed round-robin """
+
+    def __init__( self, directory ):
+        self.responses = []
+        for path in sorted(glob.glob(os.path.join(directory, '*.json'))):
+            with open(path, 'rb') as inf:
+                self.responses.append(inf.read())
+        if not self.responses:
+            raise ValueError(f"No recorded responses (*.json) in {directory}")
+        self.order = itertools.cycle(range(len(self.responses)))
+
+    def __call__( self, query ):
+        return self.responses[next(self.order)]
+
+
+def make_handler( respond, latency, jitter ):
+    class MockAnswerCoalesce(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST( self ):
+            query = orjson.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            time.sleep(max(0.0, random.gauss(latency, jitter)))
+            body = respond(query)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message( self, format, *args ):
+            logger.info(format % args)
+
+    return MockAnswerCoalesce
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Local AnswerCoalesce stand-in for load tests')
+    parser.add_argument('--port', type=int, default=9001)
+    parser.add_argument('--latency', type=float, default=2.0, help='mean seconds before answering')
+    parser.add_argument('--jitter', type=float, default=0.5, help='standard deviation of the latency')
+    parser.add_argument('--recorded', help='directory of recorded responses to replay instead of synthetic ones')
+    parser.add_argument('--inferences', type=int, default=100, help='results per synthetic answer set')
+    parser.add_argument('--groups', type=int, default=3, help='most enrichment groups supporting one inference')
+    args = parser.parse_args()
+
+    if args.recorded:
+        respond = RecordedResponses(args.recorded)
+    else:
+        def respond( query ):
+            # the same query always gets the same answer, different curies get different ones
+            seed = hashlib.sha256(orjson.dumps(query["message"]["query_graph"], option=orjson.OPT_SORT_KEYS)).hexdigest()
+            return orjson.dumps(synthetic_answerset(query, args.inferences, args.groups, seed=seed))
+    server = ThreadingHTTPServer(('', args.port), make_handler(respond, args.latency, args.jitter))
+    print(f"Mock AnswerCoalesce on http://localhost:{args.port}/query")
+    server.serve_forever()
@@ -0,0 +1,148 @@
+import csv
+import html
+import logging
+import os
+import shutil
+import zipfile
+from src.utils import LoggingUtil, DATA_DIR
+from src.jobs import load_result, set_progress, INDEXED
+from src.metrics import stage_timer
+from src.workspace import pinned_ids
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+this_dir = os.path.dirname(os.path.realpath(__file__))
+
+logger = LoggingUtil.init_logging('report', level=logging.WARNING, format='long', logFilePath=this_dir + '/')
+
+REPORTS_DIR = os.path.join(DATA_DIR, 'reports')
+# inferences explained per pass; rows are written and dropped after each one
+CHUNK_SIZE = 1000
+# inferences per HTML page
+PAGE_SIZE = 500
+
+HTML = 'html'
+CSV = 'csv'
+PARQUET = 'parquet'
+FORMATS = [HTML, CSV, PARQUET] if pyarrow is not None else [HTML, CSV]
+
+COLUMNS = ['Rank', 'Candidate', 'Candidate_ID', 'Inference', 'Predicate', 'Combined_Pvalue', 'Support_Graph',
+           'Enrichment_method', 'Group', 'Rule_Predicate', 'Enriched', 'Pvalue', 'Knowledge_Source', 'Lookup_Members']
+
+PAGE_STYLE = '<style>body{font-family:sans-serif;font-size:13px}table{border-collapse:collapse}' \
+             'td,th{border:1px solid #ccc;padding:3px 6px;vertical-align:top}th{background:#cbd3dd}</style>'
+
+
+def report_path(handle):
+    return os.path.join(REPORTS_DIR, f'{handle}.zip')
+
+
+def report_url(handle):
+    return f'/report/{handle}'
+
+
+def explanation_rows(indexed, inference_edges, start_rank):
+    """ One row per support graph: the rule with its p-values and the lookup members it was found through """
+    # imported here because the visualization module offers the export and imports this one
+    from src.visualization import support_graph_rule
+
+    kg_nodes = indexed['kg_nodes']
+    kg_edges = indexed['kg_edges']
+    aux_graphs = indexed['aux_graphs']
+    support_index = indexed['support_index']
+    ranking_index = indexed['ranking_index']
+    pinned = pinned_ids(indexed['query_graph'])
+    for offset, inference_edge in enumerate(inference_edges):
+        rank = start_rank + offset
+        edge = kg_edges[inference_edge]
+        candidate = edge['object'] if edge['subject'] in pinned else edge['subject']
+        for graph in support_index['inferences'][inference_edge]:
+            rule, lookup_edges, pvalue = support_graph_rule(graph, kg_nodes, kg_edges, aux_graphs, support_index)
+            yield {'Rank': rank + 1, 'Candidate': kg_nodes.get(candidate, {}).get('name', candidate), 'Candidate_ID': candidate,
+                   'Inference': inference_edge, 'Predicate': edge['predicate'],
+                   'Combined_Pvalue': ranking_index['combined_pvalue'][rank], 'Support_Graph': graph,
+                   'Enrichment_method': support_index['support_graphs'][graph]['method'], 'Group': rule[0],
+                   'Rule_Predicate': rule[1], 'Enriched': rule[2], 'Pvalue': pvalue, 'Knowledge_Source': rule[4],
+                   'Lookup_Members': '; '.join(' '.join(str(part) for part in lookup) for lookup in lookup_edges)}
+
+
+def html_page(rows, title, previous_page, next_page):
+    links = ' '.join(f'<a href="{href}">{label}</a>' for href, label in
+                     ((previous_page, 'previous'), ('index.html', 'index'), (next_page, 'next')) if href)
+    header = ''.join(f'<th>{column}</th>' for column in COLUMNS)
+    body = ''.join('<tr>' + ''.join(f'<td>{html.escape(str(row[column]))}</td>' for column in COLUMNS) + '</tr>'
+                   for row in rows)
+    return f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>{title}</title>{PAGE_STYLE}</head><body>' \
+           f'<h2>{title}</h2><p>{links}</p><table><tr>{header}</tr>{body}</table><p>{links}</p></body></html>'
+
+
+def page_name(page):
+    return f'page-{page + 1:04d}.html'
+
+
+def write_report(handle, source, formats):
+    """ Explain every inference of the source answer set into a zip of paginated HTML, CSV and/or Parquet """
+    indexed = load_result(source, INDEXED)
+    if indexed is None:
+        raise KeyError(f"No indexed answer set for {source}")
+    formats = [fmt for fmt in formats if fmt in FORMATS] or [CSV]
+    order = indexed['ranking_index']['order']
+    pages = (len(order) + PAGE_SIZE - 1) // PAGE_SIZE
+    workdir = os.path.join(REPORTS_DIR, handle)
+    os.makedirs(workdir, exist_ok=True)
+
+    csv_file = open(os.path.join(workdir, 'explanations.csv'), 'w', newline='') if CSV in formats else None
+    csv_writer = csv.DictWriter(csv_file, COLUMNS) if csv_file else None
+    if csv_writer:
+        csv_writer.writeheader()
+    parquet_writer = None
+    rows_written = 0
+    try:
+        for start in range(0, len(order), CHUNK_SIZE):
+            with stage_timer('report.chunk'):
+                rows = list(explanation_rows(indexed, order[start:start + CHUNK_SIZE], start))
+                if csv_writer:
+                    csv_writer.writerows(rows)
+                if PARQUET in formats and rows:
+                    table = pyarrow.Table.from_pylist(rows)
+                    if parquet_writer is None:
+                        parquet_writer = pyarrow.parquet.ParquetWriter(os.path.join(workdir, 'explanations.parquet'), table.schema)
+                    parquet_writer.write_table(table.cast(parquet_writer.schema))
+                if HTML in formats:
+                    # chunks are whole pages, so each page is written exactly once
+                    for page_start in range(start, min(start + CHUNK_SIZE, len(order)), PAGE_SIZE):
+                        page = page_start // PAGE_SIZE
+                        page_rows = [row for row in rows if page_start < row['Rank'] <= page_start + PAGE_SIZE]
+                        with open(os.path.join(workdir, page_name(page)), 'w') as outf:
+                            outf.write(html_page(page_rows, f'Candidates {page_start + 1}-{min(page_start + PAGE_SIZE, len(order))}',
+                                                 page_name(page - 1) if page > 0 else None,
+                                                 page_name(page + 1) if page + 1 < pages else None))
+                rows_written += len(rows)
+            # zipping takes the last few percent
+            set_progress(handle, 0.95 * min(start + CHUNK_SIZE, len(order)) / max(len(order), 1))
+    finally:
+        if csv_file:
+            csv_file.close()
+        if parquet_writer is not None:
+            parquet_writer.close()
+
+    if HTML in formats:
+        with open(os.path.join(workdir, 'index.html'), 'w') as outf:
+            links = ''.join(f'<li><a href="{page_name(page)}">Candidates {page * PAGE_SIZE + 1}-'
+                            f'{min((page + 1) * PAGE_SIZE, len(order))}</a></li>' for page in range(pages))
+            outf.write(f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>EDGAR report</title>{PAGE_STYLE}</head>'
+                       f'<body><h2>EDGAR report</h2><p>{len(order)} inferences, {rows_written} support graphs, '
+                       f'ranked by combined enrichment p-value.</p><ul>{links}</ul></body></html>')
+
+    with stage_timer('report.zip'), zipfile.ZipFile(f'{report_path(handle)}.tmp', 'w', zipfile.ZIP_DEFLATED) as bundle:
+        for name in sorted(os.listdir(workdir)):
+            bundle.write(os.path.join(workdir, name), name)
+    os.replace(f'{report_path(handle)}.tmp', report_path(handle))
+    shutil.rmtree(workdir)
+    set_progress(handle, 1.0)
+    return {'source': source, 'formats': formats, 'inferences': len(order), 'rows': rows_written,
+            'bytes': os.path.getsize(report_path(handle))}
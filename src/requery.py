@@ -0,0 +1,137 @@
+import hashlib
+import os
+import orjson
+from src.answerset_index import build_support_index, get_inference_edges, get_support_graphs, result_inference_edges, \
+    ENRICHMENT2GROUP, GROUP2CURIE, P_VALUE, SUPPORT_GRAPHS
+from src.jobs import find_jobs, load_result, result_path, RESPONSE
+
+REUSE = 'reuse'
+DERIVE = 'derive'
+FETCH = 'fetch'
+
+
+def query_key(data):
+    # parameters that change what AnswerCoalesce looks at (not how much it returns) are part of the key
+    parameters = data.get("parameters", {})
+    keyed = {"query_graph": data["message"]["query_graph"],
+             "predicates_to_exclude": sorted(parameters.get("predicates_to_exclude", []))}
+    return hashlib.sha256(orjson.dumps(keyed, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+def is_stricter(parameters, cached_parameters):
+    for key in ("pvalue_threshold", "result_length"):
+        if parameters.get(key) is None or cached_parameters.get(key) is None:
+            return False
+        if parameters[key] > cached_parameters[key]:
+            return False
+    return True
+
+
+def plan_query(data):
+    """ Decide whether a query can be answered from an earlier answer set for the same query graph """
+    parameters = data.get("parameters", {})
+    derivable = None
+    for job in find_jobs(query_key(data)):
+        if not os.path.exists(result_path(job['id'], RESPONSE)):
+            continue
+        cached_parameters = job['payload'].get("parameters", {})
+        if cached_parameters == parameters:
+            return REUSE, job['id']
+        if derivable is None and is_stricter(parameters, cached_parameters):
+            derivable = job['id']
+    if derivable is not None:
+        return DERIVE, derivable
+    return FETCH, None
+
+
+def filter_answerset(answerset, pvalue_threshold, result_length):
+    """ Apply a stricter p-value threshold and result length to an answer set without asking AnswerCoalesce again.
+        Like AnswerCoalesce itself the threshold applies per enrichment edge: edges above it leave their nested graph,
+        and a support graph stays only while one of its nested graphs still holds an enrichment edge """
+    message = answerset["message"]
+    kg_edges = message["knowledge_graph"]["edges"]
+    aux_graphs = message["auxiliary_graphs"]
+    support_index = build_support_index(kg_edges, message["results"], aux_graphs)
+    support_graphs = support_index['support_graphs']
+
+    def enriched(edge_id):
+        pvalues = [attribute["value"] for attribute in kg_edges[edge_id].get("attributes") or []
+                   if attribute["attribute_type_id"] == P_VALUE]
+        return bool(pvalues) and min(pvalues) <= pvalue_threshold
+
+    nested_kept = {}
+
+    def filter_nested(nested, terminals):
+        # the enrichment edges are the ones that do not touch the lookup terminals, as in support_graph_pvalues
+        if nested not in nested_kept:
+            edges = aux_graphs[nested]["edges"]
+            enrichment = [edge_id for edge_id in edges
+                          if not {kg_edges[edge_id]["subject"], kg_edges[edge_id]["object"]} & terminals]
+            aux_graphs[nested]["edges"] = [edge_id for edge_id in edges if edge_id not in enrichment or enriched(edge_id)]
+            nested_kept[nested] = any(enriched(edge_id) for edge_id in enrichment)
+        return nested_kept[nested]
+
+    graph_kept = {}
+
+    def passes(graph):
+        if graph not in graph_kept:
+            roles = support_graphs[graph]
+            if not (roles[ENRICHMENT2GROUP] and roles[GROUP2CURIE]):
+                graph_kept[graph] = False
+                return False
+            group2curie = kg_edges[roles[GROUP2CURIE]]
+            terminals = {group2curie["subject"], group2curie["object"]}
+            enrichment2group = kg_edges[roles[ENRICHMENT2GROUP]]
+            for attribute in enrichment2group["attributes"]:
+                if attribute["attribute_type_id"] == SUPPORT_GRAPHS:
+                    attribute["value"] = [nested for nested in attribute["value"] if filter_nested(nested, terminals)]
+            graph_kept[graph] = any(get_support_graphs(enrichment2group))
+        return graph_kept[graph]
+
+    kept_graphs = {}
+    for inference_edge in get_inference_edges(message["results"]):
+        kept = {graph for graph in support_index['inferences'][inference_edge] if passes(graph)}
+        if kept:
+            edge = kg_edges[inference_edge]
+            edge["attributes"] = [attribute for attribute in edge["attributes"] if
+                                  attribute["attribute_type_id"] != SUPPORT_GRAPHS or attribute["value"] in kept]
+        kept_graphs[inference_edge] = kept
+
+    # a multi-hop result survives only if every one of its hops does
+    kept_results = []
+    for result in message["results"]:
+        if all(kept_graphs[inference_edge] for inference_edge in result_inference_edges(result)):
+            kept_results.append(result)
+            if len(kept_results) == result_length:
+                break
+
+    # keep only what the remaining results still reach
+    reached_edges = set()
+    reached_graphs = set()
+    pending = list(get_inference_edges(kept_results))
+    while pending:
+        edge_id = pending.pop()
+        if edge_id in reached_edges:
+            continue
+        reached_edges.add(edge_id)
+        for value in get_support_graphs(kg_edges[edge_id]):
+            for graph in (value if isinstance(value, list) else [value]):
+                if graph not in reached_graphs and graph in aux_graphs:
+                    reached_graphs.add(graph)
+                    pending.extend(aux_graphs[graph]["edges"])
+
+    kg_nodes = message["knowledge_graph"]["nodes"]
+    reached_nodes = {node for edge_id in reached_edges for node in (kg_edges[edge_id]["subject"], kg_edges[edge_id]["object"])}
+    reached_nodes.update(binding["id"] for result in kept_results for bindings in result["node_bindings"].values()
+                         for binding in bindings)
+
+    message["results"] = kept_results
+    message["auxiliary_graphs"] = {graph: aux_graphs[graph] for graph in reached_graphs}
+    message["knowledge_graph"] = {"nodes": {node: kg_nodes[node] for node in reached_nodes if node in kg_nodes},
+                                  "edges": {edge_id: kg_edges[edge_id] for edge_id in reached_edges}}
+    return answerset
+
+
+def derive_answerset(source, parameters):
+    answerset = load_result(source, RESPONSE)
+    return filter_answerset(answerset, parameters["pvalue_threshold"], parameters["result_length"])
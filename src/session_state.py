@@ -0,0 +1,147 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+import orjson
+from src.utils import LoggingUtil
+from src.jobs import load_result, result_path, save_result, INDEXED
+from src.metrics import inc, observe, SIZE_BUCKETS
+
+this_dir = os.path.dirname(os.path.realpath(__file__))
+
+logger = LoggingUtil.init_logging('session_state', level=logging.WARNING, format='long', logFilePath=this_dir + '/')
+
+# answer sets held in memory by one web worker
+STATE_BUDGET = int(float(os.environ.get('EDGAR_STATE_BUDGET_MB', 512)) * 2 ** 20)
+# an answer set nobody has looked at for this long is dropped even when the budget is not reached
+STATE_IDLE_TTL = float(os.environ.get('EDGAR_STATE_IDLE_TTL', 1800))
+# in-memory size of an indexed answer set relative to its JSON on disk, measured with tracemalloc
+JSON_EXPANSION = 5.5
+SWEEP_INTERVAL = 60
+
+
+class AnswerSetState:
+    """ Answer sets loaded by this worker, kept under a memory budget: idle ones expire, then least recently used go """
+
+    def __init__( self, budget=STATE_BUDGET, idle_ttl=STATE_IDLE_TTL ):
+        self.budget = budget
+        self.idle_ttl = idle_ttl
+        self.entries = OrderedDict()
+        self.used = 0
+        self.lock = threading.Lock()
+        self.loading = {}
+        self.last_sweep = time.time()
+
+    def get( self, handle, artifact=INDEXED ):
+        """ The artifact from memory, or rehydrated from the on-disk cache; None if there is none """
+        def load():
+            try:
+                size = os.path.getsize(result_path(handle, artifact)) * JSON_EXPANSION
+            except FileNotFoundError:
+                return None
+            value = load_result(handle, artifact)
+            if value is not None:
+                self.put(handle, value, artifact, size)
+            return value
+        return self.single_flight((handle, artifact), load)
+
+    def derived( self, handle, name, build, measure ):
+        """ build(indexed answer set), e.g. a search index, kept beside the answer set under the same budget and dropped
+            with it; measure(value) estimates its bytes. None if the answer set is gone """
+        def load():
+            indexed = self.get(handle)
+            if indexed is None:
+                return None
+            value = build(indexed)
+            self.put(handle, value, name, measure(value), derived=True)
+            return value
+        return self.single_flight((handle, name), load)
+
+    def single_flight( self, key, load ):
+        if time.time() - self.last_sweep > SWEEP_INTERVAL:
+            self.last_sweep = time.time()
+            self.expire_idle()
+        while True:
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None:
+                    entry['last_used'] = time.time()
+                    self.entries.move_to_end(key)
+                    inc('edgar_session_state_total', outcome='hit')
+                    return entry['value']
+                loaded = self.loading.get(key)
+                if loaded is None:
+                    # the first caller loads, callers for the same answer set wait instead of holding a second copy
+                    loaded = self.loading[key] = threading.Event()
+                    break
+            loaded.wait()
+        try:
+            inc('edgar_session_state_total', outcome='miss')
+            return load()
+        finally:
+            with self.lock:
+                del self.loading[key]
+            loaded.set()
+
+    def put( self, handle, value, artifact=INDEXED, size=None, derived=False ):
+        """ Keep value in memory; if its on-disk copy is gone by the time it is evicted, it is spilled back there.
+            Derived values are never spilled, they are built again from the answer set """
+        key = (handle, artifact)
+        if size is None:
+            size = len(orjson.dumps(value)) * JSON_EXPANSION
+        observe('edgar_session_state_bytes', size, SIZE_BUCKETS)
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.used -= previous['size']
+            self.entries[key] = {'value': value, 'size': size, 'last_used': time.time(), 'derived': derived}
+            self.used += size
+            evicted = self.evict(keep=handle)
+        for key, entry in evicted:
+            self.spill(key, entry)
+
+    def evict( self, keep=None ):
+        # called with the lock held; spilling happens after it is released
+        evicted = []
+        now = time.time()
+        for key, entry in list(self.entries.items()):
+            if now - entry['last_used'] > self.idle_ttl and key[0] != keep:
+                evicted.append((key, entry))
+                inc('edgar_session_state_total', outcome='expired')
+        for key, _ in evicted:
+            self.used -= self.entries.pop(key)['size']
+        for key in list(self.entries):
+            if self.used <= self.budget:
+                break
+            # the answer set just asked for stays even if it is bigger than the whole budget on its own
+            if key[0] == keep:
+                continue
+            entry = self.entries.pop(key)
+            self.used -= entry['size']
+            evicted.append((key, entry))
+            inc('edgar_session_state_total', outcome='evicted')
+        # what was built from an evicted answer set goes with it
+        gone = {handle for (handle, artifact), entry in evicted if not entry['derived']}
+        for key in [key for key, entry in self.entries.items() if entry['derived'] and key[0] in gone]:
+            entry = self.entries.pop(key)
+            self.used -= entry['size']
+            evicted.append((key, entry))
+        if evicted:
+            logger.info(f"Evicted {len(evicted)} entries, {self.used / 2 ** 20:.0f} MB of {self.budget / 2 ** 20:.0f} MB in use")
+        return evicted
+
+    def spill( self, key, entry ):
+        handle, artifact = key
+        if not entry['derived'] and not os.path.exists(result_path(handle, artifact)):
+            save_result(handle, artifact, orjson.dumps(entry['value']))
+            inc('edgar_session_state_total', outcome='spilled')
+
+    def expire_idle( self ):
+        with self.lock:
+            evicted = self.evict()
+        for key, entry in evicted:
+            self.spill(key, entry)
+
+
+answerset_state = AnswerSetState()
@@ -0,0 +1,67 @@
+import os
+import re
+import zlib
+from src.jobs import result_path, RESPONSE
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CHUNK_SIZE = 1 << 20
+HANDLE_PATTERN = re.compile(r'[0-9a-f]{32}')
+
+
+def stream_compressed(path, encoding):
+    # compress chunk by chunk so a multi-hundred-MB response is never held in memory
+    if encoding == 'zstd':
+        compressor = zstandard.ZstdCompressor(level=3).compressobj()
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    with open(path, 'rb') as inf:
+        while chunk := inf.read(CHUNK_SIZE):
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+    yield compressor.flush()
+
+
+def download_url(handle, encoding='gzip'):
+    return f'/download/{handle}?encoding={encoding}'
+
+
+def init_transfer(server):
+    from flask import abort, request, Response, send_file
+    from src.report import report_path
+
+    # callback payloads are compressed by Dash (compress=True); downloads compress themselves chunk by chunk,
+    # which flask-compress would undo by reading the whole stream into memory first
+    server.config['COMPRESS_STREAMS'] = False
+
+    @server.route('/download/<handle>')
+    def download(handle):
+        path = result_path(handle, RESPONSE)
+        if not HANDLE_PATTERN.fullmatch(handle) or not os.path.exists(path):
+            abort(404)
+        encoding = request.args.get('encoding', 'gzip')
+        if encoding == 'zstd' and zstandard is None:
+            encoding = 'gzip'
+        extension = {'gzip': '.gz', 'zstd': '.zst'}.get(encoding)
+        if extension is not None:
+            return Response(stream_compressed(path, encoding), mimetype='application/octet-stream',
+                            headers={'Content-Disposition': f'attachment; filename=response_data.json{extension}'})
+        # a plain file: gzip it on the wire only for clients that said they can take it
+        if 'gzip' not in request.accept_encodings:
+            return send_file(path, mimetype='application/json', as_attachment=True, download_name='response_data.json')
+        response = Response(stream_compressed(path, 'gzip'), mimetype='application/json',
+                            headers={'Content-Encoding': 'gzip',
+                                     'Content-Disposition': 'attachment; filename=response_data.json'})
+        response.vary.add('Accept-Encoding')
+        return response
+
+    @server.route('/report/<handle>')
+    def report(handle):
+        if not HANDLE_PATTERN.fullmatch(handle) or not os.path.exists(report_path(handle)):
+            abort(404)
+        return send_file(report_path(handle), mimetype='application/zip', as_attachment=True,
+                         download_name=f'edgar-report-{handle[:8]}.zip')
@@ -0,0 +1,146 @@
+import heapq
+import logging
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import closing
+from src.utils import LoggingUtil
+from src.jobs import connect, load_result, DONE, NAMES
+from src.metrics import observe
+
+this_dir = os.path.dirname(os.path.realpath(__file__))
+
+logger = LoggingUtil.init_logging('typeahead', level=logging.WARNING, format='long', logFilePath=this_dir + '/')
+
+CATEGORY = 'category'
+PREDICATE = 'predicate'
+CURIE = 'curie'
+
+MAX_SUGGESTIONS = 20
+REFRESH_INTERVAL = 30
+MAX_CLIENTS = 10000
+WORD_BOUNDARY = re.compile(r'[\s_:\-/(),.]+|(?<=[a-z])(?=[A-Z])')
+
+
+class PrefixIndex:
+    """ Sorted (key, entry) pairs per kind; a lookup is a bisect to the first key with the typed prefix """
+
+    def __init__( self ):
+        self.entries = {}
+        self.keys = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def add( self, kind, value, label=None, rank=0 ):
+        # every word of the label and of the value is a way in: "alz" finds "Alzheimer disease", "0049" a MONDO id
+        label = label or value
+        with self.lock:
+            entries = self.entries.setdefault(kind, {})
+            if value in entries and entries[value]['label'] == label:
+                entries[value]['rank'] = max(rank, entries[value]['rank'])
+                return
+            entries[value] = {'value': value, 'label': label, 'rank': rank}
+            words = {word.lower() for text in (label, value) for word in WORD_BOUNDARY.split(text) if word}
+            words.update({label.lower(), value.lower()})
+            self.pending.setdefault(kind, []).extend((word, value) for word in words)
+
+    def merge_pending( self, kind ):
+        # new terms arrive in small batches, so merge them into the sorted keys rather than re-sorting everything
+        pending = sorted(self.pending.pop(kind))
+        self.keys[kind] = list(heapq.merge(self.keys.get(kind, []), pending))
+
+    def search( self, kind, prefix, limit=MAX_SUGGESTIONS, allowed=None ):
+        with self.lock:
+            if self.pending.get(kind):
+                self.merge_pending(kind)
+            keys = self.keys.get(kind, [])
+            # entries are only ever added or replaced, so lookups below are safe without the lock
+            entries = self.entries.get(kind, {})
+            prefix = prefix.strip().lower()
+            if not prefix:
+                # an empty box lists small vocabularies (categories, predicates) but not every curie ever seen
+                matches = list(entries) if len(entries) <= 50 * limit else []
+        if prefix:
+            matches = []
+            seen = set()
+            start = bisect_left(keys, (prefix,))
+            # stop once keys no longer share the prefix, or a generous number of candidates have been seen
+            for key, value in keys[start:start + 50 * limit]:
+                if not key.startswith(prefix):
+                    break
+                if value not in seen:
+                    seen.add(value)
+                    matches.append(value)
+        if allowed is not None:
+            matches = [value for value in matches if value in allowed]
+        # exact and leading matches first, then the most recently used
+        best = heapq.nsmallest(limit, matches, key=lambda value: (not entries[value]['label'].lower().startswith(prefix),
+                                                                  not value.lower().startswith(prefix),
+                                                                  -entries[value]['rank'], entries[value]['label']))
+        return [{'label': entries[value]['label'], 'value': value} for value in best]
+
+
+typeahead_index = PrefixIndex()
+_refresh = {'finished': 0.0, 'checked': 0.0}
+_latest = OrderedDict()
+_latest_lock = threading.Lock()
+
+
+def refresh_curies():
+    """ Curies and names of answer sets finished since the last look """
+    now = time.time()
+    if now - _refresh['checked'] < REFRESH_INTERVAL:
+        return
+    _refresh['checked'] = now
+    with closing(connect()) as conn:
+        rows = conn.execute('SELECT id, finished FROM jobs WHERE status = ? AND finished > ? ORDER BY finished',
+                            (DONE, _refresh['finished'])).fetchall()
+    for row in rows:
+        for curie, name in (load_result(row['id'], NAMES) or {}).items():
+            typeahead_index.add(CURIE, curie, f"{name} ({curie})" if name else curie, rank=row['finished'])
+        _refresh['finished'] = row['finished']
+
+
+def add_curie( curie, name=None ):
+    typeahead_index.add(CURIE, curie, f"{name} ({curie})" if name else curie, rank=time.time())
+
+
+def superseded( client, field, seq ):
+    # server-side debounce: a keystroke older than one already seen from the same input is not worth answering
+    key = (client, field)
+    with _latest_lock:
+        if seq < _latest.get(key, -1):
+            return True
+        _latest[key] = seq
+        _latest.move_to_end(key)
+        while len(_latest) > MAX_CLIENTS:
+            _latest.popitem(last=False)
+    return False
+
+
+def init_typeahead(server, valid_predicates=None):
+    """ valid_predicates(source category, target category) narrows predicate suggestions to what the dropdown offers """
+    from flask import jsonify, request, Response
+
+    @server.route('/typeahead/<kind>')
+    def typeahead(kind):
+        if kind not in (CATEGORY, PREDICATE, CURIE):
+            return Response(status=404)
+        try:
+            seq = int(request.args.get('seq', 0))
+        except ValueError:
+            seq = 0
+        if superseded(request.args.get('client', request.remote_addr), request.args.get('field', kind), seq):
+            return Response(status=204)
+        start_time = time.perf_counter()
+        if kind == CURIE:
+            refresh_curies()
+        allowed = None
+        if kind == PREDICATE and valid_predicates is not None:
+            allowed = set(valid_predicates(request.args.get('source') or None, request.args.get('target') or None))
+        suggestions = typeahead_index.search(kind, request.args.get('q', ''), allowed=allowed)
+        observe('edgar_typeahead_seconds', time.perf_counter() - start_time, kind=kind)
+        return jsonify(suggestions)
@@ -1,16 +1,39 @@
 import logging
 import json
 import os
+import queue
+import random
+import atexit
+import contextvars
+import multiprocessing.util
 import yaml
 from collections import namedtuple
 import copy
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from datetime import datetime
+import orjson
+
+DATA_DIR = os.environ.get('EDGAR_DATA_DIR', os.path.join(os.path.dirname(os.path.realpath(__file__)), 'cache'))
+
+# EDGAR_LOG_DIR overrides where log files go; set it empty to log to the console only
+LOG_DIR = os.environ.get('EDGAR_LOG_DIR')
+LOG_ASYNC = os.environ.get('EDGAR_LOG_ASYNC', '1') == '1'
+LOG_FORMAT = os.environ.get('EDGAR_LOG_FORMAT')
+LOG_DEBUG_SAMPLE = float(os.environ.get('EDGAR_LOG_DEBUG_SAMPLE', 1.0))
+# overrides the level every module logger is created with, e.g. INFO to get job, AnswerCoalesce and eviction timings
+LOG_LEVEL = os.environ.get('EDGAR_LOG_LEVEL')
+
+log_context = contextvars.ContextVar('log_context', default={})
 
 
 class LoggingUtil(object):
     """ Logging utility controlling format and setting initial logging level """
 
+    # handlers of every logger, fed by a single listener thread when logging is asynchronous
+    sinks = {}
+    queue_handlers = []
+    listener = None
+
     @staticmethod
     def init_logging(name, level=logging.INFO, format='short', logFilePath=None, logFileLevel=None):
         # Check if the logger already exists
@@ -19,23 +42,33 @@ class LoggingUtil(object):
             # Avoid adding handlers again if they already exist
             return logger
 
-        FORMAT = {
-            "short": '%(funcName)s: %(message)s',
-            "medium": '%(funcName)s: %(asctime)-15s %(message)s',
-            "long": '%(asctime)-15s %(filename)s %(funcName)s %(levelname)s: %(message)s'
-        }[format]
+        format = LOG_FORMAT or format
+        if format == 'json':
+            formatter = JsonFormatter()
+        else:
+            FORMAT = {
+                "short": '%(funcName)s: %(message)s',
+                "medium": '%(funcName)s: %(asctime)-15s %(message)s',
+                "long": '%(asctime)-15s %(filename)s %(funcName)s %(levelname)s: %(message)s'
+            }[format]
+
+            # create a formatter
+            formatter = logging.Formatter(FORMAT)
 
         # create a stream handler (default to console)
         stream_handler = logging.StreamHandler()
 
-        # create a formatter
-        formatter = logging.Formatter(FORMAT)
-
         # set the formatter on the console stream
         stream_handler.setFormatter(formatter)
 
         # set the logging level
+        if LOG_LEVEL:
+            level = LOG_LEVEL.upper()
         logger.setLevel(level)
+        handlers = []
+
+        if LOG_DIR is not None:
+            logFilePath = LOG_DIR or None
 
         # if there was a file path passed in, use it
         if logFilePath is not None:
@@ -51,11 +84,23 @@ class LoggingUtil(object):
             else:
                 file_handler.setLevel(level)
 
-            # add the file handler to the logger
-            logger.addHandler(file_handler)
+            handlers.append(file_handler)
+
+        handlers.append(stream_handler)
+
+        if LOG_ASYNC:
+            # the request path only enqueues; formatting, file I/O and rotation happen on the listener thread
+            LoggingUtil.sinks[name] = handlers
+            queue_handler = TracebackQueueHandler(LoggingUtil.start_listener())
+            LoggingUtil.queue_handlers.append(queue_handler)
+            logger.addHandler(queue_handler)
+        else:
+            for handler in handlers:
+                # add the handlers to the logger
+                logger.addHandler(handler)
 
-        # add the console handler to the logger
-        logger.addHandler(stream_handler)
+        # runs on the calling thread, where the request/job context is still visible
+        logger.addFilter(ContextFilter())
 
         # Prevent propagation to avoid duplicate logs
         logger.propagate = False
@@ -63,6 +108,102 @@ class LoggingUtil(object):
         # return to the caller
         return logger
 
+    @staticmethod
+    def start_listener():
+        if LoggingUtil.listener is None:
+            LoggingUtil.listener = QueueListener(queue.SimpleQueue(), SinkDispatcher(), respect_handler_level=False)
+            LoggingUtil.listener.start()
+            atexit.register(LoggingUtil.stop_listener)
+        return LoggingUtil.listener.queue
+
+    @staticmethod
+    def stop_listener():
+        # a forked web worker inherits its parent's atexit hook and registers its own, so this can run twice
+        listener, LoggingUtil.listener = LoggingUtil.listener, None
+        if listener is not None:
+            listener.stop()
+
+    @staticmethod
+    def restart_listener():
+        # listener threads do not survive fork, so child processes (compute workers) start their own
+        if LoggingUtil.listener is not None:
+            LoggingUtil.listener = None
+            log_queue = LoggingUtil.start_listener()
+            for queue_handler in LoggingUtil.queue_handlers:
+                queue_handler.queue = log_queue
+
+    @staticmethod
+    def drain_at_process_exit(cls):
+        # multiprocessing children skip atexit, so drain the queue from their own exit hook
+        multiprocessing.util.Finalize(None, LoggingUtil.stop_listener, exitpriority=0)
+
+
+os.register_at_fork(after_in_child=LoggingUtil.restart_listener)
+multiprocessing.util.register_after_fork(LoggingUtil, LoggingUtil.drain_at_process_exit)
+
+
+class TracebackQueueHandler(QueueHandler):
+    """ QueueHandler folds the traceback into the message; this one keeps it in exc_text for the sink formatters """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class SinkDispatcher(logging.Handler):
+    """ Hands records coming off the log queue to the handlers of the logger that produced them """
+
+    def handle(self, record):
+        for handler in LoggingUtil.sinks.get(record.name, []):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+        return True
+
+
+class ContextFilter(logging.Filter):
+    """ Stamps request/job ids onto records and samples debug records """
+
+    def filter(self, record):
+        if record.levelno <= logging.DEBUG and LOG_DEBUG_SAMPLE < 1.0 and random.random() >= LOG_DEBUG_SAMPLE:
+            return False
+        for key, value in log_context.get().items():
+            setattr(record, key, value)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """ One JSON object per record, built on create_log_entry """
+
+    context_fields = ('request_id', 'job_id', 'callback', 'duration')
+
+    def format(self, record):
+        entry = create_log_entry(record.getMessage(), record.levelname, getattr(record, 'code', None))
+        entry['logger'] = record.name
+        entry['function'] = record.funcName
+        for field in self.context_fields:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            # formatted on the logging thread by TracebackQueueHandler
+            entry['exception'] = record.exc_text
+        return orjson.dumps(entry, default=str).decode('utf-8')
+
+
+def set_log_context(**ids):
+    # returns the token to hand back to reset_log_context
+    return log_context.set({**log_context.get(), **ids})
+
+
+def reset_log_context(token):
+    log_context.reset(token)
+
 
 def create_log_entry( msg: str, err_level, code=None ) -> dict:
     now = datetime.now()
@@ -76,4 +217,4 @@ def create_log_entry( msg: str, err_level, code=None ) -> dict:
     }
 
     # return to the caller
-    return ret_val
\ No newline at end of file
+    return ret_val
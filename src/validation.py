@@ -0,0 +1,210 @@
+import logging
+import os
+from collections import Counter, defaultdict
+from itertools import islice
+from jsonschema import Draft202012Validator
+from src.utils import LoggingUtil
+from src.metrics import inc, timed
+from src.answerset_index import classify_support_graph, get_support_graphs, SUPPORT_GRAPHS, P_VALUE
+
+this_dir = os.path.dirname(os.path.realpath(__file__))
+
+logger = LoggingUtil.init_logging('validation', level=logging.WARNING, format='long', logFilePath=this_dir + '/')
+
+MAX_SCHEMA_ERRORS = 10
+MAX_EXAMPLES = 3
+
+# The envelope of a TRAPI message that EDGAR reads. Per-item structure is checked in the same single pass as the
+# references: running jsonschema over every node and edge of a large answer set takes seconds.
+TRAPI_SCHEMA = {
+    'type': 'object',
+    'required': ['message'],
+    'properties': {'message': {
+        'type': 'object',
+        'required': ['query_graph', 'knowledge_graph', 'results', 'auxiliary_graphs'],
+        'properties': {
+            'query_graph': {
+                'type': 'object',
+                'required': ['nodes', 'edges'],
+                'properties': {'nodes': {'type': 'object'}, 'edges': {'type': 'object'}},
+            },
+            'knowledge_graph': {
+                'type': 'object',
+                'required': ['nodes', 'edges'],
+                'properties': {'nodes': {'type': 'object'}, 'edges': {'type': 'object'}},
+            },
+            'results': {'type': 'array'},
+            'auxiliary_graphs': {'type': ['object', 'null']},
+        },
+    }},
+}
+
+# compiled once per process
+Draft202012Validator.check_schema(TRAPI_SCHEMA)
+TRAPI_VALIDATOR = Draft202012Validator(TRAPI_SCHEMA)
+
+REFERENCE_ERRORS = {
+    'malformed_node': "knowledge graph nodes are not objects",
+    'malformed_edge': "knowledge graph edges lack a string subject, object or predicate",
+    'malformed_attribute': "attributes are not objects with an attribute_type_id and a value",
+    'malformed_aux_graph': "auxiliary graphs lack an edges list",
+    'malformed_result': "results lack node_bindings or an analysis with edge bindings",
+    'dangling_edge_node': "knowledge graph edges point at nodes that are not in the knowledge graph",
+    'dangling_result_node': "result node bindings point at nodes that are not in the knowledge graph",
+    'dangling_result_edge': "result edge bindings point at edges that are not in the knowledge graph",
+    'missing_support_graphs': f"inferred edges have no {SUPPORT_GRAPHS} attribute",
+    'dangling_aux_graph': "support graph ids are not in auxiliary_graphs",
+    'dangling_aux_edge': "auxiliary graph edges are not in the knowledge graph",
+    'incomplete_support_graph': "support graphs lack an enrichment->group or group->curie edge",
+    'missing_sources': "enrichment->group edges have no sources",
+    'missing_pvalue': f"enrichment edges have no {P_VALUE} attribute",
+    'unnamed_node': "knowledge graph nodes have no name",
+}
+
+
+def schema_errors(answerset):
+    errors = []
+    for error in islice(TRAPI_VALIDATOR.iter_errors(answerset), MAX_SCHEMA_ERRORS):
+        path = '/'.join(str(part) for part in error.absolute_path) or '(root)'
+        errors.append(f"{path}: {error.message}")
+    return errors
+
+
+def reference_errors(message):
+    """ Count references across results, edges, nodes and aux graphs that point at nothing """
+    kg_nodes = message["knowledge_graph"]["nodes"]
+    kg_edges = message["knowledge_graph"]["edges"]
+    aux_graphs = message["auxiliary_graphs"] or {}
+    counts = Counter()
+    examples = defaultdict(list)
+
+    def report(kind, reference):
+        counts[kind] += 1
+        if len(examples[kind]) < MAX_EXAMPLES:
+            examples[kind].append(reference)
+
+    for node_id, node in kg_nodes.items():
+        if not isinstance(node, dict):
+            report('malformed_node', node_id)
+        elif not node.get("name"):
+            report('unnamed_node', node_id)
+    for edge_id, edge in kg_edges.items():
+        if not well_formed_edge(edge):
+            report('malformed_edge', edge_id)
+            continue
+        if not all(isinstance(attribute, dict) and isinstance(attribute.get("attribute_type_id"), str) and
+                   "value" in attribute for attribute in edge.get("attributes") or []):
+            report('malformed_attribute', edge_id)
+        for node in (edge["subject"], edge["object"]):
+            if node not in kg_nodes:
+                report('dangling_edge_node', f"{edge_id} -> {node}")
+    for aux_graph_id, aux_graph in aux_graphs.items():
+        if not isinstance(aux_graph, dict) or not isinstance(aux_graph.get("edges"), list):
+            report('malformed_aux_graph', aux_graph_id)
+            continue
+        for edge_id in aux_graph["edges"]:
+            if edge_id not in kg_edges:
+                report('dangling_aux_edge', f"{aux_graph_id} -> {edge_id}")
+    if set(counts) - {'unnamed_node'}:
+        # the support graph checks below assume well-formed, fully resolvable edges and aux graphs
+        return counts, examples
+
+    checked_graphs = set()
+    edge_roles = {}
+    for index, result in enumerate(message["results"]):
+        if not well_formed_result(result):
+            report('malformed_result', f"results[{index}]")
+            continue
+        for bindings in result["node_bindings"].values():
+            for binding in bindings:
+                if binding["id"] not in kg_nodes:
+                    report('dangling_result_node', binding["id"])
+        for bindings in result["analyses"][0]["edge_bindings"].values():
+            edge_id = bindings[0]["id"]
+            if edge_id not in kg_edges:
+                report('dangling_result_edge', edge_id)
+                continue
+            support_graphs = get_support_graphs(kg_edges[edge_id])
+            if not support_graphs:
+                report('missing_support_graphs', edge_id)
+            for graph in support_graphs:
+                if not isinstance(graph, str):
+                    report('malformed_attribute', edge_id)
+                    continue
+                if graph in checked_graphs:
+                    continue
+                checked_graphs.add(graph)
+                if graph not in aux_graphs:
+                    report('dangling_aux_graph', f"{edge_id} -> {graph}")
+                    continue
+                check_support_graph(graph, aux_graphs, kg_edges, report, checked_graphs, edge_roles)
+
+    return counts, examples
+
+
+def well_formed_edge(edge):
+    return isinstance(edge, dict) and all(isinstance(edge.get(key), str) for key in ("subject", "object", "predicate")) \
+        and isinstance(edge.get("attributes") or [], list)
+
+
+def well_formed_result(result):
+    try:
+        return all(isinstance(binding["id"], str) for bindings in result["node_bindings"].values() for binding in bindings) \
+            and len(result["analyses"][0]["edge_bindings"]) > 0 and \
+            all(isinstance(bindings[0]["id"], str) for bindings in result["analyses"][0]["edge_bindings"].values())
+    except (AttributeError, IndexError, KeyError, TypeError):
+        return False
+
+
+def check_support_graph(graph, aux_graphs, kg_edges, report, checked_graphs, edge_roles):
+    # the same classification the support index is built with, so what passes here indexes the same way
+    enrichment2group_edge, group2curie_edge = classify_support_graph(aux_graphs[graph]["edges"], kg_edges, edge_roles)
+    if not enrichment2group_edge or not group2curie_edge:
+        report('incomplete_support_graph', graph)
+        return
+    if not kg_edges[enrichment2group_edge].get("sources"):
+        report('missing_sources', enrichment2group_edge)
+
+    # the enrichment edges of the nested graphs (those away from the lookup terminals) carry the p-values
+    terminals = {kg_edges[group2curie_edge]["subject"], kg_edges[group2curie_edge]["object"]}
+    for value in get_support_graphs(kg_edges[enrichment2group_edge]):
+        for nested in value if isinstance(value, list) else []:
+            if not isinstance(nested, str) or nested not in aux_graphs:
+                report('dangling_aux_graph', f"{enrichment2group_edge} -> {nested}")
+                continue
+            # enrichment groups are shared between inferences, so their graphs come up again and again
+            if nested in checked_graphs:
+                continue
+            checked_graphs.add(nested)
+            for edge_id in aux_graphs[nested]["edges"]:
+                edge = kg_edges[edge_id]
+                if edge["subject"] in terminals or edge["object"] in terminals:
+                    continue
+                if not any(attribute["attribute_type_id"] == P_VALUE for attribute in edge.get("attributes") or []):
+                    report('missing_pvalue', edge_id)
+
+
+@timed('validate_answerset')
+def validate_answerset(answerset):
+    """ Returns None for a usable answer set, otherwise a report of what is wrong with it """
+    errors = schema_errors(answerset)
+    if errors:
+        inc('edgar_validation_failures_total', stage='schema')
+        return {'schema': errors, 'references': {}, 'examples': {}}
+    counts, examples = reference_errors(answerset["message"])
+    if counts:
+        inc('edgar_validation_failures_total', stage='references')
+        return {'schema': [], 'references': dict(counts), 'examples': dict(examples)}
+    return None
+
+
+def format_report(report):
+    if report['schema']:
+        lines = ["The answer set does not follow the TRAPI message structure:"] + report['schema']
+        if len(report['schema']) == MAX_SCHEMA_ERRORS:
+            lines.append("(only the first errors are shown)")
+    else:
+        lines = ["The answer set has broken references:"]
+        for kind, count in sorted(report['references'].items(), key=lambda item: -item[1]):
+            lines.append(f"{count} {REFERENCE_ERRORS[kind]}, e.g. {', '.join(report['examples'][kind])}")
+    return '\n'.join(lines)
@@ -1,14 +1,26 @@
+import numpy as np
 import pandas as pd
-import orjson
+import plotly.graph_objects as go
 from io import StringIO
 from dash import html, dash_table, dcc, callback_context
-from dash_extensions.enrich import Input, Output, callback, State, ALL
+from dash_extensions.enrich import Input, Output, callback, clientside_callback, State, ALL, ClientsideFunction
 from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
 import dash_cytoscape as cyto
 import os
+import re
 import logging
 from src.utils import LoggingUtil
+from src.jobs import get_job, submit_or_attach, DONE, FAILED
+from src.report import report_url, FORMATS as REPORT_FORMATS, HTML, CSV
+from src.session_state import answerset_state
+from src.graph_index import graph_index, MAX_NODES, NEIGHBORHOOD, SHARED_NEIGHBORS, SHORTEST_PATH
+from src.inference_search import inference_search
+from src.metrics import stage_timer, timed
+from src.validation import validate_answerset, format_report
+from src.chains import linear_path
+from src.answerset_index import build_support_index, build_ranking_index, enrichment_group, get_inference_edges, \
+    get_inference_methods, threshold_cut, top_k, ENRICHMENT2GROUP, GROUP2CURIE
 
 this_dir = os.path.dirname(os.path.realpath(__file__))
 
@@ -108,8 +120,9 @@ def get_answer_components(answerset):
     return query_graph, kg_edges, kg_nodes, results, aux_graphs
 
 
-def get_inferred_result_df( kg_edges, kg_nodes, results ):
-    inferences = [edge[0]['id'] for result in results for _, edge in result["analyses"][0]["edge_bindings"].items()]
+@timed('get_inferred_result_df')
+def get_inferred_result_df( kg_edges, kg_nodes, results, support_index ):
+    inferences = get_inference_edges(results)
     inference_list = [[kg_edges[inferred_edge]["subject"], kg_nodes[kg_edges[inferred_edge]["subject"]]["name"],
                        kg_edges[inferred_edge]["predicate"],
                        kg_nodes[kg_edges[inferred_edge]["object"]]["name"], inferred_edge] for inferred_edge in
@@ -117,16 +130,78 @@ def get_inferred_result_df( kg_edges, kg_nodes, results ):
 
     df = pd.DataFrame(inference_list, columns=["Source_ID", "Source", "Predicate", "Target", "EdgeString"])
 
-    support_graphs = [[attributes["value"] for attributes in kg_edges[inference_edge]["attributes"] if
-                       attributes["attribute_type_id"] == "biolink:support_graphs"] for inference_edge in inferences]
-    method_mapping = [', '.join({"graph" if support[0] == 'e' else 'property' for support in supports}) for supports in
-                      support_graphs]
+    method_mapping = [', '.join(sorted(get_inference_methods(support_index, inference_edge))) for inference_edge in
+                      inferences]
     df["Enrichment_method"] = method_mapping
     return df
 
 
+@timed('get_enrichment_df')
+def get_enrichment_df( kg_edges, kg_nodes, support_index ):
+    enrichment_list = []
+    for inference_edge, graphs in support_index['inferences'].items():
+        for graph in graphs:
+            support_graph = support_index['support_graphs'][graph]
+            if not (support_graph[ENRICHMENT2GROUP] and support_graph[GROUP2CURIE]):
+                continue
+            enrichment2group_edge = kg_edges[support_graph[ENRICHMENT2GROUP]]
+            group = enrichment_group(enrichment2group_edge, kg_edges[support_graph[GROUP2CURIE]])
+            pvalue = support_graph['pvalues'][0] if support_graph['pvalues'] else None
+            enrichment_list.append([inference_edge, graph, support_graph['method'], group,
+                                    kg_nodes.get(group, {}).get('name', group), enrichment2group_edge['predicate'],
+                                    pvalue, ', '.join(source['resource_id'] for source in enrichment2group_edge.get('sources', []))])
+
+    return pd.DataFrame(enrichment_list, columns=["EdgeString", "Support_Graph", "Enrichment_method", "Group_ID", "Group",
+                                                  "Predicate", "Pvalue", "Knowledge_Source"])
+
+
+@timed('get_group_stats_df')
+def get_group_stats_df( enrichment_df ):
+    # one row per enrichment group: how many inferences it supports and how strongly
+    grouped = enrichment_df.astype({"Pvalue": float}).groupby(["Group_ID", "Group", "Predicate"])
+    stats = grouped.agg(Inferences=("EdgeString", "nunique"), Support_Graphs=("Support_Graph", "count"),
+                        Min_Pvalue=("Pvalue", "min"), Median_Pvalue=("Pvalue", "median"), Max_Pvalue=("Pvalue", "max"))
+    stats["Q1_Pvalue"] = grouped["Pvalue"].quantile(0.25)
+    stats["Q3_Pvalue"] = grouped["Pvalue"].quantile(0.75)
+    stats["Enrichment_method"] = grouped["Enrichment_method"].agg(lambda methods: ', '.join(sorted(set(methods))))
+    stats["Knowledge_Source"] = grouped["Knowledge_Source"].agg(
+        lambda sources: ', '.join(sorted({source for value in sources for source in value.split(', ') if source})))
+    stats = stats.reset_index().sort_values(["Inferences", "Min_Pvalue"], ascending=[False, True], ignore_index=True)
+    return stats[["Group_ID", "Group", "Predicate", "Enrichment_method", "Inferences", "Support_Graphs", "Min_Pvalue",
+                  "Q1_Pvalue", "Median_Pvalue", "Q3_Pvalue", "Max_Pvalue", "Knowledge_Source"]]
+
+
+def group_stats_figure( stats, top=25 ):
+    top_groups = stats.head(top).iloc[::-1]
+    figure = go.Figure(go.Bar(
+        x=top_groups["Inferences"], y=top_groups["Group"] + " (" + top_groups["Predicate"].str.replace("biolink:", "") + ")",
+        orientation='h',
+        marker={'color': -np.log10(top_groups["Median_Pvalue"].clip(lower=1e-300)), 'colorscale': 'Blues',
+                'colorbar': {'title': '-log10 median p'}},
+        customdata=top_groups[["Min_Pvalue", "Median_Pvalue", "Max_Pvalue"]],
+        hovertemplate="%{y}<br>%{x} inferences<br>p min %{customdata[0]:.2e}, median %{customdata[1]:.2e}, "
+                      "max %{customdata[2]:.2e}<extra></extra>"))
+    figure.update_layout(title=f"Top {len(top_groups)} enrichment groups by supported inferences",
+                         height=max(300, 22 * len(top_groups) + 120), margin={'l': 10, 'r': 10, 't': 40, 'b': 30},
+                         xaxis_title="Inferences")
+    return figure
+
+
+def add_ranking_columns( df, ranking_index ):
+    ranking = pd.DataFrame({
+        "EdgeString": ranking_index['order'],
+        "Rank": range(1, len(ranking_index['order']) + 1),
+        "Score": ranking_index['score'],
+        "Best_Pvalue": ranking_index['best_pvalue'],
+        "Paths": ranking_index['paths'],
+    })
+    df = df.merge(ranking, on="EdgeString").sort_values("Rank", ignore_index=True)
+    return df[["Rank", *[column for column in df.columns if column != "Rank"]]]
+
+
 def get_all_node_categories(kg_nodes):
-    node_categories = list({kg_node["categories"][0] for kg_node in kg_nodes.values()})
+    # sorted, so every reload of an answer set hands out the same colors and shapes
+    node_categories = sorted({(kg_node.get("categories") or ["Unknown"])[0] for kg_node in kg_nodes.values()})
     return node_categories
 
 
@@ -150,33 +225,65 @@ def generate_color_map(categories, palette=color_palette):
     return {**fixed_colors, **dynamic_colors}
 
 
-def get_node_color( category_colors, category ):
-    return category_colors.get(category, "#CCCCCC")
+NODE_SHAPES = ['ellipse', 'triangle', 'rectangle', 'round-rectangle', 'diamond', 'pentagon', 'hexagon', 'heptagon',
+               'octagon']
+UNKNOWN_STYLE = {'color': '#CCCCCC', 'shape': 'ellipse', 'class': 'category-unknown'}
+
+
+def category_class( category ):
+    return 'category-' + re.sub(r'[^A-Za-z0-9_-]', '-', category.split(':')[-1])
+
 
+def build_category_styles( node_categories, category_colors ):
+    """ category -> color, shape and Cytoscape class, resolved once per answer set """
+    return {category: {'color': category_colors.get(category, UNKNOWN_STYLE['color']),
+                       'shape': NODE_SHAPES[position % len(NODE_SHAPES)], 'class': category_class(category)}
+            for position, category in enumerate(node_categories)}
 
-def get_node_shape( node_categories, category ):
-    shapes = ['ellipse', 'triangle', 'rectangle', 'round-rectangle', 'diamond', 'pentagon', 'hexagon', 'heptagon',
-              'octagon']
-    return shapes[node_categories.index(category) % len(shapes)]
+
+def category_styles_of( indexed ):
+    # answer sets indexed before the table was kept get one built on first use
+    if 'category_styles' not in indexed:
+        node_categories = get_all_node_categories(indexed['kg_nodes'])
+        indexed['category_styles'] = build_category_styles(node_categories, generate_color_map(node_categories))
+    return indexed['category_styles']
+
+
+def node_class( category_styles, category ):
+    return category_styles.get(category, UNKNOWN_STYLE)['class']
+
+
+def category_stylesheet( category_styles ):
+    """ One class selector per category, so elements carry a class name instead of an inline style """
+    return [{'selector': f"node.{style['class']}", 'style': {'background-color': style['color'], 'shape': style['shape']}}
+            for style in [UNKNOWN_STYLE, *category_styles.values()]]
 
 
 def display_qg( query_graph ):
     nodes = []
     edges = []
-    for node, node_dict in query_graph["nodes"].items():
+    element_ids = {}
+    # pinned node first, then the returned nodes hop by hop to its right
+    try:
+        ordered = [(node, query_graph["nodes"][node]) for node in linear_path(query_graph)[0]]
+    except ValueError:
+        ordered = sorted(query_graph["nodes"].items(), key=lambda item: not item[1].get('ids'))
+    for position, (node, node_dict) in enumerate(ordered):
         if node_dict.get('ids'):
             abackground_color = '#FF5733'
             q_node_ids = node_dict.get('ids')
+            element_ids[node] = q_node_ids[0]
             nodes.append({'data': {'id': q_node_ids[0], 'label': q_node_ids[0]},
                           'style': {'background-color': abackground_color},
-                          'position': {'x': 30, 'y': 30}, 'size': 30})
+                          'position': {'x': 30 + 170 * position, 'y': 30}, 'size': 30})
 
         elif not node_dict.get('ids'):
             qbackground_color = '#33D4FF'
-            return_category = f"? {node_dict.get('categories', [])[0].split(':')[-1]}"
+            return_category = f"? {(node_dict.get('categories') or [node])[0].split(':')[-1]}"
+            element_ids[node] = return_category
             nodes.append({'data': {'id': return_category, 'label': return_category},
                           'style': {'background-color': qbackground_color},
-                          'position': {'x': 200, 'y': 30}, 'size': 30})
+                          'position': {'x': 30 + 170 * position, 'y': 30}, 'size': 30})
 
     for edge, edge_data in query_graph["edges"].items():
         predicates = edge_data.get('predicates', [])
@@ -184,21 +291,23 @@ def display_qg( query_graph ):
             label = predicates[0].split(':')[-1]
         else:
             label = edge
-        edges.append({'data': {'source': return_category, 'target': q_node_ids[0], 'label': label}})
+        edges.append({'data': {'source': element_ids[edge_data['subject']], 'target': element_ids[edge_data['object']], 'label': label}})
     return nodes + edges
 
 
-def sifteredges( aux_graph_edges, kg_edges ):
-    enrich2group_aux_graph_edge = ''
-    group2curie_aux_graph_edge = ''
-    for aedge in aux_graph_edges:
-        support = [attributes["value"] for attributes in kg_edges[aedge]["attributes"]]
-        if support:
-            if isinstance(support[0], list):
-                enrich2group_aux_graph_edge = aedge
-            else:
-                group2curie_aux_graph_edge = aedge
-    return enrich2group_aux_graph_edge, group2curie_aux_graph_edge
+def subgraph_elements( nodes, edges, kg_nodes, kg_edges, category_styles, highlight=() ):
+    """ Cytoscape elements for a node/edge selection from the graph index; highlighted nodes are drawn larger """
+    elements = []
+    for node in nodes:
+        properties = kg_nodes.get(node, {})
+        category = (properties.get("categories") or ["Unknown"])[0]
+        classes = node_class(category_styles, category) + (' highlight' if node in highlight else '')
+        elements.append({'data': {'id': node, 'label': f"{properties.get('name', node)} ({node})"}, 'classes': classes})
+    for edge_id in edges:
+        edge = kg_edges[edge_id]
+        elements.append({'data': {'id': edge_id, 'source': edge['subject'], 'target': edge['object'],
+                                  'label': edge['predicate'].split(':')[-1]}})
+    return elements
 
 
 def pickgroup2curieedge(enrichment2group_edge, group2curie_edge, kg_nodes, kg_edges, aux_graphs):
@@ -226,43 +335,28 @@ def pickgroup2curieedge(enrichment2group_edge, group2curie_edge, kg_nodes, kg_ed
                     theedge = [kg_nodes[edge["object"]]["name"], 'has_member', kg_nodes[edge["subject"]]["name"]]
                     subject = edge["subject"]
                     object_ = edge["object"]
+                    # the lookup edge continues at the terminal after the one this member edge touches
                     if subject in terminals:
-                        next_element = terminals[
-                            terminals.index(subject) + 1] if subject in terminals and terminals.index(
-                            subject) + 1 < len(subject) else None
+                        next_element = terminals[min(terminals.index(subject) + 1, len(terminals) - 1)]
                         finaledge = [kg_nodes[object_]["name"], group2curie_edge["predicate"],
                                      kg_nodes[next_element]["name"]]
                     elif object_ in terminals:
-                        try:
-                            next_element = terminals[
-                                terminals.index(object_) + 1] if object_ in terminals and terminals.index(
-                                object_) + 1 < len(
-                                object_) else None
-                        except:
-                            next_element = terminals[
-                                terminals.index(object_)] if object_ in terminals and terminals.index(
-                                object_) + 1 < len(object_) else None
-
-                        # next_element = terminals[
-                        #     terminals.index(object_) + 1] if object_ in terminals and terminals.index(
-                        #     object_) + 1 < len(
-                        #     object_) else None
+                        next_element = terminals[min(terminals.index(object_) + 1, len(terminals) - 1)]
                         finaledge = [group2curie_edge["predicate"], kg_nodes[next_element]["name"]]
                     finaledges.append(theedge + finaledge)
     return pvalues, finaledges
 
 
-def generate_legend(node_categories, category_colors):
+def generate_legend(category_styles):
     legend_items = []
-    for category in node_categories:
-        color = category_colors.get(category, "#000000")
-        shape = get_node_shape(node_categories, category)
+    for category, style in category_styles.items():
+        color, shape = style['color'], style['shape']
         legend_items.append(
             html.Div([
                 html.Span(
                     style={'display': 'inline-block', 'width': '9px', 'height': '9px', 'background-color': color,
                            'shape': shape}),
-                html.Span(f"{category.split(':')[1]} ({shape})", style={'margin-left': '10px', 'font-size': '9px'})
+                html.Span(f"{category.split(':')[-1]} ({shape})", style={'margin-left': '10px', 'font-size': '9px'})
             ], style={'display': 'flex', 'align-items': 'center', 'margin-bottom': '5px'})
         )
 
@@ -270,18 +364,20 @@ def generate_legend(node_categories, category_colors):
                     style={'display': 'flex', 'flex-wrap': 'wrap', 'gap': '20px', 'align-items': 'right'})
 
 
-def generate_elements(inference_edge, kg_nodes, kg_edges, aux_graphs, node_categories, category_colors):
+@timed('generate_elements')
+def generate_elements(inference_edge, kg_nodes, kg_edges, aux_graphs, category_styles, support_index):
     elements_list = []
-    support_graphs = [attributes["value"] for attributes in kg_edges[inference_edge]["attributes"] if
-                      attributes["attribute_type_id"] == "biolink:support_graphs"]
+    support_graphs = support_index['inferences'][inference_edge]
 
-    enriched2grouplist, lookup_lists, pvalues = generate_rules(inference_edge, kg_nodes, kg_edges, aux_graphs)
+    enriched2grouplist, lookup_lists, pvalues = generate_rules(inference_edge, kg_nodes, kg_edges, aux_graphs, support_index)
 
     support_graphs_pvalues = sorted(zip(support_graphs, pvalues), key=lambda x: x[1])
     # support_graphs_pvalues = zip(support_graphs, pvalues)
 
-    for graph_index, (graph, pvalue) in enumerate(support_graphs_pvalues):
+    for graph_position, (graph, pvalue) in enumerate(support_graphs_pvalues):
         elements = []
+        # each node is drawn once per graph; its full record is looked up on the server when it is tapped
+        drawn = set()
         position_offset = 30  # Offset for each support graph
         position_y = 1 * position_offset
         aux_graph_edges = aux_graphs.get(graph).get("edges")
@@ -299,66 +395,70 @@ def generate_elements(inference_edge, kg_nodes, kg_edges, aux_graphs, node_categ
             else:
                 predicate = f"{kedge['predicate']}"
 
-            support_graphs2 = [attributes["value"] for attributes in kedge["attributes"] if
-                               attributes["attribute_type_id"] == "biolink:support_graphs"]
-            if support_graphs2 and isinstance(support_graphs2[0], list):
+            edge_roles = support_index['edges'][auxedge]
+            role = edge_roles['role']
+            if role == ENRICHMENT2GROUP:
                 predicate = predicate + f"({pvalue})"
 
             target = kedge["object"]
             target_properties = kg_nodes[target]
 
-            node_size = 10 * len(support_graphs)
-            source_color = get_node_color(category_colors, source_properties.get("categories", ["Unknown"])[0])
-            target_color = get_node_color(category_colors, target_properties.get("categories", ["Unknown"])[0])
-            source_shape = get_node_shape(node_categories, source_properties.get("categories", ["Unknown"])[0])
-            target_shape = get_node_shape(node_categories, target_properties.get("categories", ["Unknown"])[0])
+            source_class = node_class(category_styles, source_properties.get("categories", ["Unknown"])[0])
+            target_class = node_class(category_styles, target_properties.get("categories", ["Unknown"])[0])
 
             # Positioning nodes to avoid overlap
             position_x = index * position_offset
-            sourcedata = {'id': source, 'label': f"{source_properties['name']} ({source})"}
-            sourcedata.update(source_properties)
-            elements.append({'data': sourcedata,  'position': {'x': position_x, 'y': position_y}, 'style': {'width': node_size, 'height': node_size, 'background-color': source_color, 'shape': source_shape}})
-            targetdata = {'id': target, 'label': f"{target_properties['name']} ({target})"}
-            targetdata.update(target_properties)
-            elements.append({'data': targetdata, 'position': {'x': position_x + 200, 'y': position_y}, 'style': {'background-color': target_color, 'shape': target_shape}})
-
-            predicatedata = {'source': source, 'target': target, 'label': predicate,
-                             'support_graphs': support_graphs2}
+            if source not in drawn:
+                drawn.add(source)
+                elements.append({'data': {'id': source, 'label': f"{source_properties['name']} ({source})"},
+                                 'position': {'x': position_x, 'y': position_y}, 'classes': source_class})
+            if target not in drawn:
+                drawn.add(target)
+                elements.append({'data': {'id': target, 'label': f"{target_properties['name']} ({target})"},
+                                 'position': {'x': position_x + 200, 'y': position_y}, 'classes': target_class})
+
+            predicatedata = {'source': source, 'target': target, 'label': predicate, 'panel': edge_roles.get('panel')}
             elements.append({'data': predicatedata})
-            position_y = graph_index * position_offset
+            position_y = graph_position * position_offset
         elements_list.append(elements)
 
     return elements_list, enriched2grouplist, lookup_lists
 
 
-def generate_rules( selected_inference_edge, kg_nodes, kg_edges, aux_graphs):
+def support_graph_rule( graph, kg_nodes, kg_edges, aux_graphs, support_index ):
+    """ The enrichment rule, lookup member paths and p-values behind one support graph """
+    support_graph = support_index['support_graphs'][graph]
+    enrichment2group_edge = kg_edges[support_graph[ENRICHMENT2GROUP]]
+    group2curie_edge = kg_edges[support_graph[GROUP2CURIE]]
+    pvalue, lookupedges = pickgroup2curieedge(enrichment2group_edge, group2curie_edge, kg_nodes, kg_edges, aux_graphs)
+    pvalue = ', '.join(format(pval, '.4g') for pval in pvalue)
+    rule = [kg_nodes[enrichment2group_edge['subject']]['name'], enrichment2group_edge['predicate'], kg_nodes[enrichment2group_edge['object']]['name'], pvalue, ', '.join([source['resource_id'] for source in enrichment2group_edge['sources']])]
+    return rule, lookupedges, pvalue
+
+
+@timed('generate_rules')
+def generate_rules( selected_inference_edge, kg_nodes, kg_edges, aux_graphs, support_index):
     lookup_lists = []
     enriched2grouplist = []
     pvalues = []
-    kginference_edge = kg_edges[selected_inference_edge]
-    support_graphs = [attributes["value"] for attributes in kginference_edge["attributes"] if
-                      attributes["attribute_type_id"] == "biolink:support_graphs"]
-    for graph_index, graph in enumerate(support_graphs):  # graph/property
-        aux_graph_edges = aux_graphs.get(graph).get("edges")  # usually length 3
-        enrich2group_aux_graph_edge, group2curie_aux_graph_edge = sifteredges(aux_graph_edges, kg_edges)
-
-        # 2. enrich2group_aux_graph_edge
-        enrichment2group_edge = kg_edges[enrich2group_aux_graph_edge]
-
-        # 3. enrich2group_aux_graph_edge/group2curie_aux_graph_edge
-        group2curie_edge = kg_edges[group2curie_aux_graph_edge]
-        pvalue, lookupedges = pickgroup2curieedge(enrichment2group_edge, group2curie_edge, kg_nodes, kg_edges, aux_graphs)
+    for graph in support_index['inferences'][selected_inference_edge]:  # graph/property
+        rule, lookupedges, pvalue = support_graph_rule(graph, kg_nodes, kg_edges, aux_graphs, support_index)
         lookup_lists.extend(lookupedges)
-
-        # 2. contd
-        pvalue = ', '.join(format(pval, '.4g') for pval in pvalue)
         pvalues.append(pvalue)
-
-        enriched2grouplist.append([kg_nodes[enrichment2group_edge['subject']]['name'], enrichment2group_edge['predicate'], kg_nodes[enrichment2group_edge['object']]['name'], pvalue, ', '.join([source['resource_id'] for source in enrichment2group_edge['sources']])])
+        enriched2grouplist.append(rule)
 
     return enriched2grouplist, lookup_lists, pvalues
 
 
+def inferred_records( df ):
+    # row ids let the selection callbacks receive the selected edges instead of the whole table
+    return df.assign(id=df["EdgeString"]).to_dict("records")
+
+
+def min_pvalue( pvalues ):
+    return min((float(pvalue) for pvalue in pvalues.split(', ') if pvalue), default=1.0)
+
+
 def onetable(df, tableid):
     return dash_table.DataTable(
         data=df.to_dict("records"),
@@ -388,24 +488,51 @@ def onetable(df, tableid):
 dbf = pd.DataFrame({})
 
 
-def vizlayout(answerset):
-    if isinstance(answerset, dict):
-        try:
-            answerset_json = orjson.dumps(answerset).decode('utf-8')
-            qg = answerset["message"]["query_graph"]
-        except Exception as e:
-            logger.error(f"Error in json input in vizlayout function: {type(e).__name__}: {str(e)}")
-    if isinstance(answerset, str):
-        try:
-            qg = orjson.loads(answerset)["message"]["query_graph"]
-            answerset_json = answerset
-        except Exception as e:
-            logger.error(f"Error in string input in vizlayout function: {type(e).__name__}: {str(e)}")
+def check_answerset(answerset):
+    report = validate_answerset(answerset)
+    if report is None:
+        return None
+    message = format_report(report)
+    logger.error(message)
+    return message
+
+
+@timed('index_answerset')
+def index_answerset(answerset):
+    query_graph, kg_edges, kg_nodes, results, aux_graphs = get_answer_components(answerset)
+    with stage_timer('index_answerset.categories'):
+        node_categories = get_all_node_categories(kg_nodes)
+        category_colors = generate_color_map(node_categories)
+        category_styles = build_category_styles(node_categories, category_colors)
+
+    with stage_timer('index_answerset.support_index'):
+        support_index = build_support_index(kg_edges, results, aux_graphs)
+    with stage_timer('index_answerset.ranking_index'):
+        ranking_index = build_ranking_index(support_index)
+    df = add_ranking_columns(get_inferred_result_df(kg_edges, kg_nodes, results, support_index), ranking_index)
+    enrichment_df = get_enrichment_df(kg_edges, kg_nodes, support_index)
+    with stage_timer('index_answerset.group_stats'):
+        group_stats_df = get_group_stats_df(enrichment_df)
+
+    return {'query_graph': query_graph, 'kg_nodes': kg_nodes, 'kg_edges': kg_edges, 'results': results,
+            'aux_graphs': aux_graphs, 'category_styles': category_styles,
+            'inferred_df': df.to_json(orient='split'), 'enrichment_df': enrichment_df.to_json(orient='split'),
+            'group_stats_df': group_stats_df.to_json(orient='split'),
+            'support_index': support_index, 'ranking_index': ranking_index}
+
+
+def vizlayout(handle):
+    job = get_job(handle)
+    if job is None or job['status'] != DONE:
+        logger.error(f"No processed answer set to visualize in vizlayout function: {handle}")
+        return html.Div("No answer set to visualize")
+    qg = job['summary']['query_graph']
 
     try:
         layout = dbc.Container([html.Div([
-            dcc.Store(id='answerset-input', data=answerset_json),
-            dcc.Store(id='stored-node-categories'), dcc.Store(id='stored-category-colors'), dcc.Store(id='stored-kg-nodes'), dcc.Store(id='stored-kg-edges'), dcc.Store(id='stored-aux-graphs'), dcc.Store(id='stored-qg'), dcc.Store(id='stored-results'), dcc.Store(id='stored-inferred-df'),
+            dcc.Store(id='answerset-input', data=handle),
+            # the knowledge graph and indexes stay on the server (src.session_state); the browser holds only the handle
+            dcc.Store(id='stored-inferred-df'), dcc.Store(id='stored-group-stats'),
             dbc.Row([
                 dbc.Card(
                     [dbc.CardHeader("Question Graph:", style={"color": "#0096FF", 'background-color': '#cbd3dd'}),
@@ -445,7 +572,20 @@ def vizlayout(answerset):
                             style={'padding-left': '20px'}
                             # style={'display': 'none'}  # Initially hidden
                         ),
-                    )
+                    ),
+                    html.Hr(),
+                    html.Div([
+                        html.Label("Search:"),
+                        dcc.Input(id='inference-search-input', type='text', placeholder='name, curie, group, source...',
+                                  debounce=True, style={'width': '100%'}),
+                        html.Div(id='inference-search-count', style={'font-size': '80%'}),
+                        html.Label("Top candidates:"),
+                        dcc.Input(id='top-k-input', type='number', min=1, step=1, placeholder='all', debounce=True,
+                                  style={'width': '100%'}),
+                        html.Label("Max combined p-value:"),
+                        dcc.Input(id='pvalue-cut-input', type='number', min=0, placeholder='any', debounce=True,
+                                  style={'width': '100%'}),
+                    ], style={'padding-left': '20px'}),
                 ], style={"padding": "20px", 'background-color': '#cbd3dd', 'height': '65vh'}), width=2),
                 dbc.Col(html.Div([html.Marquee("Select row(s) then scroll up to see the inference path", style={'background-color': '#cbd3dd', 'color': '#000080'}), html.Div(id='result-table-container', children=[
                         dash_table.DataTable(
@@ -454,7 +594,31 @@ def vizlayout(answerset):
                             data=dbf.to_dict('records'),
                         )
                     ])]), className="col-10")]),
-            dbc.Row([dbc.Col(html.Div(id='cytoscape-cards'), width=8), dbc.Col(html.Div(id='edge-data-table-div'), width=4)]),
+            dbc.Row([dbc.Col(html.Div(id='cytoscape-cards'), width=8), dbc.Col([html.Div(id='node-detail-div'), html.Div(id='edge-data-table-div')], width=4)]),
+            dbc.Accordion([dbc.AccordionItem(dcc.Loading(html.Div(id='group-stats-container')), title='Enrichment group summary', item_id='group-stats')],
+                          id='group-stats-accordion', start_collapsed=True, style={'margin': '1em'}),
+            dbc.Accordion([dbc.AccordionItem([
+                dbc.Row([
+                    dbc.Col(dcc.RadioItems(id='graph-operation', options=[{'label': ' Neighborhood', 'value': NEIGHBORHOOD},
+                                                                          {'label': ' Shared neighbors', 'value': SHARED_NEIGHBORS},
+                                                                          {'label': ' Shortest path', 'value': SHORTEST_PATH}],
+                                           value=NEIGHBORHOOD, inline=True, inputStyle={'margin-left': '1em'}), width='auto'),
+                    dbc.Col(dcc.Input(id='graph-node-a', type='text', placeholder='Node curie, e.g. a candidate'), width='auto'),
+                    dbc.Col(dcc.Input(id='graph-node-b', type='text', placeholder='Second node (shared/path)'), width='auto'),
+                    dbc.Col(dcc.Input(id='graph-hops', type='number', min=1, max=4, step=1, value=1, style={'width': '5em'}), width='auto'),
+                    dbc.Col(html.Button("Explore", id='graph-run', n_clicks=0), width='auto'),
+                ], align='center'),
+                dcc.Loading(html.Div(id='graph-explore-container')),
+            ], title='Explore the knowledge graph', item_id='graph-explore')], start_collapsed=True, style={'margin': '1em'}),
+            dbc.Row([
+                dbc.Col(dcc.Checklist(id='report-formats', options=[{'label': f' {fmt.upper()}', 'value': fmt} for fmt in REPORT_FORMATS],
+                                      value=[HTML, CSV], inline=True, inputStyle={'margin-left': '1em'}), width='auto'),
+                dbc.Col(html.Button("Export report", id='report-button', n_clicks=0), width='auto'),
+                dbc.Col(dbc.Progress(id='report-progress', value=0, label='', style={'height': '1.5em'}), width=3),
+                dbc.Col(html.Div(id='report-link'), width='auto'),
+                dcc.Interval(id='report-interval', interval=1000, n_intervals=0, disabled=True),
+                dcc.Store(id='report-job'),
+            ], align='center', style={'margin': '1em'}),
             dcc.Store(id='stored-enrichment', data={}),
             dcc.Store(id='stored-lookup', data={}),
             dcc.Store(id='stored-edge-data', data={}),
@@ -466,47 +630,99 @@ def vizlayout(answerset):
 
 
 ########## Initial Data Storage #############
-@callback(Output("hmmm-viz-gone-wrong", "children"), Output('stored-qg', 'data'), Output('stored-kg-nodes', 'data'), Output('stored-kg-edges', 'data'), Output('stored-results', 'data'), Output('stored-aux-graphs', 'data'), Output('stored-node-categories', 'data'), Output('stored-category-colors', 'data'), Output('stored-inferred-df', 'data'), Input('answerset-input', 'data'))
-def update_stores(json_answerset):
-    if not json_answerset:
+@callback(Output("hmmm-viz-gone-wrong", "children"), Output('stored-inferred-df', 'data'), Output('stored-group-stats', 'data'), Input('answerset-input', 'data'))
+@timed('update_stores')
+def update_stores(handle):
+    if not handle:
         msg = "no_answerset"
         logger.error(msg)
-        return html.Div(msg), [], [], [], [], [], [], [], []
+        return html.Div(msg), [], None
 
-    answerset = orjson.loads(json_answerset)
-    if "message" not in answerset:
-        msg = "No 'message' the response json file"
+    with stage_timer('update_stores.load'):
+        indexed = answerset_state.get(handle)
+    if indexed is None:
+        msg = f"No indexed answer set for {handle}"
         logger.error(msg)
-        return html.Div(msg), [], [], [], [], [], [], [], []
+        return html.Div(msg), [], None
 
-    if "query_graph" not in answerset["message"]:
-        msg = "No 'query_graph' in the response message"
-        logger.error(msg)
-        return html.Div(msg), [], [], [], [], [], [], [], []
-
-    if "knowledge_graph" not in answerset["message"]:
-        msg = "No 'knowledge_graph' in the response message"
-        logger.error(msg)
-        return html.Div(msg), [], [], [], [], [], [], [], []
+    return '', indexed['inferred_df'], indexed.get('group_stats_df')
 
-    if "results" not in answerset["message"]:
-        msg = "No 'results' in the response message"
-        logger.error(msg)
-        return html.Div(msg), [], [], [], [], [], [], [], []
-
-    if "auxiliary_graphs" not in answerset["message"]:
-        msg = "No 'auxiliary_graphs' in the response message"
-        logger.error(msg)
-        return html.Div(msg), [], [], [], [], [], [], [], []
 
-    query_graph, kg_edges, kg_nodes, results, aux_graphs = get_answer_components(answerset)
-    node_categories = get_all_node_categories(kg_nodes)
-    category_colors = generate_color_map(node_categories)
-
-    df = get_inferred_result_df(kg_edges, kg_nodes, results)
-    # print(df[[]].head(20))
-
-    return '', query_graph, kg_nodes, kg_edges, results, aux_graphs, node_categories, category_colors, df.to_json(orient='split')
+########## Graph Exploration #############
+@callback(Output('graph-explore-container', 'children'), Input('graph-run', 'n_clicks'), State('graph-operation', 'value'), State('graph-node-a', 'value'), State('graph-node-b', 'value'), State('graph-hops', 'value'), State('answerset-input', 'data'), prevent_initial_call=True)
+def explore_graph(n_clicks, operation, node_a, node_b, hops, handle):
+    node_a, node_b = (node_a or '').strip(), (node_b or '').strip()
+    if not node_a or (operation != NEIGHBORHOOD and not node_b):
+        return html.Div("Enter a node curie (and a second one for shared neighbors or paths)", style={'color': 'red'})
+    indexed = answerset_state.get(handle)
+    if indexed is None:
+        return html.Div(f"No indexed answer set for {handle}")
+    try:
+        index = graph_index(handle)
+        with stage_timer(f'graph.{operation}'):
+            if operation == NEIGHBORHOOD:
+                found = index.neighborhood(node_a, hops or 1)
+            elif operation == SHARED_NEIGHBORS:
+                found = index.shared_neighbors([node_a, node_b])
+            else:
+                found = index.shortest_path(node_a, node_b)
+    except KeyError as e:
+        return html.Div(str(e.args[0]), style={'color': 'red'})
+    if found is None:
+        return html.Div(f"No path between {node_a} and {node_b} outside the inferred edges")
+    nodes, edges = found
+    category_styles = category_styles_of(indexed)
+    return html.Div([
+        html.Div(f"{len(nodes)} nodes, {len(edges)} edges" + (f" (cut at {MAX_NODES} nodes)" if len(nodes) >= MAX_NODES else '')),
+        cyto.Cytoscape(id='graph-explore-cytoscape',
+                       elements=subgraph_elements(nodes, edges, indexed['kg_nodes'], indexed['kg_edges'], category_styles,
+                                                  highlight={node_a, node_b}),
+                       style={'width': '100%', 'height': '450px'},
+                       layout={'name': 'breadthfirst' if operation == SHORTEST_PATH else 'cose'},
+                       stylesheet=[{'selector': 'node', 'style': {'label': 'data(label)', 'font-size': '8px', 'width': 15, 'height': 15}},
+                                   *category_stylesheet(category_styles),
+                                   {'selector': 'node.highlight', 'style': {'width': 30, 'height': 30}},
+                                   {'selector': 'edge', 'style': {'label': 'data(label)', 'width': 1, 'font-size': '7px',
+                                                                  'curve-style': 'bezier', 'target-arrow-shape': 'triangle'}}]),
+    ])
+
+
+########## Report Export #############
+@callback(Output('report-job', 'data'), Output('report-interval', 'disabled'), Output('report-link', 'children'), Input('report-button', 'n_clicks'), State('answerset-input', 'data'), State('report-formats', 'value'), prevent_initial_call=True)
+def start_report(n_clicks, handle, formats):
+    if not handle:
+        raise PreventUpdate
+    formats = sorted(formats or [CSV])
+    # explaining every inference can take minutes, so a worker writes the report while the page polls its progress
+    report_job = submit_or_attach('report', {'source': handle, 'formats': formats}, f"report:{handle}:{','.join(formats)}")
+    return report_job, False, ''
+
+
+@callback(Output('report-progress', 'value'), Output('report-progress', 'label'), Output('report-link', 'children', allow_duplicate=True), Output('report-interval', 'disabled', allow_duplicate=True), Input('report-interval', 'n_intervals'), State('report-job', 'data'), prevent_initial_call=True)
+def poll_report(n_intervals, report_job):
+    job = get_job(report_job) if report_job else None
+    if job is None:
+        return 0, '', '', True
+    if job['status'] == DONE:
+        return 100, 'Done', html.A("Download report", href=report_url(report_job)), True
+    if job['status'] == FAILED:
+        logger.error(f"Report export failed: {job['error']}")
+        return 100, 'Failed', html.Span("Report export failed", style={'color': 'red'}), True
+    progress = round(100 * (job['progress'] or 0))
+    return progress, f"{progress}%", '', False
+
+
+########## Enrichment Group Summary #############
+@callback(Output('group-stats-container', 'children'), Input('group-stats-accordion', 'active_item'), State('stored-group-stats', 'data'), prevent_initial_call=True)
+def display_group_stats(active_item, stats_json):
+    if active_item != 'group-stats':
+        raise PreventUpdate
+    if not stats_json:
+        return html.Div("No enrichment group summary for this answer set; reload it to build one")
+    stats = pd.read_json(StringIO(stats_json), orient='split')
+    if stats.empty:
+        return html.Div("No enrichment groups in this answer set")
+    return html.Div([dcc.Graph(figure=group_stats_figure(stats)), onetable(stats, 'group-stats-table')])
 
 
 ########## Display Inference Table #############
@@ -515,7 +731,7 @@ def inferrence(df_json):
     if df_json:
         df = pd.read_json(StringIO(df_json), orient='split')
         return dash_table.DataTable(
-            data=df.to_dict("records"),
+            data=inferred_records(df),
             columns=[{"name": i, "id": i} for i in df.columns],
             id="result-table",
             style_table={"overflowY": "auto", "overflowX": "auto", "width": "100%"},
@@ -541,27 +757,46 @@ def inferrence(df_json):
 
 
 ########### SideBar Control ######################
-@callback(Output('inferred-checklist', 'value'), [Input('inferred-checklist', 'value')])
-def update_options(inferred_values):
-    if len(inferred_values) != 1:
-        return ['graph', 'property']
-    return inferred_values
+clientside_callback(
+    ClientsideFunction(namespace='edgar', function_name='normalize_checklist'),
+    Output('inferred-checklist', 'value'), [Input('inferred-checklist', 'value')]
+)
 
 
-@callback([Output('result-table-container', 'children', allow_duplicate=True),  Output('inferred-checklist', 'disabled')], [Input('inferred-checklist', 'value')], [State('result-table', 'data')], prevent_initial_call=True)
-def filter_table( selected_values, data):
+@callback([Output('result-table-container', 'children', allow_duplicate=True),  Output('inferred-checklist', 'disabled'), Output('inference-search-count', 'children')], [Input('inferred-checklist', 'value'), Input('top-k-input', 'value'), Input('pvalue-cut-input', 'value'), Input('inference-search-input', 'value')], [State('stored-inferred-df', 'data'), State('answerset-input', 'data')], prevent_initial_call=True)
+def filter_table( selected_values, k, pvalue_cut, search_text, df_json, handle):
     if not selected_values:
         raise PreventUpdate
-    if not data:
-        return html.Div(id="result-table", style={'display': 'None'}), True
-    df = pd.DataFrame(data)
+    if not df_json:
+        return html.Div(id="result-table", style={'display': 'None'}), True, ''
+    df = pd.read_json(StringIO(df_json), orient='split')
+    searching = bool(search_text and search_text.strip())
+    if k or pvalue_cut is not None or searching:
+        indexed = answerset_state.get(handle)
+        if indexed is None:
+            return html.Div(f"No indexed answer set for {handle}"), True, ''
+    if k or pvalue_cut is not None:
+        ranking_index = indexed['ranking_index']
+        candidates = threshold_cut(ranking_index, pvalue_cut) if pvalue_cut is not None else top_k(ranking_index, k)
+        if k:
+            candidates = candidates[:k]
+        df = df.set_index("EdgeString", drop=False).loc[candidates].reset_index(drop=True)
+    if searching:
+        try:
+            with stage_timer('filter_table.search'):
+                found = inference_search(handle).search(search_text)
+        except KeyError as e:
+            return html.Div(str(e.args[0])), True, ''
+        df = df[df["EdgeString"].isin(found)]
     if len(selected_values) == 2:
         filtered_df = df
     else:
         selected = [', '.join(selected_values)]
         filtered_df = df[df['Enrichment_method'].isin(selected)]
+    # what is left in the table once top-k, the p-value cut and the method boxes have had their say too
+    search_count = f"{len(filtered_df)} matching inferences shown" if searching else ''
     return dash_table.DataTable(
-            data=filtered_df.to_dict('records'),
+            data=inferred_records(filtered_df),
             columns=[{"name": i, "id": i} for i in filtered_df.columns],
             id="result-table",
             style_table={"overflowY": "auto", "overflowX": "auto", "width": "99%"},
@@ -582,24 +817,30 @@ def filter_table( selected_values, data):
             page_size=10,
             fixed_rows={"headers": True, "data": 0},
             fixed_columns={"headers": True, "data": 0},
-        ), False
+        ), False, search_count
 
 
 # ##### Path Display callbacks ####################
-@callback(Output("cytoscape-cards", "children"), Output("stored-lookup", "data"), Output("stored-enrichment", "data"), Input('result-table', "derived_virtual_data"), Input('result-table', "derived_virtual_selected_rows"), Input('stored-kg-nodes', 'data'), Input('stored-kg-edges', 'data'), Input('stored-aux-graphs', 'data'), Input('stored-node-categories', 'data'), Input('stored-category-colors', 'data'), prevent_initial_call=True)
-def update_elements( selected_data, selected_rows, kg_nodes, kg_edges, aux_graphs, node_categories, category_colors ):
-    if not selected_rows:
+@callback(Output("cytoscape-cards", "children"), Output("stored-lookup", "data"), Output("stored-enrichment", "data"), Input('result-table', "derived_virtual_selected_row_ids"), State('answerset-input', 'data'), prevent_initial_call=True)
+def update_elements( selected_results, handle ):
+    if not selected_results:
         return [], [], []
-    selected_results = [selected_data[i]['EdgeString'] for i in selected_rows]
+    indexed = answerset_state.get(handle)
+    if indexed is None:
+        return [html.Div(f"No indexed answer set for {handle}")], [], []
+    kg_nodes, kg_edges, aux_graphs, support_index = indexed['kg_nodes'], indexed['kg_edges'], indexed['aux_graphs'], indexed['support_index']
+    category_styles = category_styles_of(indexed)
+    node_stylesheet = category_stylesheet(category_styles)
 
     cards = []
     lookup_basket = {}
     enrichment_basket = {}
     for i, result in enumerate(selected_results):
-        elements_list, enriched2grouplist, lookup_lists = generate_elements(result, kg_nodes, kg_edges, aux_graphs, node_categories, category_colors)
+        elements_list, enriched2grouplist, lookup_lists = generate_elements(result, kg_nodes, kg_edges, aux_graphs, category_styles, support_index)
         lookup_basket[result] = lookup_lists
         enrichment_basket[result] = enriched2grouplist
         card_body = []
+        node_size = 10 * len(support_index['inferences'][result])
         for j, elements in enumerate(elements_list):
             card_body.append(
                 dbc.Row(
@@ -608,7 +849,8 @@ def update_elements( selected_data, selected_rows, kg_nodes, kg_edges, aux_graph
                         elements=elements,
                         style={'width': '80%', 'height': '250px', 'margin': "auto", },
                         layout={'name': 'breadthfirst', 'idealEdgeLength': 3, 'nodeRepulsion': 10, 'edgeElasticity': 0.45, 'nestingFactor': 0, 'gravity': 1, 'numIter': 1000},
-                        stylesheet=[{'selector': 'node', 'style': {'label': 'data(label)'}},
+                        stylesheet=[{'selector': 'node', 'style': {'label': 'data(label)', 'width': node_size, 'height': node_size}},
+                                    *node_stylesheet,
                                     {'selector': 'edge',
                                      'style': {'label': 'data(label)', 'width': 1, 'curve-style': 'bezier',
                                                'target-arrow-shape': 'triangle'}},
@@ -624,7 +866,7 @@ def update_elements( selected_data, selected_rows, kg_nodes, kg_edges, aux_graph
                 dbc.Card([dbc.CardHeader(
                     [
                         html.H5(f"{result} has {len(elements_list)} Paths", className="card-title"),
-                        generate_legend(node_categories, category_colors),
+                        generate_legend(category_styles),
                         html.Div(html.Marquee("Select an edge to view its support graph",
                                         style={'background-color': '#cbd3dd', 'color': '#000080', 'display': 'inline-block'}),
                                  style={'text-align': 'right'}),
@@ -646,14 +888,33 @@ def store_edge_data( edge_data ):
     return {}
 
 
+@callback(Output('node-detail-div', 'children'), Input({'type': 'cytoscape', 'index': ALL}, 'tapNodeData'), State('answerset-input', 'data'), prevent_initial_call=True)
+def display_node_detail( node_data, handle ):
+    tapped = callback_context.triggered[0]['value'] if callback_context.triggered else None
+    if not tapped:
+        raise PreventUpdate
+    indexed = answerset_state.get(handle)
+    node = indexed['kg_nodes'].get(tapped['id']) if indexed else None
+    if node is None:
+        return html.Div(f"{tapped['id']} is not in this answer set's knowledge graph")
+    attributes = [html.Div([html.B(f"{attribute.get('attribute_type_id')}: "), html.Span(str(attribute.get('value')))])
+                  for attribute in node.get('attributes') or []]
+    return html.Div([
+        html.P(f"{node.get('name', tapped['id'])} ({tapped['id']})", style={'backgroundColor': '#cbd3dd'}),
+        html.Div([html.B("categories: "), html.Span(', '.join(node.get('categories') or []))]),
+        *attributes,
+    ], style={'maxHeight': '300px', 'overflowY': 'auto', 'backgroundColor': '#f8f9fa', 'padding': '10px',
+              'border': '1px solid #ddd', 'margin-bottom': '1em'})
+
+
 @callback(Output('edge-data-table-div', 'children'), Input('stored-edge-data', 'data'), State('stored-lookup', 'data'), State('stored-enrichment', 'data'))
 def display_support_graph(edge_data, lookup_basket, enrichment_basket):
     if not edge_data:
         return html.Div()
 
-    support_graphs = edge_data.get('support_graphs', [])
+    role = edge_data.get('panel')
 
-    if not support_graphs:
+    if role is None:
         edge_data_items = [html.Div([html.B(f"{key}: "), html.Span(str(value))]) for key, value in edge_data.items()]
         edge_data_table_component = html.Div(
             edge_data_items,
@@ -667,18 +928,18 @@ def display_support_graph(edge_data, lookup_basket, enrichment_basket):
             edge_data_table_component
         ])
 
-    if isinstance(support_graphs[0], str):
+    if role == GROUP2CURIE:
         lookup_baskets = [basket for baskets in lookup_basket.values() for basket in baskets]
         lookup = pd.DataFrame(lookup_baskets, columns=["Object1", "Predicate1", "Subject1", "Predicate2", "Object2"])
         lookup.drop_duplicates(ignore_index=True, inplace=True)
         lookup_table_component = onetable(lookup, 'datatable-lookup-table')
         lookup_table_output = html.Div([html.P("LOOKUP Members ↓ ", style={'backgroundColor': '#cbd3dd'}), lookup_table_component])
         return lookup_table_output
-    elif isinstance(support_graphs[0], list):
+    elif role == ENRICHMENT2GROUP:
         enrichment_baskets = [basket for baskets in enrichment_basket.values() for basket in baskets]
         enrichment = pd.DataFrame(enrichment_baskets, columns=["Subject", "Predicate1", "Object", "Pvalue", "Knowledge_Source"])
         enrichment.drop_duplicates(ignore_index=True, inplace=True)
-        enrichment.sort_values("Pvalue", ascending=True, inplace=True)
+        enrichment.sort_values("Pvalue", key=lambda pvalues: pvalues.map(min_pvalue), inplace=True)
         enrich_table_component = onetable(enrichment, 'datatable-enrich-table')
         enrich_table_output = html.Div([html.P(f"RULE(s) ↓ for the {len(enrichment)} paths", style={'backgroundColor': '#cbd3dd'}), enrich_table_component])
         return enrich_table_output
@@ -0,0 +1,107 @@
+import logging
+import os
+from functools import reduce
+from io import StringIO
+import pandas as pd
+from src.utils import LoggingUtil
+from src.session_state import answerset_state
+from src.metrics import timed
+
+this_dir = os.path.dirname(os.path.realpath(__file__))
+
+logger = LoggingUtil.init_logging('workspace', level=logging.WARNING, format='long', logFilePath=this_dir + '/')
+
+SHARED_CANDIDATES = 'shared_candidates'
+SHARED_GROUPS = 'shared_groups'
+DIFFERENTIAL = 'differential'
+
+OPERATIONS = {
+    SHARED_CANDIDATES: 'Shared candidates',
+    SHARED_GROUPS: 'Shared enrichment groups',
+    DIFFERENTIAL: 'Differential p-values (first two sets)',
+}
+
+
+def pinned_ids(query_graph):
+    return {curie for node in query_graph["nodes"].values() for curie in (node.get("ids") or [])}
+
+
+def build_tables(bundle):
+    """ Inferred and enrichment tables of an indexed answer set, keyed by the candidate each inference is about """
+    pinned = pinned_ids(bundle['query_graph'])
+    kg_edges = bundle['kg_edges']
+    kg_nodes = bundle['kg_nodes']
+
+    inferred = pd.read_json(StringIO(bundle['inferred_df']), orient='split')
+    # the candidate is whichever end of the inferred edge the query left open
+    subjects = inferred["EdgeString"].map(lambda edge: kg_edges[edge]["subject"])
+    objects = inferred["EdgeString"].map(lambda edge: kg_edges[edge]["object"])
+    inferred["Candidate_ID"] = subjects.where(~subjects.isin(pinned), objects)
+    inferred["Candidate"] = inferred["Candidate_ID"].map(lambda curie: kg_nodes.get(curie, {}).get("name", curie))
+
+    enrichment = pd.read_json(StringIO(bundle['enrichment_df']), orient='split')
+    enrichment = enrichment.merge(inferred[["EdgeString", "Candidate_ID"]], on="EdgeString")
+    return inferred, enrichment
+
+
+def load_tables(handle):
+    """ build_tables, kept with the answer set in answerset_state """
+    tables = answerset_state.derived(handle, 'tables', build_tables,
+                                     lambda tables: sum(int(df.memory_usage(deep=True).sum()) for df in tables))
+    if tables is None:
+        raise KeyError(f"No indexed answer set for {handle}")
+    return tables
+
+
+def suffixed(df, label, keys):
+    return df.rename(columns={column: f"{column} ({label})" for column in df.columns if column not in keys})
+
+
+@timed('workspace.shared_candidates')
+def shared_candidates(answersets):
+    keys = ["Candidate_ID", "Candidate"]
+    tables = []
+    for answerset in answersets:
+        inferred, _ = load_tables(answerset['handle'])
+        # an answer set can reach a candidate through several predicates; keep its best ranked one
+        best = inferred.sort_values("Rank").drop_duplicates("Candidate_ID")
+        tables.append(suffixed(best[[*keys, "Rank", "Score", "Best_Pvalue"]], answerset['label'], keys))
+    shared = reduce(lambda left, right: left.merge(right, on=keys), tables)
+    rank_columns = [column for column in shared.columns if column.startswith("Rank (")]
+    return shared.assign(Mean_Rank=shared[rank_columns].mean(axis=1)).sort_values("Mean_Rank", ignore_index=True)
+
+
+@timed('workspace.shared_groups')
+def shared_enrichment_groups(answersets):
+    keys = ["Group_ID", "Group", "Predicate"]
+    tables = []
+    for answerset in answersets:
+        _, enrichment = load_tables(answerset['handle'])
+        groups = enrichment.groupby(keys, as_index=False).agg(Candidates=("Candidate_ID", "nunique"),
+                                                                Best_Pvalue=("Pvalue", "min"))
+        tables.append(suffixed(groups, answerset['label'], keys))
+    shared = reduce(lambda left, right: left.merge(right, on=keys), tables)
+    pvalue_columns = [column for column in shared.columns if column.startswith("Best_Pvalue (")]
+    return shared.assign(Worst_Pvalue=shared[pvalue_columns].max(axis=1)).sort_values("Worst_Pvalue", ignore_index=True)
+
+
+@timed('workspace.differential')
+def differential_pvalues(first, second):
+    keys = ["Candidate_ID", "Candidate"]
+    tables = []
+    for answerset in (first, second):
+        inferred, _ = load_tables(answerset['handle'])
+        best = inferred.sort_values("Rank").drop_duplicates("Candidate_ID")
+        tables.append(best[[*keys, "Score", "Best_Pvalue"]])
+    # an outer join so candidates that only one set found show up too, with the other side missing
+    diff = tables[0].merge(tables[1], on=keys, how="outer", suffixes=(f" ({first['label']})", f" ({second['label']})"))
+    diff["Delta_Score"] = diff[f"Score ({first['label']})"].fillna(0) - diff[f"Score ({second['label']})"].fillna(0)
+    return diff.reindex(diff["Delta_Score"].abs().sort_values(ascending=False).index).reset_index(drop=True)
+
+
+def compare(operation, answersets):
+    if operation == DIFFERENTIAL:
+        return differential_pvalues(*answersets[:2])
+    if operation == SHARED_GROUPS:
+        return shared_enrichment_groups(answersets)
+    return shared_candidates(answersets)
@@ -1,81 +1,124 @@
-import json
-from string import Template
-
-def qg_template():
-    return '''{
-        "query_graph": {
-            "nodes": {
-                "drug": {
-                    "ids": $source_id,
-                    "constraints": [],
-                    "is_set": false,
-                    "categories":  $source_category
-                },
-                "disease": {
-                    "ids": $target_id,
-                    "is_set": false,
-                    "constraints": [],
-                    "categories": $target_category
-                }
-            },
-            "edges": {
-                "e00": {
-                    "subject": "drug",
-                    "object": "disease",
-                    "predicates": $predicate,
-                    "knowledge_type": "inferred",
-                    "attribute_constraints": [],
-                    "qualifier_constraints": $qualifier
-                }
-            }
-        }
-    }'''
+import re
 
+# Query graphs are built as plain dicts, so generating thousands of them never round-trips through JSON text.
+
+ASPECT_QUALIFIER = "biolink:object_aspect_qualifier"
+DIRECTION_QUALIFIER = "biolink:object_direction_qualifier"
+
+
+def qnode( ids=None, categories=None, is_set=False, constraints=None ):
+    node = {"constraints": list(constraints or []), "is_set": is_set, "categories": as_list(categories)}
+    # unpinned nodes leave "ids" out entirely rather than sending an empty list
+    if ids:
+        node["ids"] = as_list(ids)
+    return node
+
+
+def qualifier_set( qualifiers ):
+    """ {qualifier_type_id: value} -> one TRAPI qualifier_set; empty values are skipped """
+    return {"qualifier_set": [{"qualifier_type_id": type_id, "qualifier_value": value}
+                              for type_id, value in qualifiers.items() if value]}
+
+
+def qedge( subject, object, predicates, qualifier_sets=(), knowledge_type="inferred", attribute_constraints=None ):
+    return {
+        "subject": subject,
+        "object": object,
+        "predicates": as_list(predicates),
+        "knowledge_type": knowledge_type,
+        "attribute_constraints": list(attribute_constraints or []),
+        "qualifier_constraints": [qualifiers if "qualifier_set" in qualifiers else qualifier_set(qualifiers)
+                                  for qualifiers in qualifier_sets],
+    }
+
+
+def query_message( nodes, edges, parameters=None ):
+    message = {"message": {"query_graph": {"nodes": nodes, "edges": edges}}}
+    if parameters:
+        message["parameters"] = parameters
+    return message
+
+
+def as_list( value ):
+    if not value:
+        return []
+    return [value] if isinstance(value, str) else list(value)
 
-def get_qg( curie, is_source, predicates, source_category='', target_category='', object_aspect_qualifier=None,
-            object_direction_qualifier=None ):
-    # print('curie= ', curie, '\nis_source = ', is_source, '\npredicates = ', predicates, '\nsource_category = ',
-    #       source_category, '\ntarget_category = ', target_category)
 
-    if not is_source:
-        target_ids = curie
-        source_ids = []
-    else:
-        source_ids = curie
-        target_ids = []
+def node_key( category ):
+    # biolink:PhenotypicFeature -> phenotypic_feature
+    return re.sub(r'(?<!^)(?=[A-Z])', '_', category.split(':')[-1]).lower()
 
-    source_category = [source_category] if source_category else []
-    target_category = [target_category] if target_category else []
 
-    quali = []
+class QueryTemplate:
+    """ A one-hop query shape fixed up front; build() only fills in the curies and qualifiers """
+
+    def __init__( self, subject_category, predicates, object_category, subject_key=None, object_key=None,
+                  edge_key="e00" ):
+        self.subject_category = subject_category
+        self.object_category = object_category
+        self.predicates = as_list(predicates)
+        self.subject_key = subject_key or node_key(subject_category)
+        self.object_key = object_key or node_key(object_category)
+        if self.subject_key == self.object_key:
+            self.object_key = f"{self.object_key}_2"
+        self.edge_key = edge_key
+
+    @classmethod
+    def from_pattern( cls, pattern, **keys ):
+        """ "biolink:Drug-biolink:treats-biolink:Disease" as used by the example query dropdown """
+        subject_category, predicate, object_category = pattern.split('-')
+        return cls(subject_category, predicate, object_category, **keys)
+
+    def build( self, ids, pinned="object", is_set=False, qualifier_sets=(), parameters=None ):
+        subject_ids, object_ids = (ids, None) if pinned == "subject" else (None, ids)
+        nodes = {self.subject_key: qnode(subject_ids, self.subject_category, is_set=is_set and pinned == "subject"),
+                 self.object_key: qnode(object_ids, self.object_category, is_set=is_set and pinned == "object")}
+        edges = {self.edge_key: qedge(self.subject_key, self.object_key, self.predicates, qualifier_sets)}
+        return query_message(nodes, edges, parameters)
+
+    def build_many( self, curies, pinned="object", qualifier_sets=(), parameters=None ):
+        """ One query per curie, e.g. for batch runs """
+        for curie in curies:
+            yield self.build([curie], pinned, qualifier_sets=qualifier_sets, parameters=parameters)
+
+
+def path_query( categories, predicates, ids, pinned_index, qualifier_sets=None, parameters=None ):
+    """ A linear multi-hop chain categories[0] -predicates[0]-> categories[1] -> ... with one end pinned to ids """
+    keys = []
+    for category in categories:
+        key = node_key(category) or "n"
+        keys.append(key if key not in keys else f"{key}_{len(keys)}")
+    nodes = {key: qnode(ids if index == pinned_index else None, category)
+             for index, (key, category) in enumerate(zip(keys, categories))}
+    qualifier_sets = qualifier_sets or [()] * len(predicates)
+    edges = {f"e{index:02d}": qedge(keys[index], keys[index + 1], hop_predicates, hop_qualifiers)
+             for index, (hop_predicates, hop_qualifiers) in enumerate(zip(predicates, qualifier_sets))}
+    return query_message(nodes, edges, parameters)
+
+
+EXAMPLE_QUERIES = [
+    ("What Drugs treats Disease Y eg. MONDO:0004975?", "biolink:Drug-biolink:treats-biolink:Disease"),
+    ("What Genes are genetically associated with Disease X eg. DOID:0050430?",
+     "biolink:Gene-biolink:genetically_associated_with-biolink:Disease"),
+    ("What are the Phenotypes of Disease X eg. MONDO:0005147?",
+     "biolink:Disease-biolink:has_phenotype-biolink:PhenotypicFeature"),
+    ("What are the Genes that affects Phenotype X eg. HP:0003637?",
+     "biolink:Gene-biolink:affects-biolink:PhenotypicFeature"),
+    ("What are the Phenotypes of Gene X eg. NCBIGene:122481?",
+     "biolink:Gene-biolink:has_phenotype-biolink:PhenotypicFeature"),
+]
+
+# precompiled once, keyed by the example-query-dropdown values
+EXAMPLE_TEMPLATES = {pattern: QueryTemplate.from_pattern(pattern) for _, pattern in EXAMPLE_QUERIES}
+
+
+def get_qg( curie, is_source, predicates, source_category='', target_category='', object_aspect_qualifier=None,
+            object_direction_qualifier=None ):
+    # the UI's one-hop shape, keeping the "drug"/"disease" node keys earlier answer sets were cached under
+    template = QueryTemplate(source_category, predicates, target_category, subject_key="drug", object_key="disease")
+    qualifier_sets = []
     if object_aspect_qualifier and object_direction_qualifier:
-        quali = [
-            {
-                "qualifier_set": [
-                    {
-                        "qualifier_type_id": "biolink:object_aspect_qualifier",
-                        "qualifier_value": object_aspect_qualifier
-                    },
-                    {
-                        "qualifier_type_id": "biolink:object_direction_qualifier",
-                        "qualifier_value": object_direction_qualifier
-                    }
-                ]
-            }
-        ]
-
-    query_template = Template(qg_template())
-    qs = query_template.substitute(source_id=json.dumps(source_ids), target_id=json.dumps(target_ids),
-                                   source_category=json.dumps(source_category),
-                                   target_category=json.dumps(target_category),
-                                   predicate=json.dumps(predicates), qualifier=json.dumps(quali))
-
-    query = json.loads(qs)
-    if not is_source:
-        del query["query_graph"]["nodes"]["drug"]["ids"]
-        query["query_graph"]["nodes"]["disease"]["ids"] = target_ids
-    else:
-        del query["query_graph"]["nodes"]["disease"]["ids"]
-        query["query_graph"]["nodes"]["drug"]["ids"] = source_ids
-
-    return {"message": query}
\ No newline at end of file
+        qualifier_sets.append({ASPECT_QUALIFIER: object_aspect_qualifier,
+                               DIRECTION_QUALIFIER: object_direction_qualifier})
+    return template.build(curie, "subject" if is_source else "object", qualifier_sets=qualifier_sets)
@@ -0,0 +1,68 @@
+import os
+import tempfile
+
+# before any src module is imported: job queue and caches in a scratch directory, logs to the console only
+os.environ.setdefault('EDGAR_DATA_DIR', tempfile.mkdtemp(prefix='edgar-tests-'))
+os.environ.setdefault('EDGAR_LOG_DIR', '')
+os.environ.setdefault('EDGAR_LOG_ASYNC', '0')
+
+import pytest
+
+DISEASE = 'MONDO:0004975'
+GENES = ['NCBIGene:348', 'NCBIGene:351', 'NCBIGene:4137']
+DRUG_NAMES = ['Answer compound', 'Donepezil', 'Memantine', 'Galantamine', 'Rivastigmine']
+
+
+def make_answerset(pvalues=((1e-6,), (1e-4, 1e-3), (1e-2,), (0.2, 0.03), (0.5,))):
+    """ A small AnswerCoalesce-shaped answer set: drug i treats the disease through one support graph per p-value.
+        Each support graph is drug -affects-> gene (enrichment->group, pointing at a nested graph of gene -member_of->
+        group and the group's p-valued enrichment edge) and gene -associated_with-> disease (group->curie); graph ids
+        starting with 'e' are graph enrichment """
+    nodes = {DISEASE: {'name': 'Alzheimer disease', 'categories': ['biolink:Disease'], 'attributes': []},
+             'GO:0001': {'name': 'enriched pathway', 'categories': ['biolink:Pathway'], 'attributes': []}}
+    for gene in GENES:
+        nodes[gene] = {'name': f'gene {gene[-3:]}', 'categories': ['biolink:Gene'], 'attributes': []}
+    edges, aux_graphs, results = {}, {}, []
+    for i, drug_pvalues in enumerate(pvalues):
+        drug = f'CHEBI:{i + 1}'
+        nodes[drug] = {'name': DRUG_NAMES[i % len(DRUG_NAMES)], 'categories': ['biolink:Drug'], 'attributes': []}
+        support_graphs = []
+        for k, pvalue in enumerate(drug_pvalues):
+            gene = GENES[(i + k) % len(GENES)]
+            group = f'uuid:{i}_{k}'
+            nodes[group] = {'name': f'group {i} {k}', 'categories': ['biolink:NamedThing'], 'attributes': []}
+            edges[f'member{i}_{k}'] = {'subject': gene, 'object': group, 'predicate': 'biolink:member_of',
+                                       'attributes': [], 'sources': []}
+            edges[f'enrich{i}_{k}'] = {'subject': group, 'object': 'GO:0001', 'predicate': 'biolink:affects',
+                                       'attributes': [{'attribute_type_id': 'biolink:p_value', 'value': pvalue}],
+                                       'sources': []}
+            aux_graphs[f'nested{i}_{k}'] = {'edges': [f'member{i}_{k}', f'enrich{i}_{k}']}
+            edges[f'e2g{i}_{k}'] = {'subject': drug, 'object': gene, 'predicate': 'biolink:affects',
+                                    'attributes': [{'attribute_type_id': 'biolink:support_graphs',
+                                                    'value': [f'nested{i}_{k}']}],
+                                    'sources': [{'resource_id': 'infores:answercoalesce',
+                                                 'resource_role': 'primary_knowledge_source'}]}
+            edges[f'g2c{i}_{k}'] = {'subject': gene, 'object': DISEASE,
+                                    'predicate': 'biolink:genetically_associated_with',
+                                    'attributes': [{'attribute_type_id': 'biolink:agent_type', 'value': 'manual_agent'}],
+                                    'sources': [{'resource_id': 'infores:ctd', 'resource_role': 'primary_knowledge_source'}]}
+            graph = f"{'e' if k % 2 == 0 else 'p'}_{i}_{k}"
+            aux_graphs[graph] = {'edges': [f'e2g{i}_{k}', f'g2c{i}_{k}']}
+            support_graphs.append(graph)
+        edges[f'inf{i}'] = {'subject': drug, 'object': DISEASE, 'predicate': 'biolink:treats',
+                            'attributes': [{'attribute_type_id': 'biolink:support_graphs', 'value': graph}
+                                           for graph in support_graphs],
+                            'sources': [{'resource_id': 'infores:answercoalesce',
+                                         'resource_role': 'primary_knowledge_source'}]}
+        results.append({'node_bindings': {'disease': [{'id': DISEASE}], 'drug': [{'id': drug}]},
+                        'analyses': [{'edge_bindings': {'e0': [{'id': f'inf{i}'}]}}]})
+    query_graph = {'nodes': {'drug': {'categories': ['biolink:Drug']},
+                             'disease': {'ids': [DISEASE], 'categories': ['biolink:Disease']}},
+                   'edges': {'e0': {'subject': 'drug', 'object': 'disease', 'predicates': ['biolink:treats']}}}
+    return {'message': {'query_graph': query_graph, 'knowledge_graph': {'nodes': nodes, 'edges': edges},
+                        'results': results, 'auxiliary_graphs': aux_graphs}}
+
+
+@pytest.fixture
+def answerset():
+    return make_answerset()
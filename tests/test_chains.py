@@ -0,0 +1,171 @@
+import pytest
+import src.chains
+from src.chains import join_paths, linear_path, run_chain
+from src.validation import validate_answerset
+
+DISEASE = 'MONDO:0004975'
+
+
+def node(category, ids=None):
+    return {'categories': [category], 'ids': ids} if ids else {'categories': [category]}
+
+
+def edge(subject, object):
+    return {'subject': subject, 'object': object, 'predicates': ['biolink:related_to']}
+
+
+# drug -> gene -> disease, pinned at the disease: the walk starts at the end the edges point to
+TARGET_PINNED = {'nodes': {'drug': node('biolink:Drug'), 'gene': node('biolink:Gene'),
+                           'disease': node('biolink:Disease', [DISEASE])},
+                 'edges': {'e0': edge('drug', 'gene'), 'e1': edge('gene', 'disease')}}
+# disease -> gene -> drug, pinned at the disease: the walk follows the edges
+SOURCE_PINNED = {'nodes': {'drug': node('biolink:Drug'), 'gene': node('biolink:Gene'),
+                           'disease': node('biolink:Disease', [DISEASE])},
+                 'edges': {'e1': edge('gene', 'drug'), 'e0': edge('disease', 'gene')}}
+
+
+def test_target_pinned_path_is_walked_against_the_edges():
+    assert linear_path(TARGET_PINNED) == (['disease', 'gene', 'drug'], ['e1', 'e0'])
+
+
+def test_source_pinned_path_is_walked_along_the_edges():
+    assert linear_path(SOURCE_PINNED) == (['disease', 'gene', 'drug'], ['e0', 'e1'])
+
+
+def test_mixed_directions_still_make_a_path():
+    query_graph = {'nodes': {'a': node('biolink:Gene', ['NCBIGene:348']), 'b': node('biolink:Pathway'),
+                             'c': node('biolink:Gene'), 'd': node('biolink:Drug')},
+                   'edges': {'x': edge('b', 'c'), 'y': edge('a', 'b'), 'z': edge('d', 'c')}}
+    assert linear_path(query_graph) == (['a', 'b', 'c', 'd'], ['y', 'x', 'z'])
+
+
+@pytest.mark.parametrize('nodes, edges', [
+    ({'a': node('biolink:Gene'), 'b': node('biolink:Gene')}, {'x': edge('a', 'b')}),  # nothing pinned
+    ({'a': node('biolink:Gene', ['NCBIGene:1']), 'b': node('biolink:Gene', ['NCBIGene:2'])}, {'x': edge('a', 'b')}),
+    # pinned in the middle
+    ({'a': node('biolink:Gene'), 'b': node('biolink:Gene', ['NCBIGene:2']), 'c': node('biolink:Gene')},
+     {'x': edge('a', 'b'), 'y': edge('b', 'c')}),
+    # a branch
+    ({'a': node('biolink:Gene', ['NCBIGene:1']), 'b': node('biolink:Gene'), 'c': node('biolink:Gene'),
+      'd': node('biolink:Gene')}, {'x': edge('a', 'b'), 'y': edge('b', 'c'), 'z': edge('b', 'd')}),
+    # two pieces
+    ({'a': node('biolink:Gene', ['NCBIGene:1']), 'b': node('biolink:Gene'), 'c': node('biolink:Gene'),
+      'd': node('biolink:Gene')}, {'x': edge('a', 'b'), 'y': edge('c', 'd')}),
+])
+def test_queries_that_are_not_a_pinned_path_are_refused(nodes, edges):
+    with pytest.raises(ValueError):
+        linear_path({'nodes': nodes, 'edges': edges})
+
+
+def hop_answerset(query_graph, pinned_key, pinned, ranked):
+    """ An AnswerCoalesce-shaped answer to one hop: an inference per (answer, p-value), each with one support graph """
+    (edge_key, query_edge), = query_graph['edges'].items()
+    answer_key = query_edge['object'] if pinned_key == query_edge['subject'] else query_edge['subject']
+    nodes = {pinned: {'name': pinned, 'categories': query_graph['nodes'][pinned_key]['categories'], 'attributes': []},
+             'NCBIGene:0': {'name': 'shared gene', 'categories': ['biolink:Gene'], 'attributes': []},
+             'GO:0001': {'name': 'enriched pathway', 'categories': ['biolink:Pathway'], 'attributes': []}}
+    edges, aux_graphs, results = {}, {}, []
+    for n, (answer, pvalue) in enumerate(ranked):
+        nodes[answer] = {'name': answer, 'categories': query_graph['nodes'][answer_key]['categories'], 'attributes': []}
+        nodes[f'uuid:{n}'] = {'name': f'group {n}', 'categories': ['biolink:NamedThing'], 'attributes': []}
+        edges[f'member{n}'] = {'subject': 'NCBIGene:0', 'object': f'uuid:{n}', 'predicate': 'biolink:member_of',
+                               'attributes': [], 'sources': []}
+        edges[f'enrich{n}'] = {'subject': f'uuid:{n}', 'object': 'GO:0001', 'predicate': 'biolink:affects',
+                               'attributes': [{'attribute_type_id': 'biolink:p_value', 'value': pvalue}], 'sources': []}
+        aux_graphs[f'nested{n}'] = {'edges': [f'member{n}', f'enrich{n}']}
+        sources = [{'resource_id': 'infores:answercoalesce', 'resource_role': 'primary_knowledge_source'}]
+        edges[f'e2g{n}'] = {'subject': answer, 'object': 'NCBIGene:0', 'predicate': 'biolink:affects',
+                            'attributes': [{'attribute_type_id': 'biolink:support_graphs', 'value': [f'nested{n}']}],
+                            'sources': sources}
+        edges[f'g2c{n}'] = {'subject': 'NCBIGene:0', 'object': pinned, 'predicate': 'biolink:related_to',
+                            'attributes': [{'attribute_type_id': 'biolink:agent_type', 'value': 'manual_agent'}],
+                            'sources': [{'resource_id': 'infores:ctd', 'resource_role': 'primary_knowledge_source'}]}
+        aux_graphs[f'e_{n}'] = {'edges': [f'e2g{n}', f'g2c{n}']}
+        subject, object = (pinned, answer) if pinned_key == query_edge['subject'] else (answer, pinned)
+        edges[f'inf{n}'] = {'subject': subject, 'object': object, 'predicate': 'biolink:related_to',
+                            'attributes': [{'attribute_type_id': 'biolink:support_graphs', 'value': f'e_{n}'}],
+                            'sources': sources}
+        results.append({'node_bindings': {pinned_key: [{'id': pinned}], answer_key: [{'id': answer}]},
+                        'analyses': [{'edge_bindings': {edge_key: [{'id': f'inf{n}'}]}}]})
+    return {'message': {'query_graph': query_graph, 'knowledge_graph': {'nodes': nodes, 'edges': edges},
+                        'results': results, 'auxiliary_graphs': aux_graphs}}
+
+
+# hop answers by pinned node, listed worst first so the ranking has to reorder them
+HOPS = {
+    DISEASE: [('NCBIGene:4', 0.3), ('NCBIGene:3', 0.02), ('NCBIGene:1', 1e-6), ('NCBIGene:2', 1e-4)],
+    'NCBIGene:1': [('CHEBI:11', 0.01), ('CHEBI:12', 0.001), ('CHEBI:13', 0.1)],
+    'NCBIGene:2': [('CHEBI:21', 0.04), ('CHEBI:12', 0.2)],
+    'NCBIGene:3': [('CHEBI:31', 0.01)],
+    'NCBIGene:4': [('CHEBI:41', 0.01)],
+}
+
+
+@pytest.fixture
+def asked(monkeypatch):
+    """ Stands in for AnswerCoalesce; records the pinned node of every hop query """
+    asked = []
+
+    def cached_answer(data):
+        query_graph = data['message']['query_graph']
+        pinned_key, = [key for key, node in query_graph['nodes'].items() if node.get('ids')]
+        pinned, = query_graph['nodes'][pinned_key]['ids']
+        asked.append((pinned_key, pinned))
+        return hop_answerset(query_graph, pinned_key, pinned, HOPS[pinned])
+
+    monkeypatch.setattr(src.chains, 'cached_answer', cached_answer)
+    return asked
+
+
+def bound(answerset, key):
+    return [[binding['id'] for binding in result['node_bindings'][key]][0] for result in answerset['message']['results']]
+
+
+@pytest.mark.parametrize('query_graph', [TARGET_PINNED, SOURCE_PINNED], ids=['target-pinned', 'source-pinned'])
+def test_chain_hops_start_at_the_pinned_node(asked, query_graph):
+    answerset = run_chain({'message': {'query_graph': query_graph}}, fanout=2, concurrency=1)
+    assert asked == [('disease', DISEASE), ('gene', 'NCBIGene:1'), ('gene', 'NCBIGene:2')]
+    kg_edges = answerset['message']['knowledge_graph']['edges']
+    for result in answerset['message']['results']:
+        nodes = {key: bindings[0]['id'] for key, bindings in result['node_bindings'].items()}
+        for edge_key, bindings in result['analyses'][0]['edge_bindings'].items():
+            # every bound edge joins the nodes its query edge does, in the query edge's direction
+            query_edge = query_graph['edges'][edge_key]
+            kg_edge = kg_edges[bindings[0]['id']]
+            assert (kg_edge['subject'], kg_edge['object']) == (nodes[query_edge['subject']], nodes[query_edge['object']])
+    assert validate_answerset(answerset) is None
+
+
+def test_fanout_passes_only_the_best_intermediate_nodes_on(asked):
+    answerset = run_chain({'message': {'query_graph': TARGET_PINNED}}, fanout=2)
+    # NCBIGene:3 and NCBIGene:4 rank below the fanout and are never asked about
+    assert sorted(pinned for _, pinned in asked[1:]) == ['NCBIGene:1', 'NCBIGene:2']
+    # the last hop keeps every answer, so a drug reached through both genes appears on both paths
+    assert sorted(zip(bound(answerset, 'gene'), bound(answerset, 'drug'))) == [
+        ('NCBIGene:1', 'CHEBI:11'), ('NCBIGene:1', 'CHEBI:12'), ('NCBIGene:1', 'CHEBI:13'),
+        ('NCBIGene:2', 'CHEBI:12'), ('NCBIGene:2', 'CHEBI:21')]
+    assert set(bound(answerset, 'disease')) == {DISEASE}
+
+
+def test_fanout_of_one_follows_a_single_path(asked):
+    answerset = run_chain({'message': {'query_graph': TARGET_PINNED}}, fanout=1)
+    assert asked == [('disease', DISEASE), ('gene', 'NCBIGene:1')]
+    # the answers of the last hop come out best first
+    assert bound(answerset, 'drug') == ['CHEBI:12', 'CHEBI:11', 'CHEBI:13']
+
+
+def test_join_paths_keeps_each_hop_apart():
+    first = hop_answerset({'nodes': {'disease': TARGET_PINNED['nodes']['disease'], 'gene': node('biolink:Gene')},
+                           'edges': {'e1': TARGET_PINNED['edges']['e1']}}, 'disease', DISEASE, HOPS[DISEASE][:1])
+    second = hop_answerset({'nodes': {'gene': node('biolink:Gene', ['NCBIGene:4']), 'drug': node('biolink:Drug')},
+                            'edges': {'e0': TARGET_PINNED['edges']['e0']}}, 'gene', 'NCBIGene:4', HOPS['NCBIGene:4'])
+    paths = [{'nodes': [DISEASE, 'NCBIGene:4', 'CHEBI:41'], 'edges': ['inf0_h0', 'inf0_h1']}]
+    message = join_paths(TARGET_PINNED, ['disease', 'gene', 'drug'], ['e1', 'e0'], [first, second], paths)['message']
+    # both hops name their edges inf0, nested0, ...; the hop suffix keeps them from overwriting each other
+    assert {'inf0_h0', 'inf0_h1', 'e2g0_h0', 'e2g0_h1'} <= set(message['knowledge_graph']['edges'])
+    assert message['knowledge_graph']['edges']['e2g0_h1']['attributes'][0]['value'] == ['nested0_h1']
+    assert message['auxiliary_graphs']['e_0_h0'] == {'edges': ['e2g0_h0', 'g2c0_h0']}
+    assert message['results'] == [{
+        'node_bindings': {'disease': [{'id': DISEASE}], 'gene': [{'id': 'NCBIGene:4'}], 'drug': [{'id': 'CHEBI:41'}]},
+        'analyses': [{'resource_id': 'infores:edgar', 'edge_bindings': {'e1': [{'id': 'inf0_h0'}], 'e0': [{'id': 'inf0_h1'}]}}],
+    }]
@@ -0,0 +1,72 @@
+import pytest
+from src.graph_index import GraphIndex
+
+#   A - B - C - D - E      F - G      H
+#        \_____/
+# plus an inferred edge A -> E, which paths must not take
+KG_NODES = {node: {'name': node} for node in 'ABCDEFGH'}
+KG_EDGES = {
+    'ab': {'subject': 'A', 'object': 'B'},
+    'bc': {'subject': 'B', 'object': 'C'},
+    'cd': {'subject': 'C', 'object': 'D'},
+    'bd': {'subject': 'B', 'object': 'D'},
+    'ed': {'subject': 'E', 'object': 'D'},
+    'fg': {'subject': 'F', 'object': 'G'},
+    'inferred': {'subject': 'A', 'object': 'E'},
+}
+
+
+@pytest.fixture
+def index():
+    return GraphIndex(KG_NODES, KG_EDGES, skip_edges=['inferred'])
+
+
+def test_neighborhood_grows_one_hop_at_a_time(index):
+    assert index.neighborhood('A', 1) == (['A', 'B'], ['ab'])
+    nodes, edges = index.neighborhood('A', 2)
+    assert nodes == ['A', 'B', 'C', 'D'] and edges == ['ab', 'bc', 'bd']
+    nodes, edges = index.neighborhood('A', 3)
+    assert nodes == ['A', 'B', 'C', 'D', 'E'] and edges == ['ab', 'bc', 'bd', 'ed']
+    # nothing left to reach
+    assert index.neighborhood('A', 10) == index.neighborhood('A', 3)
+
+
+def test_neighborhood_is_cut_at_the_node_limit(index):
+    nodes, edges = index.neighborhood('B', 2, limit=3)
+    assert len(nodes) == 3 and nodes[0] == 'B' and len(edges) == 2
+
+
+def test_isolated_node_has_an_empty_neighborhood(index):
+    assert index.neighborhood('H', 2) == (['H'], [])
+
+
+def test_shortest_path_walks_edges_either_way(index):
+    assert index.shortest_path('A', 'E') == (['A', 'B', 'D', 'E'], ['ab', 'bd', 'ed'])
+    assert index.shortest_path('E', 'A') == (['E', 'D', 'B', 'A'], ['ed', 'bd', 'ab'])
+    assert index.shortest_path('C', 'C') == (['C'], [])
+
+
+def test_shortest_path_between_disconnected_nodes_is_none(index):
+    assert index.shortest_path('A', 'F') is None
+    assert index.shortest_path('H', 'A') is None
+
+
+def test_shared_neighbors(index):
+    assert index.shared_neighbors(['A', 'C']) == (['A', 'C', 'B'], ['ab', 'bc'])
+    nodes, edges = index.shared_neighbors(['B', 'E'])
+    assert nodes == ['B', 'E', 'D'] and set(edges) == {'bd', 'ed'}
+    assert index.shared_neighbors(['A', 'F']) == (['A', 'F'], [])
+
+
+def test_unknown_node_raises_key_error(index):
+    with pytest.raises(KeyError, match='NCBIGene:1'):
+        index.neighborhood('NCBIGene:1')
+    with pytest.raises(KeyError):
+        index.shortest_path('A', 'NCBIGene:1')
+    with pytest.raises(KeyError):
+        index.shared_neighbors(['A', 'NCBIGene:1'])
+
+
+def test_skipped_edges_are_left_out(index):
+    assert 'inferred' not in index.edge_ids
+    assert GraphIndex(KG_NODES, KG_EDGES).shortest_path('A', 'E') == (['A', 'E'], ['inferred'])
@@ -0,0 +1,86 @@
+import pytest
+from src.inference_search import InferenceSearch, edit_distance
+from src.session_state import answerset_state
+from src.visualization import filter_table, index_answerset
+
+
+@pytest.fixture
+def indexed(answerset):
+    return index_answerset(answerset)
+
+
+@pytest.fixture
+def search(indexed):
+    return InferenceSearch(indexed['ranking_index']['order'], indexed['kg_nodes'], indexed['kg_edges'],
+                           indexed['support_index'])
+
+
+@pytest.mark.parametrize('a, b, limit, expected', [
+    ('answer', 'answer', 1, 0),
+    ('answr', 'answer', 1, 1),  # deletion
+    ('answeer', 'answer', 1, 1),  # insertion
+    ('anwser', 'answer', 1, 1),  # two neighbours swapped count once
+    ('ansewr', 'answer', 1, 1),
+    ('nswera', 'answer', 2, 2),
+    ('ca', 'abc', 2, 3),  # restricted distance: no edits inside a swapped pair
+    ('abc', 'xyz', 1, 2),  # gives up at limit + 1
+])
+def test_edit_distance(a, b, limit, expected):
+    assert edit_distance(a, b, limit) == expected
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('Donepezil', ['inf1']),  # exact, whatever the case
+    ('donep', ['inf1']),  # prefix
+    ('answr', ['inf0']),  # one letter missing
+    ('ansewr', ['inf0']),  # two letters swapped
+    ('compound answr', ['inf0']),
+])
+def test_exact_prefix_and_fuzzy_hits(search, text, expected):
+    assert search.search(text) == expected
+
+
+def test_prefix_covers_longer_words(search, indexed):
+    # every inference has an infores:answercoalesce source, and "answer" is a prefix of it
+    assert search.search('answer') == indexed['ranking_index']['order']
+
+
+def test_short_words_need_to_be_exact(search):
+    # three letters are too few to guess a typo from
+    assert search.search('anx') == []
+
+
+def test_every_word_has_to_match(search):
+    assert search.search('answr donepezil') == []
+
+
+def test_matches_come_back_in_rank_order(search, indexed):
+    order = indexed['ranking_index']['order']
+    assert search.search('alzheimer') == order
+    assert search.search('') == order
+    assert order[0] == 'inf0'
+
+
+def test_support_graph_text_is_searchable(search, indexed):
+    # NCBIGene:348 is the enriched gene of drug 0's and drug 3's first support graphs
+    found = search.search('NCBIGene:348')
+    assert set(found) == {'inf0', 'inf3'}
+    assert found == [edge for edge in indexed['ranking_index']['order'] if edge in found]
+    assert search.search('infores:ctd') == indexed['ranking_index']['order']
+
+
+def shown(handle, indexed, k=None, search_text=''):
+    table, _, count = filter_table(['graph', 'property'], k, None, search_text, indexed['inferred_df'], handle)
+    return table.data, count
+
+
+def test_count_reports_rows_shown_after_all_filters(indexed):
+    answerset_state.put('search-count', indexed)
+    rows, count = shown('search-count', indexed, search_text='alzheimer')
+    assert count == f"{len(rows)} matching inferences shown" == "5 matching inferences shown"
+    rows, count = shown('search-count', indexed, k=2, search_text='alzheimer')
+    assert count == f"{len(rows)} matching inferences shown" == "2 matching inferences shown"
+    rows, count = shown('search-count', indexed, k=2, search_text='memantine')
+    assert rows == [] and count == "0 matching inferences shown"
+    _, count = shown('search-count', indexed)
+    assert count == ''
@@ -0,0 +1,82 @@
+import math
+
+import pytest
+from src.answerset_index import build_ranking_index, fisher_combined_pvalue, threshold_cut, top_k
+
+
+def fisher(*pvalues):
+    # chi-square survival function with 2k degrees of freedom, written out term by term
+    statistic = -math.log(math.prod(pvalues))
+    return math.prod(pvalues) * sum(statistic ** i / math.factorial(i) for i in range(len(pvalues)))
+
+
+@pytest.mark.parametrize('pvalues, expected', [
+    ([0.03], 0.03),
+    ([0.5, 0.5], 0.25 * (1 - math.log(0.25))),
+    ([0.01, 0.2], 0.002 * (1 - math.log(0.002))),
+    ([0.01, 0.02, 0.3], fisher(0.01, 0.02, 0.3)),
+    ([1e-6, 1e-4, 1e-3, 0.5], fisher(1e-6, 1e-4, 1e-3, 0.5)),
+])
+def test_fisher_known_values(pvalues, expected):
+    assert fisher_combined_pvalue(pvalues) == pytest.approx(expected, rel=1e-12)
+
+
+@pytest.mark.parametrize('pvalues', [[0.03], [0.5, 0.5], [0.01, 0.02, 0.3], [1e-6, 1e-4, 1e-3, 0.5], [1e-12] * 10,
+                                     [0.9, 0.8, 0.95], [0.0, 0.5]])
+def test_fisher_matches_scipy(pvalues):
+    stats = pytest.importorskip('scipy.stats')
+    assert fisher_combined_pvalue(pvalues) == pytest.approx(stats.combine_pvalues(pvalues, method='fisher')[1],
+                                                            rel=1e-9)
+
+
+def test_fisher_edge_cases():
+    assert fisher_combined_pvalue([]) == 1.0
+    assert fisher_combined_pvalue([1.0]) == fisher_combined_pvalue([1.0, 1.0]) == 1.0
+    # a p-value of 0 settles it, as in scipy, instead of failing in log
+    assert fisher_combined_pvalue([0.0]) == fisher_combined_pvalue([0.0, 0.5]) == 0.0
+    # and a lone p-value comes back unchanged, not through exp(log(p))
+    assert fisher_combined_pvalue([0.01]) == 0.01
+    # more evidence never makes a combination less significant than its parts suggest
+    assert fisher_combined_pvalue([0.01, 0.01]) < 0.01
+
+
+def ranking(*inferences):
+    """ A ranking index over inferences given as lists of support graph p-values """
+    support_graphs, graphs = {}, {}
+    for n, pvalues in enumerate(inferences):
+        graphs[f'inf{n}'] = []
+        for k, pvalue in enumerate(pvalues):
+            support_graphs[f'e_{n}_{k}'] = {'pvalues': [] if pvalue is None else [pvalue]}
+            graphs[f'inf{n}'].append(f'e_{n}_{k}')
+    return build_ranking_index({'inferences': graphs, 'support_graphs': support_graphs})
+
+
+def test_ranking_orders_by_combined_pvalue_then_paths():
+    index = ranking([0.5], [0.01, 0.01], [0.01], [None], [0.01, 0.01])
+    assert index['order'] == ['inf1', 'inf4', 'inf2', 'inf0', 'inf3']
+    assert index['combined_pvalue'] == sorted(index['combined_pvalue'])
+    assert index['combined_pvalue'][-1] == 1.0  # no p-values at all ranks last
+
+
+def test_threshold_cut_and_top_k_on_an_empty_ranking():
+    index = ranking()
+    assert threshold_cut(index, 0.05) == [] and top_k(index, 10) == []
+
+
+def test_threshold_cut_edge_cases():
+    index = ranking([0.0], [0.01], [0.5], [1.0], [None])
+    assert index['order'][:3] == ['inf0', 'inf1', 'inf2']
+    # a threshold of 0 keeps only what had a p-value of 0
+    assert threshold_cut(index, 0) == ['inf0']
+    assert threshold_cut(index, 1e-300) == ['inf0']
+    # the cut is inclusive
+    assert threshold_cut(index, 0.01) == ['inf0', 'inf1']
+    # a threshold of 1 keeps everything, including inferences without p-values
+    assert sorted(threshold_cut(index, 1)) == ['inf0', 'inf1', 'inf2', 'inf3', 'inf4']
+
+
+def test_top_k():
+    index = ranking([0.5], [0.01], [0.2])
+    assert top_k(index, 0) == []
+    assert top_k(index, 2) == ['inf1', 'inf2']
+    assert top_k(index, 10) == ['inf1', 'inf2', 'inf0']
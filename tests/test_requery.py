@@ -0,0 +1,118 @@
+import uuid
+
+import orjson
+import pytest
+from src.answerset_index import get_inference_edges
+from src.jobs import finish_job, save_result, submit_job, RESPONSE
+from src.requery import filter_answerset, is_stricter, plan_query, query_key, DERIVE, FETCH, REUSE
+from src.validation import validate_answerset
+from tests.conftest import make_answerset
+
+
+def query(pvalue_threshold=0.05, result_length=100):
+    data = make_answerset()
+    # a query graph of its own, so the jobs other tests leave in the queue are never found
+    data['message']['query_graph']['nodes']['drug']['name'] = uuid.uuid4().hex
+    data['parameters'] = {'pvalue_threshold': pvalue_threshold, 'result_length': result_length}
+    return data
+
+
+def answered(data, saved=True):
+    handle = submit_job('answercoalesce', data, query_key(data))
+    if saved:
+        save_result(handle, RESPONSE, orjson.dumps(data))
+    finish_job(handle, {})
+    return handle
+
+
+@pytest.mark.parametrize('parameters, cached, expected', [
+    ({'pvalue_threshold': 0.01, 'result_length': 50}, {'pvalue_threshold': 0.05, 'result_length': 100}, True),
+    ({'pvalue_threshold': 0.05, 'result_length': 100}, {'pvalue_threshold': 0.05, 'result_length': 100}, True),
+    ({'pvalue_threshold': 0.1, 'result_length': 50}, {'pvalue_threshold': 0.05, 'result_length': 100}, False),
+    ({'pvalue_threshold': 0.01, 'result_length': 200}, {'pvalue_threshold': 0.05, 'result_length': 100}, False),
+    # an unbounded side can never be derived
+    ({'pvalue_threshold': 0.01}, {'pvalue_threshold': 0.05, 'result_length': 100}, False),
+    ({'pvalue_threshold': 0.01, 'result_length': 50}, {'result_length': 100}, False),
+])
+def test_is_stricter(parameters, cached, expected):
+    assert is_stricter(parameters, cached) is expected
+
+
+def test_query_key_ignores_thresholds():
+    data = query()
+    looser = dict(data, parameters={'pvalue_threshold': 0.5, 'result_length': 10})
+    assert query_key(looser) == query_key(data)
+    excluding = dict(data, parameters={'predicates_to_exclude': ['biolink:treats']})
+    assert query_key(excluding) != query_key(data)
+
+
+def test_unseen_query_is_fetched():
+    assert plan_query(query()) == (FETCH, None)
+
+
+def test_same_parameters_reuse_the_answer_set():
+    data = query()
+    handle = answered(data)
+    assert plan_query(data) == (REUSE, handle)
+
+
+def test_stricter_parameters_derive_from_the_answer_set():
+    data = query()
+    handle = answered(data)
+    stricter = dict(data, parameters={'pvalue_threshold': 0.01, 'result_length': 3})
+    assert plan_query(stricter) == (DERIVE, handle)
+
+
+def test_looser_parameters_are_fetched():
+    data = query()
+    answered(data)
+    assert plan_query(dict(data, parameters={'pvalue_threshold': 0.1, 'result_length': 100})) == (FETCH, None)
+
+
+def test_jobs_without_a_saved_response_are_skipped():
+    data = query()
+    answered(data, saved=False)
+    assert plan_query(data) == (FETCH, None)
+    handle = answered(data)
+    assert plan_query(data) == (REUSE, handle)
+
+
+def test_filter_drops_enrichment_edges_above_the_threshold():
+    # drug 1 keeps its 1e-4 graph and loses its 1e-3 one, drug 3 keeps only its 0.03 graph
+    answerset = filter_answerset(make_answerset(), 0.05, 100)
+    message = answerset['message']
+    kg_edges = message['knowledge_graph']['edges']
+    assert get_inference_edges(message['results']) == ['inf0', 'inf1', 'inf2', 'inf3']
+    assert [attribute['value'] for attribute in kg_edges['inf3']['attributes']] == ['p_3_1']
+    assert 'e_3_0' not in message['auxiliary_graphs'] and 'enrich3_0' not in kg_edges
+    assert 'CHEBI:5' not in message['knowledge_graph']['nodes'] and 'inf4' not in kg_edges
+
+    answerset = filter_answerset(make_answerset(), 1e-4, 100)
+    message = answerset['message']
+    assert get_inference_edges(message['results']) == ['inf0', 'inf1']
+    assert [attribute['value'] for attribute in message['knowledge_graph']['edges']['inf1']['attributes']] == ['e_1_0']
+
+
+def test_filter_works_per_enrichment_edge():
+    # one nested graph holding two enrichment edges, only one of them under the threshold
+    answerset = make_answerset(pvalues=((1e-4,),))
+    message = answerset['message']
+    kg_edges = message['knowledge_graph']['edges']
+    kg_edges['enrich0_0b'] = dict(kg_edges['enrich0_0'], attributes=[{'attribute_type_id': 'biolink:p_value',
+                                                                      'value': 0.2}])
+    message['auxiliary_graphs']['nested0_0']['edges'].append('enrich0_0b')
+    message = filter_answerset(answerset, 0.01, 100)['message']
+    assert message['auxiliary_graphs']['nested0_0']['edges'] == ['member0_0', 'enrich0_0']
+    assert 'enrich0_0b' not in message['knowledge_graph']['edges']
+
+
+def test_filter_truncates_to_result_length():
+    message = filter_answerset(make_answerset(), 1, 2)['message']
+    assert get_inference_edges(message['results']) == ['inf0', 'inf1']
+    assert set(message['auxiliary_graphs']) == {'e_0_0', 'nested0_0', 'e_1_0', 'p_1_1', 'nested1_0', 'nested1_1'}
+
+
+@pytest.mark.parametrize('pvalue_threshold, result_length', [(1, 100), (0.05, 100), (1e-4, 100), (0.05, 1), (1e-9, 100)])
+def test_derived_answer_set_still_validates(pvalue_threshold, result_length):
+    answerset = filter_answerset(make_answerset(), pvalue_threshold, result_length)
+    assert validate_answerset(answerset) is None
@@ -0,0 +1,96 @@
+import pytest
+from src.validation import format_report, validate_answerset, REFERENCE_ERRORS
+
+
+def test_valid_answer_set(answerset):
+    assert validate_answerset(answerset) is None
+
+
+def test_aux_graphs_may_be_null_without_inferences(answerset):
+    answerset['message'].update(results=[], auxiliary_graphs=None)
+    assert validate_answerset(answerset) is None
+
+
+@pytest.mark.parametrize('answerset, path', [
+    ([], '(root)'),
+    ({}, '(root)'),
+    ({'message': {'query_graph': {'nodes': {}, 'edges': {}}, 'knowledge_graph': {'nodes': {}, 'edges': {}},
+                  'results': []}}, 'message'),
+    ({'message': {'query_graph': {'nodes': {}}, 'knowledge_graph': {'nodes': {}, 'edges': {}}, 'results': [],
+                  'auxiliary_graphs': {}}}, 'message/query_graph'),
+    ({'message': {'query_graph': {'nodes': {}, 'edges': {}}, 'knowledge_graph': {'nodes': [], 'edges': {}},
+                  'results': [], 'auxiliary_graphs': {}}}, 'message/knowledge_graph/nodes'),
+    ({'message': {'query_graph': {'nodes': {}, 'edges': {}}, 'knowledge_graph': {'nodes': {}, 'edges': {}},
+                  'results': {}, 'auxiliary_graphs': {}}}, 'message/results'),
+])
+def test_schema_stage(answerset, path):
+    report = validate_answerset(answerset)
+    assert report['references'] == {} and report['examples'] == {}
+    assert report['schema'] and report['schema'][0].startswith(f'{path}: ')
+    assert format_report(report).startswith("The answer set does not follow the TRAPI message structure:")
+
+
+def kg_edges(message):
+    return message['knowledge_graph']['edges']
+
+
+def drop_support_graphs(message):
+    kg_edges(message)['inf2']['attributes'] = []
+
+
+def drop_group2curie(message):
+    message['auxiliary_graphs']['e_2_0']['edges'].remove('g2c2_0')
+
+
+def drop_pvalue(message):
+    kg_edges(message)['enrich2_0']['attributes'] = []
+
+
+# one way to break the fixture per kind of reference error, with the example the report gives for it
+BROKEN = [
+    ('malformed_node', lambda message: message['knowledge_graph']['nodes'].update({'GO:0001': 'pathway'}), 'GO:0001'),
+    ('malformed_edge', lambda message: kg_edges(message)['g2c0_0'].pop('predicate'), 'g2c0_0'),
+    ('malformed_attribute', lambda message: kg_edges(message)['g2c0_0']['attributes'].append({'value': 1}), 'g2c0_0'),
+    ('malformed_aux_graph', lambda message: message['auxiliary_graphs'].update({'e_0_0': {}}), 'e_0_0'),
+    ('malformed_result', lambda message: message['results'][1].update(analyses=[]), 'results[1]'),
+    ('dangling_edge_node', lambda message: kg_edges(message)['g2c0_0'].update(object='MONDO:1'), 'g2c0_0 -> MONDO:1'),
+    ('dangling_result_node', lambda message: message['results'][0]['node_bindings']['drug'][0].update(id='CHEBI:99'),
+     'CHEBI:99'),
+    ('dangling_result_edge', lambda message: message['results'][0]['analyses'][0]['edge_bindings']['e0'][0]
+     .update(id='inf99'), 'inf99'),
+    ('missing_support_graphs', drop_support_graphs, 'inf2'),
+    ('dangling_aux_graph', lambda message: message['auxiliary_graphs'].pop('e_2_0'), 'inf2 -> e_2_0'),
+    ('dangling_aux_graph', lambda message: message['auxiliary_graphs'].pop('nested2_0'), 'e2g2_0 -> nested2_0'),
+    ('dangling_aux_edge', lambda message: message['auxiliary_graphs']['e_0_0']['edges'].append('e2g9'), 'e_0_0 -> e2g9'),
+    ('incomplete_support_graph', drop_group2curie, 'e_2_0'),
+    ('missing_sources', lambda message: kg_edges(message)['e2g2_0'].update(sources=[]), 'e2g2_0'),
+    ('missing_pvalue', drop_pvalue, 'enrich2_0'),
+    ('unnamed_node', lambda message: message['knowledge_graph']['nodes']['GO:0001'].pop('name'), 'GO:0001'),
+]
+
+
+@pytest.mark.parametrize('kind, breaks, example', BROKEN, ids=[kind for kind, *_ in BROKEN])
+def test_reference_stage(answerset, kind, breaks, example):
+    breaks(answerset['message'])
+    report = validate_answerset(answerset)
+    assert report['schema'] == []
+    assert report['references'] == {kind: 1}
+    assert report['examples'] == {kind: [example]}
+    assert format_report(report) == f"The answer set has broken references:\n1 {REFERENCE_ERRORS[kind]}, e.g. {example}"
+
+
+def test_support_graphs_are_not_checked_over_broken_edges(answerset):
+    # the support graph checks would trip over the dangling edge; only the dangling edge is reported
+    drop_pvalue(answerset['message'])
+    answerset['message']['auxiliary_graphs']['e_0_0']['edges'].append('e2g9')
+    assert validate_answerset(answerset)['references'] == {'dangling_aux_edge': 1}
+
+
+def test_every_occurrence_is_counted_but_only_a_few_shown(answerset):
+    for edge in kg_edges(answerset['message']).values():
+        if edge['predicate'] == 'biolink:affects' and edge['subject'].startswith('uuid:'):
+            edge['attributes'] = []
+    report = validate_answerset(answerset)
+    assert report['references'] == {'missing_pvalue': 7}
+    assert len(report['examples']['missing_pvalue']) == 3
+    assert format_report(report).startswith("The answer set has broken references:\n7 ")